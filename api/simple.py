@@ -2,6 +2,7 @@
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.responses import JSONResponse
 import pandas as pd
+import numpy as np
 from typing import List, Optional, Union
 from google.cloud import storage
 import os
@@ -13,7 +14,14 @@ import logging
 ################
 # Use relative import of plotting functions
 from scripts.plotting import plot_market_share, plot_share_credit_modality, plot_credit_portfolio, plot_time_series
+from scripts.plotting import MARKET_SHARE_FEATURES, CREDIT_MODALITIES, CREDIT_PORTFOLIO, CREDIT_PORTFOLIO_GROUPED
 from scripts.plotting_financial_waterfall import plot_waterfall_agg, create_waterfall, filter_agg
+from scripts.concentration import concentration_metrics
+from scripts.cube import MetricCube
+from scripts.market_share import ShareTable
+from scripts.query_backend import PandasBackend, make_backend
+from scripts import data_lake
+from scripts.schema import read_report_csv
 
 
 # Add logger configuration
@@ -37,7 +45,7 @@ def get_credentials():
 
 
 def load_gcs_data(bucket_name, file_name):
-    """Load data from Google Cloud Storage"""
+    """Load data from Google Cloud Storage, as an encoded report frame (categoricals, integer AnoMes_Q)"""
     try:
         logger.info(f"Attempting to load {file_name} from bucket {bucket_name}")
 
@@ -53,8 +61,8 @@ def load_gcs_data(bucket_name, file_name):
             temp_file = f"/tmp/{file_name}"
             blob.download_to_filename(temp_file)
 
-            # Read with pandas
-            df = pd.read_csv(temp_file)
+            # Read with the repeated strings dictionary-encoded (see scripts.schema.read_report_csv)
+            df = read_report_csv(temp_file)
 
             # Clean up
             os.remove(temp_file)
@@ -71,8 +79,8 @@ def load_gcs_data(bucket_name, file_name):
             temp_file = f"/tmp/{file_name}"
             blob.download_to_filename(temp_file)
 
-            # Read with pandas
-            df = pd.read_csv(temp_file)
+            # Read with the repeated strings dictionary-encoded (see scripts.schema.read_report_csv)
+            df = read_report_csv(temp_file)
 
             # Clean up
             os.remove(temp_file)
@@ -88,23 +96,61 @@ def load_gcs_data(bucket_name, file_name):
 
 
 ################################
-# Load dataframes from GCS
-# Global variables to store dataframes
-bucket_name = 'bacen-project-data'
-try:
-    # Load main dataframes
-    df_market_metrics = load_gcs_data(bucket_name, 'market_metrics.csv')
-    credit_data_df = load_gcs_data(bucket_name, 'credit_data.csv')
-    df_fmp = load_gcs_data(bucket_name, 'financial_metrics_processed.csv')
-    financial_metrics_df = load_gcs_data(bucket_name, 'financial_metrics.csv')
+# Query backend the endpoints read their slices from (see scripts.query_backend):
+#   pandas (default): the CSVs loaded from GCS into memory
+#   sqlite: the star schema of BACEN_DB_PATH, written by the ETL
+#   duckdb: the partitioned Parquet tables of BACEN_DATA_DIR, written by the ETL
+QUERY_BACKEND = os.environ.get('BACEN_QUERY_BACKEND', 'pandas')
 
-    # Load additional credit dataframes
-    #df_cred_pf = load_gcs_data(bucket_name, 'cred_pf.csv')
-    #df_cred_pj = load_gcs_data(bucket_name, 'cred_pj.csv')
+# Directory of the ETL's metric cubes (see scripts.cube). When set, the market share and credit
+# endpoints slice the memory-mapped market_metrics and credit_data cubes instead of querying rows.
+CUBE_DIR = os.environ.get('BACEN_CUBE_DIR')
 
+# Market share table precomputed by the ETL (market_share.csv or .parquet, see scripts.market_share).
+# When set, the market share and credit modality share endpoints look their shares up in it.
+SHARE_TABLE_PATH = os.environ.get('BACEN_SHARE_TABLE')
 
+# Market concentration table of the ETL (market_concentration.csv or .parquet, see
+# scripts.concentration) served by /metrics/concentration. Without it, the concentration is
+# computed once from the share table at startup.
+CONCENTRATION_TABLE_PATH = os.environ.get('BACEN_CONCENTRATION_TABLE')
 
-    logger.info("All dataframes loaded and processed successfully")
+bucket_name = 'bacen-project-data'
+try:
+    if QUERY_BACKEND == 'pandas':
+        # Load main dataframes
+        backend = PandasBackend({
+            'market_metrics': load_gcs_data(bucket_name, 'market_metrics.csv'),
+            'credit_data': load_gcs_data(bucket_name, 'credit_data.csv'),
+            'financial_metrics_processed': load_gcs_data(bucket_name, 'financial_metrics_processed.csv'),
+            'financial_metrics': load_gcs_data(bucket_name, 'financial_metrics.csv')
+        })
+
+        # Load additional credit dataframes
+        #df_cred_pf = load_gcs_data(bucket_name, 'cred_pf.csv')
+        #df_cred_pj = load_gcs_data(bucket_name, 'cred_pj.csv')
+
+    elif QUERY_BACKEND == 'sqlite':
+        backend = make_backend('sqlite', db_path=os.environ.get('BACEN_DB_PATH', '../data/bacen_data.db'))
+    else:
+        backend = make_backend(QUERY_BACKEND, data_dir=os.environ.get('BACEN_DATA_DIR', '../data'))
+
+    logger.info(f"Query backend {QUERY_BACKEND} ready")
+
+    cubes = {}
+    if CUBE_DIR:
+        cubes = {name: MetricCube.load(os.path.join(CUBE_DIR, name)) for name in ['market_metrics', 'credit_data']}
+        logger.info(f"Metric cubes of {CUBE_DIR} ready")
+
+    share_table = ShareTable.load(SHARE_TABLE_PATH) if SHARE_TABLE_PATH else None
+
+    if CONCENTRATION_TABLE_PATH:
+        concentration_df = (data_lake.read_table(CONCENTRATION_TABLE_PATH) if data_lake.is_lake_path(CONCENTRATION_TABLE_PATH)
+                            else pd.read_csv(CONCENTRATION_TABLE_PATH, encoding='utf-8'))
+    elif share_table is not None:
+        concentration_df = concentration_metrics(share_table.table)
+    else:
+        concentration_df = None
 
 except Exception as e:
     error_msg = f"Failed to load or process dataframes: {str(e)}"
@@ -115,10 +161,10 @@ except Exception as e:
 #app = FastAPI()
 
 # Global variables to store dataframes
-#df_market_metrics = pd.read_csv('../data/market_metrics.csv')
-#credit_data_df = pd.read_csv('../data/credit_data.csv')
-#df_fmp = pd.read_csv('../data/financial_metrics_processed.csv')
-#financial_metrics_df = pd.read_csv('../data/financial_metrics.csv')
+#df_market_metrics = read_report_csv('../data/market_metrics.csv')
+#credit_data_df = read_report_csv('../data/credit_data.csv')
+#df_fmp = read_report_csv('../data/financial_metrics_processed.csv')
+#financial_metrics_df = read_report_csv('../data/financial_metrics.csv')
 
 #df_cred_pf = pd.read_csv('../data/cred_pf.csv')
 #df_cred_pj = pd.read_csv('../data/cred_pj.csv')
@@ -172,9 +218,19 @@ def get_market_share_plot(
         if custom_selected_institutions == []:
             custom_selected_institutions = None
 
+        # The precomputed shares, the cube, or rows of the feature only (every institution: the
+        # top_n are picked from them)
+        if share_table is not None:
+            df = share_table
+        elif 'market_metrics' in cubes:
+            df = cubes['market_metrics']
+        else:
+            df = backend.query('market_metrics', where={'NomeRelatorio_Grupo_Coluna': MARKET_SHARE_FEATURES[feature]},
+                               min_year=initial_year)
+
         # Call the imported function
         fig = plot_market_share(
-            df=df_market_metrics,
+            df=df,
             feature=feature,
             top_n=top_n,
             initial_year=initial_year,
@@ -216,6 +272,15 @@ def api_plot_share_credit_modality(
     ),
     show_percentage: bool = Query(default=True,description='Show percentage of total')
 ):
+    # The precomputed shares, the cube, or rows of the selected modalities only
+    if share_table is not None:
+        credit_data_df = share_table
+    elif 'credit_data' in cubes:
+        credit_data_df = cubes['credit_data']
+    else:
+        credit_data_df = backend.query('credit_data', where={'NomeRelatorio_Grupo_Coluna': [CREDIT_MODALITIES[mod] for mod in modalities]},
+                                       min_year=initial_year)
+
     fig = plot_share_credit_modality(
         credit_data_df=credit_data_df,
         modalities=modalities,
@@ -265,6 +330,18 @@ def api_plot_credit_portfolio(
     if len(select_institutions) == 1 and select_institutions[0] == "All":
         select_institutions = "All"
 
+    portfolio = list((CREDIT_PORTFOLIO_GROUPED if grouped else CREDIT_PORTFOLIO).values())
+    if 'credit_data' in cubes:
+        credit_data_df = cubes['credit_data']
+    elif select_institutions == "All":
+        # Market-wide: the backend sums the institutions, one row per quarter and modality
+        credit_data_df = backend.query('credit_data', where={'NomeRelatorio_Grupo_Coluna': portfolio},
+                                       min_year=initial_year, group_by=['AnoMes', 'AnoMes_Q', 'NomeRelatorio_Grupo_Coluna'])
+    else:
+        credit_data_df = backend.query('credit_data', where={'NomeRelatorio_Grupo_Coluna': portfolio,
+                                                             'NomeInstituicao': select_institutions},
+                                       min_year=initial_year)
+
     fig = plot_credit_portfolio(
         credit_data_df=credit_data_df,
         select_institutions=select_institutions,
@@ -298,6 +375,10 @@ def api_plot_dre_waterfall(
         internal_chart_type = chart_type_reverse[chart_type]
         internal_view_type = view_type_reverse[view_type]
 
+        # Rows of the selected institutions and quarters only
+        df_fmp = backend.query('financial_metrics_processed',
+                               where={'NomeInstituicao': institutions_list, 'AnoMes_Q': periods_list})
+
         # Call the original function with translated parameters
         fig, data = plot_waterfall_agg(
             df_fmp=df_fmp,
@@ -352,6 +433,15 @@ def get_time_series_plot(
     Generate a time series plot for financial metrics across selected institutions.
     """
     try:
+        # Rows of the metric and institutions only, from the dataset the control plots
+        financial_metrics_df, df_fmp = None, None
+        if control == "Valores Absolutos":
+            financial_metrics_df = backend.query('financial_metrics',
+                                                 where={'NomeColuna': metric_name, 'NomeInstituicao': list_institutions})
+        else:
+            df_fmp = backend.query('financial_metrics_processed',
+                                   where={'Component': metric_name, 'NomeInstituicao': list_institutions})
+
         fig, plot_data = plot_time_series(
             financial_metrics_df=financial_metrics_df,
             df_fmp=df_fmp,
@@ -366,3 +456,38 @@ def get_time_series_plot(
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+#------------------------------
+
+@app.get("/metrics/concentration")
+def get_market_concentration(
+    feature: str = Query(
+        default='Carteira de Crédito Pessoa Física',
+        description="Feature de market share ou modalidade de crédito (e.g., 'Lucro Líquido', 'Veículos PF')"
+    ),
+    initial_year: Optional[int] = Query(default=None, description='Ano inicial')
+):
+    """
+    Market concentration (HHI, CR3, CR5, CR10, Gini and number of institutions) of a market share
+    feature or credit modality, quarter by quarter.
+    """
+    if concentration_df is None:
+        raise HTTPException(status_code=503, detail="Market concentration not available (set BACEN_CONCENTRATION_TABLE or BACEN_SHARE_TABLE)")
+
+    # Features of plot_market_share come from market_metrics, modalities from credit_data
+    if feature in MARKET_SHARE_FEATURES:
+        dataset, metric = 'market_metrics', MARKET_SHARE_FEATURES[feature]
+    elif feature in CREDIT_MODALITIES:
+        dataset, metric = 'credit_data', CREDIT_MODALITIES[feature]
+    else:
+        raise HTTPException(status_code=400, detail=f"Invalid feature: {feature}")
+
+    rows = concentration_df[(concentration_df['Dataset'] == dataset) &
+                            (concentration_df['NomeRelatorio_Grupo_Coluna'] == metric)]
+    if initial_year:
+        rows = rows[rows['AnoMes_Q'].astype(str) >= f"{initial_year}Q1"]
+
+    rows = rows.drop(columns=['Dataset', 'NomeRelatorio_Grupo_Coluna', 'AnoMes']).sort_values('AnoMes_Q')
+    rows = rows.astype({'AnoMes_Q': str}).replace([np.inf, -np.inf], np.nan)
+    return {"feature": feature, "data": json.loads(rows.to_json(orient='records'))}
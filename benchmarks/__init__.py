@@ -0,0 +1,5 @@
+"""
+BACEN Insights Benchmarks
+------------------------
+Repeatable performance checks for the fetch and ETL layers, run against local data only.
+"""
@@ -0,0 +1,176 @@
+"""
+ETL scale-up benchmark suite.
+
+Writes synthetic raw IF.data files (benchmarks.synthetic_data.make_raw_reports) for the base
+number of institutions times each scale (1x, 5x, 20x by default), runs the whole ETL on them
+(combine_csv_files, transform_data, build_derived_tables, make_credit_data_df,
+process_financial_metrics2, save_to_sqlite) under the stage profiler (scripts.profiling), and
+prints the wall time, CPU time, peak RSS and rows of every builder at every scale, with the time
+growth relative to 1x (a builder whose time grows faster than the data is not scaling linearly).
+
+The results can be stored as a baseline and later runs compared with it: a builder whose time,
+memory or bytes grow beyond --tolerance at any scale is a regression (exit status 1). Baselines
+are only compared when they were made with the same data options.
+
+Run from the project root:
+    python -m benchmarks.bench_etl
+    python -m benchmarks.bench_etl --institutions 110 --periods 8 --save-baseline
+    python -m benchmarks.bench_etl --baseline benchmarks/baselines/bench_etl.json --tolerance 0.2
+    python -m benchmarks.bench_etl --frequency M --periods 24 --scales 1 5
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import pandas as pd
+
+from benchmarks.synthetic_data import make_raw_reports
+from scripts import profiling
+from scripts.etl import (
+    TRANSFORM_CHUNKSIZE,
+    build_derived_tables,
+    combine_csv_files,
+    make_credit_data_df,
+    process_financial_metrics2,
+    save_to_sqlite,
+    transform_data
+)
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "bench_etl.json")
+
+# Data options a baseline must share with the run it is compared with
+DATA_OPTIONS = ['institutions', 'periods', 'frequency', 'reports', 'columns_per_extra_report', 'max_workers', 'seed']
+
+
+def run_etl(workdir, max_workers=4):
+    """
+    Runs every ETL builder on the raw files of workdir/raw, writing the outputs to workdir, under
+    the stage profiler.
+
+    Returns:
+        dict: Run report of scripts.profiling.
+    """
+    raw_dir = os.path.join(workdir, "raw")
+    path = lambda name: os.path.join(workdir, name)
+    etl_files = {
+        'consolidated_reports': path("consolidated_cleaned.csv"),
+        'institutions': os.path.join(raw_dir, "consolidated_institutions.json"),
+        'credit_pf': path("cred_pf.csv"),
+        'credit_pj': path("cred_pj.csv"),
+        'market_metrics': path("market_metrics.csv"),
+        'financial_metrics': path("financial_metrics.csv"),
+        'financial_metrics_processed': path("financial_metrics_processed.csv")
+    }
+
+    profiling.start_run()
+    combine_csv_files(input_dir=raw_dir, output_file=path("consolidated_reports.csv"), max_workers=max_workers)
+    transform_data(input_data_path=path("consolidated_reports.csv"), output_data_path=path("consolidated_cleaned.csv"),
+                   institutions_path=etl_files['institutions'], chunksize=TRANSFORM_CHUNKSIZE)
+    tables = build_derived_tables(input_data_path=path("consolidated_cleaned.csv"), output_dir=workdir,
+                                  max_workers=max_workers)
+    make_credit_data_df(etl_files['credit_pf'], etl_files['credit_pj'], path("credit_data.csv"))
+    process_financial_metrics2(etl_files['financial_metrics'], etl_files['financial_metrics_processed'])
+    save_to_sqlite(db_path=path("bacen_data.db"), additional_files=etl_files,
+                   frames={'consolidated_reports': tables['consolidated_reports']})
+    return profiling.finish_run()
+
+
+def run_scales(args):
+    """Runs the ETL at every scale; returns {scale: run report}."""
+    reports = {}
+    for scale in args.scales:
+        with tempfile.TemporaryDirectory(prefix=f"bench_etl_{scale}x_") as workdir:
+            make_raw_reports(os.path.join(workdir, "raw"), n_institutions=args.institutions * scale,
+                             n_periods=args.periods, frequency=args.frequency, n_reports=args.reports,
+                             columns_per_extra_report=args.columns_per_extra_report, seed=args.seed)
+            reports[str(scale)] = run_etl(workdir, args.max_workers)
+    return reports
+
+
+def print_scaling(reports):
+    """Prints every top-level builder at every scale, with the time relative to the smallest scale."""
+    scales = sorted(reports, key=int)
+    stages = {scale: profiling.stages_frame(reports[scale]).set_index('stage') for scale in scales}
+    base = scales[0]
+
+    for scale in scales:
+        report = reports[scale]
+        print(f"\n{scale}x: {report['wall_s']:.2f}s wall, {report['cpu_s']:.2f}s CPU, "
+              f"peak RSS {report['peak_rss_mib']:.0f} MiB")
+        print(f"{'stage':<30}{'rows_out':>12}{'wall_s':>10}{'cpu_s':>10}{'peak_rss_mib':>14}"
+              f"{f'time vs {base}x':>14}")
+        for stage, row in stages[scale].iterrows():
+            if isinstance(row['parent'], str):
+                continue
+            base_wall = stages[base]['wall_s'].get(stage)
+            growth = f"{row['wall_s'] / base_wall:.1f}x" if base_wall else "-"
+            rows_out = "-" if pd.isna(row['rows_out']) else f"{int(row['rows_out']):,}"
+            print(f"{stage:<30}{rows_out:>12}{row['wall_s']:>10.2f}{row['cpu_s']:>10.2f}"
+                  f"{row['peak_rss_mib']:>14.0f}{growth:>14}")
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Compares the run reports of results with those of baseline, scale by scale.
+
+    Returns:
+        int: Number of regressions (None when the baseline was made with other data options).
+    """
+    if baseline['options'] != results['options']:
+        print(f"\nBaseline made with other data options ({baseline['options']}), not compared.")
+        return None
+
+    regressions = 0
+    print(f"\nRegressions against the baseline of {baseline['created_at']} (tolerance {tolerance:.0%}):")
+    for scale, report in results['runs'].items():
+        if scale not in baseline['runs']:
+            continue
+        diff = profiling.diff_reports(baseline['runs'][scale], report, tolerance)
+        for row in diff[diff['regression']].itertuples(index=False):
+            print(f"  {scale}x {row.stage:<30} {row.metric:<14} {row.old:>14,.2f} -> {row.new:>14,.2f} ({row.change:+.1%})")
+        regressions += int(diff['regression'].sum())
+    print(f"  {regressions} regression(s)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--institutions", type=int, default=100, help="Institutions at scale 1")
+    parser.add_argument("--periods", type=int, default=8)
+    parser.add_argument("--frequency", choices=["Q", "M"], default="Q", help="Quarterly or monthly periods")
+    parser.add_argument("--reports", type=int, default=None, help="Reports per institution (default all)")
+    parser.add_argument("--columns-per-extra-report", type=int, default=30)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 5, 20], help="Institution multipliers")
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline file compared with (if it exists)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Relative increase tolerated (default 0.25)")
+    args = parser.parse_args()
+
+    reports = run_scales(args)
+    results = {
+        'created_at': min(report['started_at'] for report in reports.values()),
+        'options': {option: getattr(args, option) for option in DATA_OPTIONS},
+        'runs': reports
+    }
+    print_scaling(reports)
+
+    regressions = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,175 @@
+"""
+Fetch throughput benchmark suite, run against the local OData stand-in (benchmarks.odata_stub).
+
+For every fetch mode of download_historical_data (serial, concurrent periods, concurrent pages,
+both, Parquet output) and of get_consolidated_institutions (serial, concurrent periods), reports:
+    - rows/s and requests/s
+    - retry overhead: retries sent and the share of requests that were not needed on a clean run
+
+Each mode runs in a clean scenario and in a faulty one, where the stand-in answers a share of the
+requests with 429 (with Retry-After) or 500. Every CSV mode must produce files byte-identical to
+the clean serial download.
+
+Run from the project root:
+    python -m benchmarks.bench_fetch
+    python -m benchmarks.bench_fetch --error-rate 0.1 --latency 0.1 --fixtures-dir fixtures/
+"""
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.odata_stub import ODataStubServer
+from scripts.fetch_data import download_historical_data, get_consolidated_institutions
+from scripts.http_session import make_session
+from scripts.rate_limiter import AdaptiveRateLimiter
+
+
+def _hash_dir(directory):
+    """sha256 of every downloaded CSV period file and of the consolidated institutions in directory."""
+    hashes = {}
+    for file in sorted(os.listdir(directory)):
+        if file.endswith('.csv') or file == "consolidated_institutions.json":
+            with open(os.path.join(directory, file), 'rb') as f:
+                hashes[file] = hashlib.sha256(f.read()).hexdigest()
+    return hashes
+
+
+def _run(server, fetch, rate, max_retries, **kwargs):
+    """
+    Runs fetch (download_historical_data or get_consolidated_institutions) against server
+    in a fresh output directory, with its own rate limiter and session.
+
+    Returns:
+        dict: elapsed time, rows/requests/errors served, retries and CSV hashes of the run.
+    """
+    output_dir = tempfile.mkdtemp(prefix="bench_fetch_")
+    # Fresh limiter and session per run so one run's adapted rate or warm pool does not leak into the next
+    rate_limiter = AdaptiveRateLimiter(rate=rate, burst=max(1, int(rate)), backoff_base=0.05, backoff_max=1.0)
+    before = server.stats()
+    start = time.perf_counter()
+    try:
+        fetch(output_dir=output_dir, base_url=server.base_url, rate_limiter=rate_limiter,
+              session=make_session(pool_maxsize=16), max_retries=max_retries, **kwargs)
+        elapsed = time.perf_counter() - start
+        hashes = _hash_dir(output_dir)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    after = server.stats()
+    served = {key: after[key] - before[key] for key in after}
+    return {
+        'seconds': elapsed,
+        'rows': served['rows'],
+        'requests': served['requests'],
+        'errors': served['errors'],
+        'retries': rate_limiter.stats()['retries'],
+        'hashes': hashes
+    }
+
+
+def _report(scenario, mode, result, baseline_requests):
+    extra_requests = result['requests'] - baseline_requests
+    overhead = extra_requests / baseline_requests if baseline_requests else 0.0
+    print(
+        f"{scenario:<7} {mode:<34} {result['seconds']:>7.2f}s "
+        f"{result['rows'] / result['seconds']:>10,.0f} rows/s "
+        f"{result['requests'] / result['seconds']:>7.1f} req/s "
+        f"{result['errors']:>4} errors {result['retries']:>4} retries "
+        f"{overhead:>6.1%} retry overhead"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=int, default=2, help="Number of years to download (4 quarters each)")
+    parser.add_argument("--rows", type=int, default=2500, help="Synthetic IfDataValores rows per period")
+    parser.add_argument("--institutions", type=int, default=1500, help="Synthetic IfDataCadastro records per period")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--max-page-size", type=int, default=None, help="Page size cap of the stand-in")
+    parser.add_argument("--latency", type=float, default=0.05, help="Stand-in latency per request (s)")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="Share of requests failed in the faulty scenario")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After (s) sent with injected 429s")
+    parser.add_argument("--fixtures-dir", default=None, help="Recorded fixtures (see odata_stub.record_fixtures)")
+    parser.add_argument("--rate", type=float, default=10.0, help="Initial rate limiter requests/s")
+    parser.add_argument("--max-retries", type=int, default=6)
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--pages-in-flight", type=int, default=2)
+    parser.add_argument("--max-connections-per-host", type=int, default=8)
+    parser.add_argument("--skip-parquet", action="store_true", help="Skip the Parquet mode (requires pyarrow)")
+    args = parser.parse_args()
+
+    # Keep the fetchers' progress logs out of the report
+    logging.basicConfig(level=logging.WARNING)
+
+    years = list(range(2013, 2013 + args.years))
+    months = [3, 6, 9, 12]
+    download_common = dict(years=years, months=months, page_size=args.page_size)
+    institutions_common = dict(years_list=years, months_list=months)
+    concurrency = dict(max_connections_per_host=args.max_connections_per_host)
+
+    download_modes = [
+        ("download serial", {}),
+        (f"download max_workers={args.max_workers}", dict(max_workers=args.max_workers, **concurrency)),
+        (f"download pages_in_flight={args.pages_in_flight}", dict(pages_in_flight=args.pages_in_flight, **concurrency)),
+        ("download workers + pages", dict(max_workers=args.max_workers, pages_in_flight=args.pages_in_flight,
+                                          **concurrency)),
+    ]
+    if not args.skip_parquet:
+        download_modes.append(("download workers + pages, parquet",
+                               dict(max_workers=args.max_workers, pages_in_flight=args.pages_in_flight,
+                                    output_format="parquet", **concurrency)))
+    institutions_modes = [
+        ("institutions serial", {}),
+        (f"institutions max_workers={args.max_workers}", dict(max_workers=args.max_workers)),
+    ]
+
+    scenarios = [("clean", 0.0), ("faulty", args.error_rate)]
+    baseline_requests = {}
+    serial_hashes = None
+    institutions_hashes = None
+    print(f"{len(years) * len(months)} periods, {args.rows} rows/period, page_size={args.page_size}, "
+          f"latency={args.latency}s")
+    for scenario, error_rate in scenarios:
+        server_options = dict(
+            rows_per_period=args.rows,
+            institutions_per_period=args.institutions,
+            latency=args.latency,
+            max_page_size=args.max_page_size,
+            error_rate=error_rate,
+            retry_after=args.retry_after,
+            fixtures_dir=args.fixtures_dir
+        )
+        with ODataStubServer(**server_options) as server:
+            for mode, options in download_modes:
+                result = _run(server, download_historical_data, args.rate, args.max_retries,
+                              **download_common, **options)
+                baseline_requests.setdefault(mode, result['requests'])
+                _report(scenario, mode, result, baseline_requests[mode])
+
+                if options.get('output_format') == "parquet":
+                    continue
+                if serial_hashes is None:
+                    serial_hashes = result['hashes']
+                assert result['hashes'] == serial_hashes, f"{scenario} {mode} produced different files than the clean serial download"
+
+            for mode, options in institutions_modes:
+                result = _run(server, get_consolidated_institutions, args.rate, args.max_retries,
+                              **institutions_common, **options)
+                baseline_requests.setdefault(mode, result['requests'])
+                _report(scenario, mode, result, baseline_requests[mode])
+
+                if institutions_hashes is None:
+                    institutions_hashes = result['hashes']
+                assert result['hashes'] == institutions_hashes, \
+                    f"{scenario} {mode} produced different institutions than the clean serial run"
+
+    print("CSV output of every download mode and scenario is byte-identical to the clean serial download,")
+    print("and so is the consolidated institutions file of every institutions mode.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Parity check and benchmark of the vectorized process_financial_metrics2 engine.
+
+Builds a synthetic financial_metrics.csv (benchmarks.synthetic_data -> make_financial_metrics_df)
+at today's size and at 10x the institutions, runs the previous row-by-row implementation
+(kept below as the reference) and compute_financial_metrics on the same frame, checks that
+both write byte-identical financial_metrics_processed.csv and prints the speedup.
+
+Run from the project root:
+    python -m benchmarks.bench_financial_metrics
+    python -m benchmarks.bench_financial_metrics --institutions 500 --scales 1 10 20
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic_data import make_clean_dataset
+from scripts.etl import (
+    FINANCIAL_AGGREGATION_BUCKETS,
+    FINANCIAL_COMPONENTS,
+    compute_financial_metrics,
+    filter_valid_financial_entries,
+    load_financial_metrics,
+    make_financial_metrics_df
+)
+
+
+def reference_financial_metrics(df):
+    """Row-by-row implementation process_financial_metrics2 used before the vectorized engine."""
+    df = filter_valid_financial_entries(df)
+
+    # Create separate DataFrames for clients and revenue
+    clients_df = df[df['NomeColuna'] == 'Quantidade de clientes com operações ativas'].copy()
+    revenue_df = df[df['NomeColuna'] == 'Receita Operacional'].copy()
+
+    # Convert filtered data into dictionaries for faster lookup by institution and period
+    clients_dict = clients_df.set_index(['NomeInstituicao', 'AnoMes_Q', 'AnoMes'])['Saldo'].to_dict()
+    revenue_dict = revenue_df.set_index(['NomeInstituicao', 'AnoMes_Q', 'AnoMes'])['Saldo'].to_dict()
+
+    results = []
+    for (inst, period, anomes), group in df.groupby(['NomeInstituicao', 'AnoMes_Q', 'AnoMes']):
+        metrics = group.set_index('NomeColuna')['Saldo'].to_dict()
+
+        for agg_name, components in FINANCIAL_AGGREGATION_BUCKETS.items():
+            metrics[agg_name] = sum(metrics.get(comp, 0) for comp in components)
+
+        num_clients = float(clients_dict.get((inst, period, anomes), 1))
+        receita_op = float(revenue_dict.get((inst, period, anomes), 1))
+
+        for component_type, components in FINANCIAL_COMPONENTS.items():
+            for comp in components:
+                value = float(metrics.get(comp, 0))
+                percent_revenue = (value / receita_op) * 100 if receita_op > 1 else 0
+                per_client = value / num_clients if num_clients > 1 else 0
+                results.append({
+                    'NomeInstituicao': inst,
+                    'AnoMes_Q': period,
+                    'AnoMes': anomes,
+                    'ComponentType': component_type,
+                    'Component': comp,
+                    'ValueAbsolute': value,
+                    'ValuePercentRevenue': percent_revenue,
+                    'ValuePerClient': per_client,
+                    'NumClients': num_clients,
+                    'ReceitaOperacional': receita_op
+                })
+
+    return pd.DataFrame(results)
+
+
+def _timed(engine, df):
+    start = time.perf_counter()
+    result = engine(df)
+    return time.perf_counter() - start, result
+
+
+def run(n_institutions, n_quarters, workdir, skip_reference=False):
+    """Benchmarks both engines on a synthetic dataset; returns (reference_s, vectorized_s, groups)."""
+    clean_path = os.path.join(workdir, f"clean_{n_institutions}.csv")
+    metrics_path = os.path.join(workdir, f"financial_metrics_{n_institutions}.csv")
+    make_clean_dataset(n_institutions, n_quarters).to_csv(clean_path, index=False)
+    make_financial_metrics_df(clean_path, metrics_path)
+    df = load_financial_metrics(metrics_path)
+
+    vectorized_time, vectorized = _timed(compute_financial_metrics, df)
+    groups = vectorized[['NomeInstituicao', 'AnoMes_Q', 'AnoMes']].drop_duplicates().shape[0]
+    if skip_reference:
+        return None, vectorized_time, groups
+
+    reference_time, reference = _timed(reference_financial_metrics, df)
+    # Parity: the CSV written by process_financial_metrics2 must not change
+    assert reference.to_csv(index=False) == vectorized.to_csv(index=False), \
+        f"Vectorized output differs from the reference at {n_institutions} institutions"
+    return reference_time, vectorized_time, groups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--institutions", type=int, default=150, help="Institutions at scale 1 (today's size)")
+    parser.add_argument("--quarters", type=int, default=48)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10], help="Institution multipliers")
+    parser.add_argument("--skip-reference-above", type=int, default=None,
+                        help="Only time the vectorized engine above this many institutions")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_financial_metrics_") as workdir:
+        for scale in args.scales:
+            n_institutions = args.institutions * scale
+            skip_reference = args.skip_reference_above is not None and n_institutions > args.skip_reference_above
+            reference_time, vectorized_time, groups = run(n_institutions, args.quarters, workdir, skip_reference)
+            line = f"{scale:>3}x {n_institutions:>6} institutions {groups:>8} groups  vectorized {vectorized_time:7.2f}s"
+            if reference_time is not None:
+                line += f"  row-by-row {reference_time:7.2f}s  speedup {reference_time / vectorized_time:6.1f}x  (parity ok)"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
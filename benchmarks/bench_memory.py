@@ -0,0 +1,80 @@
+"""
+Memory report of the dictionary-encoded load path (scripts.schema.read_report_csv).
+
+Builds a synthetic cleaned dataset (benchmarks.synthetic_data) and the tables the API serves from
+it (market_metrics, credit_data, financial_metrics, financial_metrics_processed), then loads each
+file with plain pd.read_csv (object strings, as before) and with read_report_csv (categoricals,
+integer AnoMes_Q) and prints the in-memory size of both. Also checks that decoding the encoded
+frame gives back the pd.read_csv frame.
+
+Run from the project root:
+    python -m benchmarks.bench_memory
+    python -m benchmarks.bench_memory --institutions 1500 --quarters 48
+"""
+import argparse
+import os
+import tempfile
+
+import pandas as pd
+
+from benchmarks.synthetic_data import make_clean_dataset
+from scripts.etl import build_derived_tables, make_credit_data_df, process_financial_metrics2
+from scripts.schema import decode_report_frame, memory_usage, read_report_csv
+
+
+API_TABLES = ['consolidated_cleaned', 'market_metrics', 'credit_data', 'financial_metrics', 'financial_metrics_processed']
+
+
+def _build_tables(n_institutions, n_quarters, workdir):
+    """Writes the cleaned dataset and the API tables to workdir; returns {table: path}."""
+    paths = {table: os.path.join(workdir, f"{table}.csv") for table in API_TABLES}
+    make_clean_dataset(n_institutions, n_quarters).to_csv(paths['consolidated_cleaned'], index=False)
+    build_derived_tables(paths['consolidated_cleaned'], workdir)
+    make_credit_data_df(os.path.join(workdir, "cred_pf.csv"), os.path.join(workdir, "cred_pj.csv"),
+                        paths['credit_data'])
+    process_financial_metrics2(paths['financial_metrics'], paths['financial_metrics_processed'])
+    return paths
+
+
+def memory_report(paths):
+    """
+    Loads every table both ways.
+
+    Returns:
+        pd.DataFrame: rows and MiB per table, before (pd.read_csv) and after (read_report_csv).
+    """
+    rows = []
+    for table, path in paths.items():
+        before = pd.read_csv(path, low_memory=False)
+        after = read_report_csv(path, low_memory=False)
+        pd.testing.assert_frame_equal(decode_report_frame(after), before, check_dtype=False)
+        rows.append({
+            'table': table,
+            'rows': len(before),
+            'before_mib': memory_usage(before) / 2**20,
+            'after_mib': memory_usage(after) / 2**20
+        })
+    report = pd.DataFrame(rows)
+    report['reduction'] = report['before_mib'] / report['after_mib']
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--institutions", type=int, default=150)
+    parser.add_argument("--quarters", type=int, default=48)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_memory_") as workdir:
+        report = memory_report(_build_tables(args.institutions, args.quarters, workdir))
+
+    for row in report.itertuples():
+        print(f"{row.table:<28} {row.rows:>9} rows  pd.read_csv {row.before_mib:8.1f} MiB  "
+              f"read_report_csv {row.after_mib:7.1f} MiB  {row.reduction:5.1f}x smaller")
+    total_before, total_after = report['before_mib'].sum(), report['after_mib'].sum()
+    print(f"{'total':<28} {report['rows'].sum():>9} rows  pd.read_csv {total_before:8.1f} MiB  "
+          f"read_report_csv {total_after:7.1f} MiB  {total_before / total_after:5.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Parity check and benchmark of the API query backends (scripts.query_backend).
+
+Builds one synthetic cleaned dataset (benchmarks.synthetic_data), runs the ETL builders on it twice,
+to CSV (loaded by the pandas backend and into SQLite by save_to_sqlite) and to partitioned Parquet
+(read by DuckDB), and sends every backend the queries the API endpoints send:
+
+    - market_metrics of one feature from a first year (plot_market_share)
+    - credit_data of several modalities (plot_share_credit_modality)
+    - credit_data summed by quarter, and of some institutions (plot_credit_portfolio)
+    - financial_metrics_processed of some institutions and quarters (plot_dre_waterfall)
+    - financial_metrics and financial_metrics_processed of one metric (plot_time_series)
+
+The SQLite and DuckDB results must be identical (same columns, order and dtypes, the ones of the
+CSV outputs) and hold the rows of the pandas backend once its categoricals are decoded. The time
+of every backend is printed.
+
+Run from the project root:
+    python -m benchmarks.bench_query_backends
+    python -m benchmarks.bench_query_backends --institutions 500 --quarters 24
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic_data import make_clean_dataset
+from scripts.etl import build_derived_tables, make_credit_data_df, process_financial_metrics2, save_to_sqlite
+from scripts.query_backend import DATASETS, make_backend
+from scripts.schema import decode_report_frame, read_report_csv
+
+
+def build_fixture(workdir, n_institutions, n_quarters):
+    """
+    Writes the API datasets of one synthetic dataset as CSV files, a SQLite database and Parquet
+    tables under workdir; returns {backend name: make_backend options}.
+    """
+    clean_path = os.path.join(workdir, "consolidated_cleaned.csv")
+    make_clean_dataset(n_institutions, n_quarters).to_csv(clean_path, index=False)
+
+    for output_format in ["csv", "parquet"]:
+        output_dir = os.path.join(workdir, output_format)
+        os.makedirs(output_dir)
+        build_derived_tables(input_data_path=clean_path, output_dir=output_dir, output_format=output_format)
+        process_financial_metrics2(os.path.join(output_dir, f"financial_metrics.{output_format}"),
+                                   os.path.join(output_dir, f"financial_metrics_processed.{output_format}"))
+
+    csv_path = lambda name: os.path.join(workdir, "csv", f"{name}.csv")
+    make_credit_data_df(csv_path("cred_pf"), csv_path("cred_pj"), csv_path("credit_data"))
+    db_path = os.path.join(workdir, "bacen_data.db")
+    save_to_sqlite(db_path=db_path, additional_files={
+        'consolidated_reports': clean_path,
+        'institutions': os.path.join(workdir, "no_institutions.json"),
+        'credit_pf': csv_path("cred_pf"),
+        'credit_pj': csv_path("cred_pj"),
+        'market_metrics': csv_path("market_metrics"),
+        'financial_metrics': csv_path("financial_metrics"),
+        'financial_metrics_processed': csv_path("financial_metrics_processed")
+    })
+
+    # The pandas backend holds the CSVs as the API loads them (read_report_csv)
+    frames = {dataset: read_report_csv(csv_path(dataset), dtype={'CodInst': str}) for dataset in DATASETS}
+    return {
+        'pandas': dict(frames=frames),
+        'sqlite': dict(db_path=db_path),
+        'duckdb': dict(data_dir=os.path.join(workdir, "parquet")),
+    }
+
+
+def api_queries(frames):
+    """(label, dataset, query kwargs) of the queries the API endpoints send, on values of the fixture."""
+    first = lambda dataset, col, n: decode_report_frame(frames[dataset][[col]])[col].drop_duplicates().head(n).tolist()
+    institutions = first('market_metrics', 'NomeInstituicao', 3)
+    metric = first('market_metrics', 'NomeRelatorio_Grupo_Coluna', 1)
+    modalities = first('credit_data', 'NomeRelatorio_Grupo_Coluna', 3)
+    quarters = first('financial_metrics_processed', 'AnoMes_Q', 2)
+    year = int(first('market_metrics', 'AnoMes', 2)[-1][:4])
+    return [
+        ("market share", 'market_metrics', dict(where={'NomeRelatorio_Grupo_Coluna': metric}, min_year=year)),
+        ("credit modalities", 'credit_data', dict(where={'NomeRelatorio_Grupo_Coluna': modalities}, min_year=year)),
+        ("credit portfolio, market", 'credit_data',
+         dict(where={'NomeRelatorio_Grupo_Coluna': modalities}, group_by=['AnoMes', 'AnoMes_Q', 'NomeRelatorio_Grupo_Coluna'])),
+        ("credit portfolio, institutions", 'credit_data',
+         dict(where={'NomeRelatorio_Grupo_Coluna': modalities, 'NomeInstituicao': institutions})),
+        ("dre waterfall", 'financial_metrics_processed',
+         dict(where={'NomeInstituicao': institutions, 'AnoMes_Q': quarters})),
+        ("time series, metric", 'financial_metrics',
+         dict(where={'NomeColuna': first('financial_metrics', 'NomeColuna', 1), 'NomeInstituicao': institutions})),
+        ("time series, component", 'financial_metrics_processed',
+         dict(where={'Component': first('financial_metrics_processed', 'Component', 1), 'NomeInstituicao': institutions})),
+    ]
+
+
+def _sorted_rows(df):
+    return df.sort_values(list(df.columns), kind='mergesort', ignore_index=True)
+
+
+def check_parity(results, label):
+    """The SQL backends give the same frame; the pandas backend the same rows once decoded."""
+    sqlite, duckdb = _sorted_rows(results['sqlite']), _sorted_rows(results['duckdb'])
+    assert list(sqlite.columns) == list(duckdb.columns), f"{label}: columns differ {list(duckdb.columns)}"
+    assert (sqlite.dtypes == duckdb.dtypes).all(), f"{label}: dtypes differ\n{pd.concat([sqlite.dtypes, duckdb.dtypes], axis=1)}"
+    pd.testing.assert_frame_equal(sqlite, duckdb, check_exact=False, obj=label)
+
+    # credit_data.csv (make_credit_data_df) stores CodInst without its zero padding
+    columns = [col for col in sqlite.columns if col != 'CodInst']
+    rows = _sorted_rows(decode_report_frame(results['pandas'])[columns])
+    assert len(rows) == len(sqlite), f"{label}: pandas backend returned {len(rows)} rows, SQL {len(sqlite)}"
+    pd.testing.assert_frame_equal(rows, _sorted_rows(sqlite[columns]), check_dtype=False, check_exact=False, obj=label)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--institutions", type=int, default=60)
+    parser.add_argument("--quarters", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of every query timed")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_query_backends_") as workdir:
+        options = build_fixture(workdir, args.institutions, args.quarters)
+        backends = {name: make_backend(name, **backend_options) for name, backend_options in options.items()}
+
+        timings = {name: 0.0 for name in backends}
+        queries = api_queries(options['pandas']['frames'])
+        for label, dataset, query in queries:
+            results = {}
+            for name, backend in backends.items():
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    results[name] = backend.query(dataset, **query)
+                timings[name] += (time.perf_counter() - start) / args.repeat
+            assert len(results['sqlite']), f"{label}: no rows, the fixture does not cover the query"
+            check_parity(results, label)
+
+    print(f"{len(queries)} API queries identical on the {', '.join(backends)} backends")
+    for name, seconds in timings.items():
+        print(f"{name:8s} {seconds * 1000:8.1f} ms per round of queries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Parity check and benchmark of the precomputed market share table (scripts.market_share).
+
+Builds a synthetic cleaned dataset (benchmarks.synthetic_data) in which some institutions skip
+quarters, derives market_metrics and credit_data, materializes the metric cubes and the share
+table, and checks, for every feature of plot_market_share and every modality of
+plot_share_credit_modality, that the ShareTable lookup gives the quarter x institution table the
+plotting functions compute from the rows:
+
+    - one feature / modality of the whole market (precomputed shares)
+    - the market without one institution (drop_nubank)
+    - several modalities summed
+    - absolute saldo instead of shares
+
+It also checks the ranks (1..n in every quarter, no institution ranked in a quarter it skipped)
+and prints the time of the row path and of the lookup.
+
+Run from the project root:
+    python -m benchmarks.bench_share_table
+    python -m benchmarks.bench_share_table --institutions 1500 --quarters 48
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic_data import make_clean_dataset
+from scripts.etl import build_derived_tables, make_metric_cubes
+from scripts.market_share import SHARE_METRICS, ShareTable, build_share_table
+
+
+def sparse_clean_dataset(n_institutions, n_quarters, seed=0):
+    """
+    make_clean_dataset with gaps: every 7th institution skips one quarter, and the last institution
+    only enters in the second half of the periods.
+    """
+    df = make_clean_dataset(n_institutions, n_quarters, seed)
+    quarters = sorted(df['AnoMes'].unique())
+    institutions = sorted(df['NomeInstituicao'].unique())
+
+    skipped = pd.Series(False, index=df.index)
+    for i, institution in enumerate(institutions[::7]):
+        skipped |= (df['NomeInstituicao'] == institution) & (df['AnoMes'] == quarters[i % len(quarters)])
+    skipped |= (df['NomeInstituicao'] == institutions[-1]) & (df['AnoMes'] < quarters[len(quarters) // 2])
+    return df[~skipped].reset_index(drop=True)
+
+
+def reference_quarterly(df, metrics, exclude_institutions=(), show_percentage=True):
+    """Quarter x institution table as plot_market_share / plot_share_credit_modality build it from rows."""
+    df = df[df['NomeRelatorio_Grupo_Coluna'].isin(metrics) & ~df['NomeInstituicao'].isin(list(exclude_institutions))]
+    df = df.assign(AnoMes_Q=pd.PeriodIndex(pd.to_datetime(df['AnoMes']), freq='Q'))
+    quarterly_data = df.groupby(['AnoMes_Q', 'NomeInstituicao'])['Saldo'].sum().reset_index()
+    if show_percentage:
+        market_total = quarterly_data.groupby('AnoMes_Q')['Saldo'].sum().reset_index()
+        quarterly_data = quarterly_data.merge(market_total, on='AnoMes_Q', suffixes=('', '_total'))
+        quarterly_data['Saldo'] = quarterly_data['Saldo'] / quarterly_data['Saldo_total'] * 100
+    return quarterly_data.pivot_table(index='AnoMes_Q', columns='NomeInstituicao', values='Saldo',
+                                      aggfunc='first').sort_index()
+
+
+def _assert_same(expected, result, label):
+    expected = expected.sort_index(axis=1)
+    assert list(expected.index.astype(str)) == list(result.index.astype(str)), f"{label}: quarters differ"
+    assert list(expected.columns) == list(result.columns), f"{label}: institutions differ"
+    assert np.allclose(expected.to_numpy(dtype=float), result.to_numpy(dtype=float), equal_nan=True), \
+        f"{label}: values differ"
+
+
+def check_ranks(table):
+    """Ranks 1..n in every dataset, metric and quarter, for the institutions with a saldo only."""
+    assert table['Saldo'].notna().all(), "Share table holds institutions without a saldo"
+    for key, group in table.groupby(['Dataset', 'NomeRelatorio_Grupo_Coluna', 'AnoMes_Q']):
+        assert sorted(group['Rank']) == list(range(1, len(group) + 1)), f"Ranks of {key} are not 1..n"
+        assert group.sort_values('Rank')['Saldo'].is_monotonic_decreasing, f"Ranks of {key} do not follow saldo"
+
+
+def run(n_institutions, n_quarters, workdir):
+    """Builds the tables and checks every feature and modality; returns (row path s, lookup s, checks)."""
+    tables = build_derived_tables(df_clean=sparse_clean_dataset(n_institutions, n_quarters), output_dir=workdir)
+    credit_data = pd.concat([tables['credit_pf'], tables['credit_pj']], ignore_index=True)
+    rows = {'market_metrics': tables['market_metrics'], 'credit_data': credit_data}
+
+    cubes = make_metric_cubes(output_dir=workdir, frames={name: tables[name] for name in
+                                                          ['market_metrics', 'credit_pf', 'credit_pj']})
+    table = build_share_table(cubes)
+    check_ranks(table)
+    share_table = ShareTable(table)
+
+    row_time, lookup_time, checks = 0.0, 0.0, 0
+    for dataset, metrics in SHARE_METRICS.items():
+        available = [metric for metric in dict.fromkeys(metrics.values())
+                     if (rows[dataset]['NomeRelatorio_Grupo_Coluna'] == metric).any()]
+        institution = sorted(rows[dataset]['NomeInstituicao'].dropna().unique())[0]
+        cases = [([metric], (), True) for metric in available]
+        cases += [([metric], (institution,), True) for metric in available[:3]]
+        cases += [(available[:3], (), True), (available[:1], (), False)]
+
+        for metric_list, excluded, show_percentage in cases:
+            start = time.perf_counter()
+            expected = reference_quarterly(rows[dataset], metric_list, excluded, show_percentage)
+            row_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            result = share_table.quarterly(dataset, metric_list, exclude_institutions=excluded,
+                                           show_percentage=show_percentage)
+            lookup_time += time.perf_counter() - start
+
+            _assert_same(expected, result, f"{dataset} {metric_list} without {excluded}")
+            checks += 1
+    return row_time, lookup_time, checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--institutions", type=int, default=150)
+    parser.add_argument("--quarters", type=int, default=12)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_share_table_") as workdir:
+        row_time, lookup_time, checks = run(args.institutions, args.quarters, workdir)
+
+    print(f"{checks} share tables identical to the row path (sparse institutions included)")
+    print(f"row path {row_time:.3f}s, share table lookup {lookup_time:.3f}s "
+          f"({row_time / lookup_time:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+Local stand-in for the BACEN Olinda IF.data OData service.
+
+Serves IfDataValores (paginated CSV) and IfDataCadastro (JSON) from recorded fixtures or,
+when no fixture exists for a period, from deterministic synthetic data. Latency, the
+maximum page size and injected 429/500 errors are configurable, so the fetch layer can be
+benchmarked and regression-tested without hitting olinda.bcb.gov.br.
+"""
+import os
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+RAW_REPORT_HEADER = "TipoInstituicao,CodInst,AnoMes,NomeRelatorio,NumeroRelatorio,Grupo,Conta,NomeColuna,DescricaoColuna,Saldo"
+
+OLINDA_BASE_URL = "https://olinda.bcb.gov.br/olinda/servico/IFDATA/versao/v1/odata"
+
+
+def make_period_rows(period, rows_per_period, tipo_instituicao=2):
+    """Deterministic synthetic IfDataValores rows (CSV lines, no newline) for one period."""
+    rows = []
+    for i in range(rows_per_period):
+        cod_inst = 10000 + i // 20
+        conta = 78180 + i % 20
+        saldo = f'"{(i * 7919) % 10000000},{i % 100:02d}"'
+        rows.append(
+            f'{tipo_instituicao},{cod_inst},{period},Resumo,1,,{conta},'
+            f'Coluna {i % 20},Descricao {i % 20},{saldo}'
+        )
+    return rows
+
+
+def make_period_institutions(period, institutions_per_period):
+    """Deterministic synthetic IfDataCadastro records for one period."""
+    return [
+        {
+            'CodInst': str(10000 + i),
+            'Data': int(period),
+            'NomeInstituicao': f"INSTITUICAO {i} {period[:4]}",
+            'DataInicioAtividade': "19900101",
+            'Tcb': "b1",
+            'Td': "12",
+            'Tc': 1,
+            'SegmentoTb': "S1",
+            'Atividade': "001",
+            'Uf': "SP",
+            'Municipio': "SAO PAULO",
+            'Sr': "S1",
+            'CodConglomeradoFinanceiro': None,
+            'CodConglomeradoPrudencial': None,
+            'CnpjInstituicaoLider': None,
+            'Situacao': "A"
+        }
+        for i in range(institutions_per_period)
+    ]
+
+
+def record_fixtures(periods, fixtures_dir, tipo_instituicao=2, relatorio="T", base_url=OLINDA_BASE_URL,
+                    page_size=10000, timeout=60):
+    """
+    Records IfDataValores (CSV) and IfDataCadastro (JSON) responses of the real API for the
+    given periods into fixtures_dir, in the layout ODataStubServer(fixtures_dir=...) reads:
+        IfDataValores_{period}.csv, IfDataCadastro_{period}.json
+    """
+    import requests
+
+    os.makedirs(fixtures_dir, exist_ok=True)
+    values_endpoint = "/IfDataValores(AnoMes=@AnoMes,TipoInstituicao=@TipoInstituicao,Relatorio=@Relatorio)"
+    for period in periods:
+        lines, skip = [], 0
+        while True:
+            response = requests.get(
+                f"{base_url}{values_endpoint}?@AnoMes={period}&@TipoInstituicao={tipo_instituicao}&@Relatorio='{relatorio}'",
+                params={"$top": page_size, "$skip": skip, "$format": "text/csv"},
+                timeout=timeout
+            )
+            response.raise_for_status()
+            page = response.text.splitlines()
+            lines = lines or page[:1]
+            if len(page) <= 1:
+                break
+            lines += page[1:]
+            skip += page_size
+        with open(os.path.join(fixtures_dir, f"IfDataValores_{period}.csv"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+        response = requests.get(
+            f"{base_url}/IfDataCadastro(AnoMes=@AnoMes)",
+            params={"@AnoMes": period, "$top": "100000", "$format": "json"},
+            timeout=timeout
+        )
+        response.raise_for_status()
+        with open(os.path.join(fixtures_dir, f"IfDataCadastro_{period}.json"), "w", encoding="utf-8") as f:
+            json.dump(response.json()['value'], f, ensure_ascii=False)
+
+
+class ODataStubServer:
+    """
+    Threaded HTTP/1.1 server answering IfDataValores and IfDataCadastro requests on 127.0.0.1.
+
+    Parameters:
+        rows_per_period (int): Synthetic IfDataValores rows per period (when no fixture exists).
+        institutions_per_period (int): Synthetic IfDataCadastro records per period.
+        latency (float): Seconds slept before answering each request.
+        max_page_size (int, optional): Cap applied to $top, like the real API's page limit. The
+            fetchers advance $skip by their own page_size, so keep it <= max_page_size.
+        error_rate (float): Probability of answering a request with an injected error. Default 0.
+        error_codes (tuple): Status codes injected, chosen at random. Default (429, 500).
+        retry_after (float, optional): Retry-After seconds sent with injected 429 responses.
+        fixtures_dir (str, optional): Directory of recorded fixtures (see record_fixtures).
+        seed (int): Seed of the error injection, for repeatable runs.
+
+    Usage:
+        with ODataStubServer(rows_per_period=2500, latency=0.05, error_rate=0.05) as server:
+            download_historical_data(..., base_url=server.base_url)
+            print(server.stats())
+    """
+
+    def __init__(
+        self,
+        rows_per_period=2500,
+        institutions_per_period=1500,
+        latency=0.05,
+        max_page_size=None,
+        error_rate=0.0,
+        error_codes=(429, 500),
+        retry_after=None,
+        fixtures_dir=None,
+        seed=0
+    ):
+        self.rows_per_period = rows_per_period
+        self.institutions_per_period = institutions_per_period
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.retry_after = retry_after
+        self.fixtures_dir = fixtures_dir
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._rows_cache = {}
+        self._counters = {'requests': 0, 'errors': 0, 'rows': 0, 'bytes': 0}
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}/olinda/servico/IFDATA/versao/v1/odata"
+
+    @property
+    def request_count(self):
+        return self.stats()['requests']
+
+    def stats(self):
+        """Counters of requests, injected errors, rows and bytes served so far."""
+        with self._lock:
+            return dict(self._counters)
+
+    def _period_rows(self, period):
+        """(header, rows) of IfDataValores for one period."""
+        with self._lock:
+            if period not in self._rows_cache:
+                fixture = self._fixture_path(f"IfDataValores_{period}.csv")
+                if fixture:
+                    with open(fixture, encoding="utf-8") as f:
+                        lines = f.read().splitlines()
+                    self._rows_cache[period] = (lines[0], lines[1:])
+                else:
+                    self._rows_cache[period] = (RAW_REPORT_HEADER, make_period_rows(period, self.rows_per_period))
+            return self._rows_cache[period]
+
+    def _period_institutions(self, period):
+        fixture = self._fixture_path(f"IfDataCadastro_{period}.json")
+        if fixture:
+            with open(fixture, encoding="utf-8") as f:
+                return json.load(f)
+        return make_period_institutions(period, self.institutions_per_period)
+
+    def _fixture_path(self, filename):
+        if self.fixtures_dir:
+            path = os.path.join(self.fixtures_dir, filename)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _injected_error(self):
+        with self._lock:
+            self._counters['requests'] += 1
+            if self.error_rate and self._random.random() < self.error_rate:
+                self._counters['errors'] += 1
+                return self._random.choice(self.error_codes)
+        return None
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 so clients can keep connections alive between pages
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, payload, content_type, headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                time.sleep(server.latency)
+
+                error_code = server._injected_error()
+                if error_code:
+                    headers = {}
+                    if error_code == 429 and server.retry_after is not None:
+                        headers["Retry-After"] = str(server.retry_after)
+                    self._send(error_code, b"injected error", "text/plain", headers)
+                    return
+
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                period = unquote(query["@AnoMes"][0])
+                top = int(query.get("$top", ["1000"])[0])
+                skip = int(query.get("$skip", ["0"])[0])
+                if server.max_page_size:
+                    top = min(top, server.max_page_size)
+
+                if "IfDataCadastro" in url.path:
+                    records = server._period_institutions(period)[skip:skip + top]
+                    payload = json.dumps({'value': records}, ensure_ascii=False).encode("utf-8")
+                    content_type = "application/json; charset=utf-8"
+                    rows = len(records)
+                else:
+                    header, period_rows = server._period_rows(period)
+                    page = period_rows[skip:skip + top]
+                    payload = ("\n".join([header] + page) + "\n").encode("utf-8")
+                    content_type = "text/csv; charset=utf-8"
+                    rows = len(page)
+
+                with server._lock:
+                    server._counters['rows'] += rows
+                    server._counters['bytes'] += len(payload)
+                self._send(200, payload, content_type)
+
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
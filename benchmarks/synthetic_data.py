@@ -0,0 +1,271 @@
+"""
+Synthetic IF.data datasets for the ETL benchmarks.
+
+make_clean_dataset builds a frame shaped like transform_data's consolidated_cleaned.csv, with
+the reports and NomeColuna values the derived-table builders and process_financial_metrics2
+look for, and every credit modality of the credit charts (scripts.plotting), for any number of
+institutions and quarters.
+
+make_raw_reports writes what download_historical_data and get_consolidated_institutions leave in
+data/: one data_<AnoMes>_Tipo2_RelatorioT.csv per period (raw columns, Saldo with a decimal comma)
+and consolidated_institutions.json, for any number of institutions, periods (quarterly or
+monthly) and reports, so the whole ETL can be run at sizes we do not have yet.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from scripts.plotting import CREDIT_MODALITIES, CREDIT_PORTFOLIO, CREDIT_PORTFOLIO_GROUPED
+
+
+# Credit reports read by make_cred_pf_df (11) and make_cred_pj_df (13, 14): NomeRelatorio -> NumeroRelatorio
+CREDIT_REPORTS = {
+    'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento': 11,
+    'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento': 13,
+    'Carteira de crédito ativa Pessoa Jurídica - por porte do tomador': 14,
+}
+
+
+def credit_report_layout():
+    """
+    REPORT_LAYOUT entries of the credit reports, with every NomeRelatorio_Grupo_Coluna the credit
+    charts ask for (CREDIT_MODALITIES, CREDIT_PORTFOLIO, CREDIT_PORTFOLIO_GROUPED), and the borrower
+    sizes of the Pessoa Jurídica report.
+    """
+    lines = {(name, 'nagroup'): ['Micro', 'Pequena', 'Média', 'Grande']
+             for name, number in CREDIT_REPORTS.items() if number == 14}
+    for metric in {**CREDIT_MODALITIES, **CREDIT_PORTFOLIO, **CREDIT_PORTFOLIO_GROUPED}.values():
+        name, group, column = metric.split('_', 2)
+        columns = lines.setdefault((name, group), [])
+        if column not in columns:
+            columns.append(column)
+    return sorted((CREDIT_REPORTS[name], name, group, columns) for (name, group), columns in lines.items())
+
+
+# (NumeroRelatorio, NomeRelatorio, Grupo, [NomeColuna, ...]) reported by every institution
+REPORT_LAYOUT = [
+    (1, 'Resumo', 'nagroup', [
+        'Ativo Total', 'Carteira de Crédito Classificada', 'Passivo Circulante e Exigível a Longo Prazo e Resultados de Exercícios Futuros',
+        'Captações', 'Patrimônio Líquido', 'Lucro Líquido', 'Número de Agências', 'Número de Postos de Atendimento'
+    ]),
+    (4, 'Demonstração de Resultado', 'Resultado de Intermediação Financeira - Receitas de Intermediação Financeira', [
+        'Rendas de Operações de Crédito \n(a1)',
+        'Rendas de Operações de Arrendamento Mercantil \n(a2)',
+        'Rendas de Operações com TVM \n(a3)',
+        'Rendas de Operações com Instrumentos Financeiros Derivativos \n(a4)',
+        'Resultado de Operações de Câmbio \n(a5)',
+        'Rendas de Aplicações Compulsórias \n(a6)',
+        'Receitas de Intermediação Financeira \n(a) = (a1) + (a2) + (a3) + (a4) + (a5) + (a6)'
+    ]),
+    (4, 'Demonstração de Resultado', 'Resultado de Intermediação Financeira - Despesas de Intermediação Financeira', [
+        'Despesas de Captação \n(b1)',
+        'Despesas de Obrigações por Empréstimos e Repasses \n(b2)',
+        'Despesas de Operações de Arrendamento Mercantil \n(b3)',
+        'Resultado de Operações de Câmbio \n(b4)',
+        'Resultado de Provisão para Créditos de Difícil Liquidação \n(b5)',
+        'Despesas de Intermediação Financeira \n(b) = (b1) + (b2) + (b3) + (b4) + (b5)',
+        'Resultado de Intermediação Financeira \n(c) = (a) + (b)'
+    ]),
+    (4, 'Demonstração de Resultado', 'Outras Receitas/Despesas Operacionais', [
+        'Rendas de Prestação de Serviços \n(d1)',
+        'Rendas de Tarifas Bancárias \n(d2)',
+        'Despesas de Pessoal \n(d3)',
+        'Despesas Administrativas \n(d4)',
+        'Despesas Tributárias \n(d5)',
+        'Outras Receitas Operacionais \n(d7)',
+        'Outras Despesas Operacionais \n(d8)'
+    ]),
+    (4, 'Demonstração de Resultado', 'Lucro Líquido', [
+        'Lucro Líquido \n(j) = (g) + (h) + (i)'
+    ]),
+    (10, 'Carteira de crédito ativa - quantidade de clientes e de operações', 'nagroup', [
+        'Quantidade de clientes com operações ativas', 'Quantidade de operações ativas'
+    ]),
+    *credit_report_layout(),
+]
+
+# Reports the ETL builders do not read, added by make_raw_reports to reach the width of the real
+# files: (NumeroRelatorio, NomeRelatorio)
+EXTRA_REPORTS = [
+    (2, 'Ativo'),
+    (3, 'Passivo'),
+    (5, 'Informações de Capital'),
+    (6, 'Segmentação'),
+    (7, 'Carteira de crédito ativa - por indexador'),
+    (8, 'Carteira de crédito ativa - por nível de risco da operação'),
+    (9, 'Carteira de crédito ativa - por região geográfica'),
+    (12, 'Carteira de crédito ativa Pessoa Jurídica - por atividade econômica (CNAE)'),
+]
+
+RAW_COLUMNS = [
+    'TipoInstituicao', 'CodInst', 'AnoMes', 'NomeRelatorio', 'NumeroRelatorio', 'Grupo', 'Conta',
+    'NomeColuna', 'DescricaoColuna', 'Saldo'
+]
+
+CLEAN_COLUMNS = [
+    'TipoInstituicao', 'CodInst', 'AnoMes', 'NomeRelatorio', 'NumeroRelatorio', 'Grupo', 'Conta',
+    'NomeColuna', 'DescricaoColuna', 'Saldo', 'AnoMes_M', 'AnoMes_Q', 'AnoMes_Y',
+    'NomeRelatorio_Grupo_Coluna', 'NomeInstituicao'
+]
+
+
+def quarters(n_quarters, last_year=2024):
+    """The n_quarters most recent quarter-end months up to December of last_year, as 'YYYYMM'."""
+    months = [f"{year}{month:02d}" for year in range(last_year - n_quarters // 4 - 1, last_year + 1)
+              for month in (3, 6, 9, 12)]
+    return months[-n_quarters:]
+
+
+def periods(n_periods, frequency="Q", last_year=2024):
+    """The n_periods most recent quarter-end ("Q") or month-end ("M") months up to December of last_year."""
+    if frequency == "Q":
+        return quarters(n_periods, last_year)
+    if frequency == "M":
+        months = [f"{year}{month:02d}" for year in range(last_year - n_periods // 12 - 1, last_year + 1)
+                  for month in range(1, 13)]
+        return months[-n_periods:]
+    raise ValueError(f"Invalid frequency: {frequency}")
+
+
+def raw_report_layout(n_reports=None, columns_per_extra_report=30):
+    """
+    Lines (NumeroRelatorio, NomeRelatorio, Grupo, NomeColuna) every institution reports: the reports
+    of REPORT_LAYOUT, then EXTRA_REPORTS with columns_per_extra_report generic lines each, up to
+    n_reports reports in total (default all of them).
+    """
+    reports = {}
+    for number, name, group, columns in REPORT_LAYOUT:
+        reports.setdefault((number, name), []).extend((group, column) for column in columns)
+    for number, name in EXTRA_REPORTS:
+        reports[(number, name)] = [('nagroup', f"{name} - Linha {line:02d}") for line in range(columns_per_extra_report)]
+    reports = list(reports.items())[:n_reports]
+    return [(number, name, group, column) for (number, name), lines in reports for group, column in lines]
+
+
+def make_clean_dataset(n_institutions=200, n_quarters=48, seed=0):
+    """
+    Synthetic cleaned dataset (as read back from consolidated_cleaned.csv) with one row per
+    institution, quarter and NomeColuna of REPORT_LAYOUT. Saldo values are random but
+    reproducible for a given seed; a few institutions report no clients so the
+    "insufficient revenue/clients" filters have something to drop.
+    """
+    rng = np.random.default_rng(seed)
+    layout = [(number, name, group, column) for number, name, group, columns in REPORT_LAYOUT for column in columns]
+    periods = pd.to_datetime(quarters(n_quarters), format='%Y%m')
+
+    n_rows_per_inst = len(layout)
+    inst = np.repeat(np.arange(n_institutions), n_rows_per_inst)
+    line = np.tile(np.arange(n_rows_per_inst), n_institutions)
+
+    frames = []
+    for period in periods:
+        saldo = np.round(rng.lognormal(mean=12, sigma=2, size=len(inst)), 2)
+        # Roughly 5% of the institutions without active clients
+        no_clients = rng.random(n_institutions) < 0.05
+        clients_line = [i for i, row in enumerate(layout) if row[3] == 'Quantidade de clientes com operações ativas'][0]
+        saldo[(line == clients_line) & no_clients[inst]] = 0.0
+
+        frames.append(pd.DataFrame({
+            'TipoInstituicao': 2,
+            'CodInst': [f"{10000 + i:08d}" for i in inst],
+            'AnoMes': period.strftime('%Y-%m-%d'),
+            'NomeRelatorio': [layout[j][1] for j in line],
+            'NumeroRelatorio': [layout[j][0] for j in line],
+            'Grupo': [layout[j][2] for j in line],
+            'Conta': 78000 + line,
+            'NomeColuna': [layout[j][3] for j in line],
+            'DescricaoColuna': [f"Descrição {layout[j][3]}" for j in line],
+            'Saldo': saldo,
+            'AnoMes_M': str(period.to_period('M')),
+            'AnoMes_Q': str(period.to_period('Q')),
+            'AnoMes_Y': str(period.to_period('Y')),
+            'NomeRelatorio_Grupo_Coluna': [f"{layout[j][1]}_{layout[j][2]}_{layout[j][3]}" for j in line],
+            'NomeInstituicao': [f"INSTITUICAO {i:05d}" for i in inst]
+        }, columns=CLEAN_COLUMNS))
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def make_raw_reports(output_dir, n_institutions=200, n_periods=8, frequency="Q", n_reports=None,
+                     columns_per_extra_report=30, seed=0):
+    """
+    Writes synthetic raw IF.data files to output_dir, in the layout the ETL reads:
+        data_<AnoMes>_Tipo2_RelatorioT.csv   one per period, raw columns, Saldo as "1234,56"
+        consolidated_institutions.json       CodInst -> NomeInstituicao
+
+    The data looks like the real files where it matters for the ETL: institution sizes are skewed
+    (a few large ones hold most of the balances), about 10% of the institutions start reporting
+    after the first period, the smaller ones skip the Pessoa Jurídica report, some Saldo values are
+    empty and some lines are delivered twice. Each period has its own random stream, so adding
+    periods does not change the files of the others.
+
+    Parameters:
+        output_dir (str): Directory of the files (created if missing).
+        n_institutions (int): Institutions of the registry.
+        n_periods (int): Number of periods, ending in December 2024.
+        frequency (str): "Q" (quarters, as IF.data publishes) or "M" (months).
+        n_reports (int, optional): Reports per institution (see raw_report_layout). Default all.
+        columns_per_extra_report (int): Lines of each report outside REPORT_LAYOUT.
+        seed (int): Random seed.
+
+    Returns:
+        list: Paths of the period files.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    layout = raw_report_layout(n_reports, columns_per_extra_report)
+    period_list = periods(n_periods, frequency)
+
+    # Fixed traits of every institution
+    rng = np.random.default_rng(seed)
+    cod_inst = np.array([f"{10000000 + i}" for i in range(n_institutions)])
+    size = rng.pareto(1.2, n_institutions) + 1
+    first_period = np.where(rng.random(n_institutions) < 0.10, rng.integers(0, len(period_list), n_institutions), 0)
+    small = size < np.quantile(size, 0.4)
+
+    numbers = np.array([row[0] for row in layout])
+    line_frame = pd.DataFrame({
+        'NomeRelatorio': [row[1] for row in layout],
+        'NumeroRelatorio': numbers,
+        # Lines without group come with an empty Grupo, which transform_data turns into 'nagroup'
+        'Grupo': [None if row[2] == 'nagroup' else row[2] for row in layout],
+        'Conta': 78000 + np.arange(len(layout)),
+        'NomeColuna': [row[3] for row in layout],
+        'DescricaoColuna': [f"Descrição {row[3]}" for row in layout],
+    })
+
+    paths = []
+    for period_index, period in enumerate(period_list):
+        period_rng = np.random.default_rng([seed, period_index])
+        institutions = np.flatnonzero(first_period <= period_index)
+        inst = np.repeat(institutions, len(layout))
+        line = np.tile(np.arange(len(layout)), len(institutions))
+
+        # Smaller institutions have no Pessoa Jurídica credit
+        keep = ~(small[inst] & np.isin(numbers[line], [13, 14]))
+        inst, line = inst[keep], line[keep]
+
+        saldo = np.round(size[inst] * period_rng.lognormal(mean=11, sigma=1.5, size=len(inst)), 2)
+        saldo_text = pd.Series(saldo).map("{:.2f}".format).str.replace(".", ",", regex=False)
+        saldo_text[period_rng.random(len(inst)) < 0.02] = None
+
+        df = line_frame.iloc[line].reset_index(drop=True)
+        df.insert(0, 'TipoInstituicao', 2)
+        df.insert(1, 'CodInst', cod_inst[inst])
+        df.insert(2, 'AnoMes', int(period))
+        df['Saldo'] = saldo_text.to_numpy()
+
+        # A few lines delivered twice (overlapping pages), dropped by combine_csv_files
+        duplicates = df.sample(frac=0.005, random_state=int(period_rng.integers(2**31)))
+        df = pd.concat([df, duplicates], ignore_index=True)[RAW_COLUMNS]
+
+        path = os.path.join(output_dir, f"data_{period}_Tipo2_RelatorioT.csv")
+        df.to_csv(path, index=False, encoding='utf-8')
+        paths.append(path)
+
+    institutions = [{'CodInst': int(code), 'NomeInstituicao': f"INSTITUICAO {i:05d}"} for i, code in enumerate(cod_inst)]
+    with open(os.path.join(output_dir, "consolidated_institutions.json"), "w", encoding="utf-8") as f:
+        json.dump(institutions, f, ensure_ascii=False)
+
+    return paths
@@ -21,11 +21,13 @@ from .etl import (
     make_cred_pf_df,
     make_cred_pj_df,
     make_market_metrics_df,
+    build_derived_tables,
     save_to_sqlite
 )
 
 from .fetch_data import (
     download_historical_data,
+    schedule_downloads,
     get_consolidated_institutions
 )
 
@@ -42,9 +44,11 @@ __all__ = [
     'make_cred_pf_df',
     'make_cred_pj_df',
     'make_market_metrics_df',
+    'build_derived_tables',
     'save_to_sqlite',
 
     # Data fetching functions
     'download_historical_data',
+    'schedule_downloads',
     'get_consolidated_institutions'
 ]
@@ -0,0 +1,108 @@
+"""
+Content-hash change detection between the raw period files and the ETL outputs.
+
+download_historical_data records a sha256 for every complete period file in
+download_manifest.json. The ETL keeps the hashes it last processed in its own state file,
+so a run only needs to touch the periods whose hash is new or different.
+"""
+import os
+import re
+import hashlib
+
+from scripts.manifest import Manifest
+
+
+# Manifest written by download_historical_data next to the raw period files
+DOWNLOAD_MANIFEST = "download_manifest.json"
+
+# Default ETL state file, next to the ETL outputs
+ETL_STATE = "../data/etl_state.json"
+
+_PERIOD_FILE_PATTERN = re.compile(r"^data_(\d{6})_Tipo2_RelatorioT\.(csv|parquet)$")
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """sha256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _raw_period_files(input_dir, input_format):
+    """{period: path} of the raw period files of input_dir in the given format."""
+    if input_format == "parquet":
+        parquet_dir = os.path.join(input_dir, "parquet")
+        candidates = []
+        if os.path.isdir(parquet_dir):
+            for partition in os.listdir(parquet_dir):
+                partition_dir = os.path.join(parquet_dir, partition)
+                if os.path.isdir(partition_dir):
+                    candidates += [os.path.join(partition_dir, file) for file in os.listdir(partition_dir)]
+    else:
+        candidates = [os.path.join(input_dir, file) for file in os.listdir(input_dir)]
+
+    files = {}
+    for path in candidates:
+        match = _PERIOD_FILE_PATTERN.match(os.path.basename(path))
+        if match and match.group(2) == input_format:
+            files[match.group(1)] = path
+    return files
+
+
+def raw_period_hashes(input_dir="../data/data_raw_reports", input_format="csv"):
+    """
+    Returns {period: sha256} for every raw period file in input_dir.
+
+    Hashes come from the download manifest when its entry is complete and matches the file
+    size and modification time; files downloaded without a manifest entry (or edited since)
+    are hashed directly.
+    """
+    manifest = Manifest(os.path.join(input_dir, DOWNLOAD_MANIFEST))
+    hashes = {}
+    for period, path in _raw_period_files(input_dir, input_format).items():
+        entry = manifest.get(os.path.basename(path), {})
+        stat = os.stat(path)
+        if (entry.get("complete") and entry.get("sha256")
+                and entry.get("bytes") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns):
+            hashes[period] = entry["sha256"]
+        else:
+            hashes[period] = file_sha256(path)
+    return hashes
+
+
+def changed_periods(input_dir="../data/data_raw_reports", state_path=ETL_STATE, input_format="csv"):
+    """
+    Returns the sorted list of periods whose raw file is new or has a different hash than
+    the one recorded by the last successful ETL run (every period if there is no state yet).
+    """
+    processed = Manifest(state_path).get("processed_hashes", {})
+    current = raw_period_hashes(input_dir, input_format)
+    return sorted(period for period, sha in current.items() if processed.get(period) != sha)
+
+
+def processed_periods(state_path=ETL_STATE):
+    """Set of periods (YYYYMM) already in the ETL outputs, according to the last successful run."""
+    return set(Manifest(state_path).get("processed_hashes", {}))
+
+
+def input_changed(name, path, state_path=ETL_STATE):
+    """True if the file at path (an ETL input other than the raw periods, e.g. the institutions
+    registry) is different from the one the last successful run processed under name."""
+    processed = Manifest(state_path).get("input_hashes", {})
+    return not os.path.exists(path) or processed.get(name) != file_sha256(path)
+
+
+def mark_input_processed(name, path, state_path=ETL_STATE):
+    """Records the current hash of the input file at path under name."""
+    Manifest(state_path).update("input_hashes", **{name: file_sha256(path)})
+
+
+def mark_periods_processed(periods, input_dir="../data/data_raw_reports", state_path=ETL_STATE, input_format="csv"):
+    """Records the current hashes of periods as processed; call once every ETL stage has succeeded."""
+    state = Manifest(state_path)
+    processed = state.get("processed_hashes", {})
+    current = raw_period_hashes(input_dir, input_format)
+    processed.update({period: current[period] for period in periods if period in current})
+    state.update("processed_hashes", **processed)
@@ -0,0 +1,73 @@
+"""
+Market concentration of every market share feature and credit modality, quarter by quarter.
+
+Computed from the precomputed market share table (scripts.market_share), whose rows already hold
+each institution's saldo, share and rank in its quarter, so every (dataset, metric, quarter) is
+reduced in one grouped pass:
+
+    Institutions   institutions with a saldo in the quarter
+    HHI            Herfindahl-Hirschman index, sum of the squared shares in percent (0 to 10,000)
+    CR3/CR5/CR10   share (%) held by the 3, 5 and 10 largest institutions
+    Gini           Gini coefficient of the institutions' saldo (0 = equal, 1 = one institution)
+
+Metrics that can be negative (e.g. Lucro Líquido) give shares outside 0-100 and an HHI and Gini
+that are only comparable between quarters of the same metric.
+
+The ETL writes the table as market_concentration.csv (or .parquet), keyed by the AnoMes of the
+last month of each quarter, so an incremental run only recomputes the quarters it received.
+"""
+import numpy as np
+
+from scripts.schema import period_keys
+
+
+# Top-k concentration ratios computed (CR3, CR5, CR10)
+CONCENTRATION_RATIOS = [3, 5, 10]
+
+GROUP_COLUMNS = ['Dataset', 'NomeRelatorio_Grupo_Coluna', 'AnoMes_Q', 'AnoMes']
+
+
+def quarter_end_periods(periods):
+    """AnoMes (YYYYMM) of the last month of the quarters of periods, the keys of the share tables."""
+    return sorted({int(period) // 100 * 100 + ((int(period) % 100 - 1) // 3 + 1) * 3 for period in periods})
+
+
+def concentration_metrics(share_df, periods=None):
+    """
+    Concentration of every dataset, metric and quarter of a market share table.
+
+    Parameters:
+        share_df (pd.DataFrame): Market share table (see scripts.market_share.build_share_table).
+        periods (iterable, optional): Only the quarters of these AnoMes (YYYYMM). Default every quarter.
+
+    Returns:
+        pd.DataFrame: GROUP_COLUMNS plus Institutions, HHI, CR3, CR5, CR10 and Gini, one row per
+            dataset, metric and quarter.
+    """
+    if periods is not None:
+        share_df = share_df[period_keys(share_df['AnoMes']).isin(quarter_end_periods(periods))]
+
+    saldo = share_df['Saldo'].to_numpy(dtype='float64')
+    share = share_df['Share'].to_numpy(dtype='float64')
+    rank = share_df['Rank'].to_numpy(dtype='int64')
+
+    # Per-row terms, summed by quarter in a single groupby
+    groups = share_df[GROUP_COLUMNS].assign(
+        Institutions=1,
+        Saldo=saldo,
+        HHI=share ** 2,
+        # Rank 1 is the largest saldo: weight of the ascending-order position in the Gini formula
+        _rank_saldo=rank * saldo,
+        **{f"CR{k}": np.where(rank <= k, share, 0.0) for k in CONCENTRATION_RATIOS}
+    )
+    sums = groups.groupby(GROUP_COLUMNS, sort=True, observed=True).sum().reset_index()
+
+    # Gini = 2 * sum(i * x_i) / (n * sum(x)) - (n + 1) / n with x ascending (i = n + 1 - rank)
+    n = sums['Institutions'].to_numpy(dtype='float64')
+    total = sums['Saldo'].to_numpy(dtype='float64')
+    ascending_weighted = (n + 1) * total - sums['_rank_saldo'].to_numpy(dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sums['Gini'] = 2 * ascending_weighted / (n * total) - (n + 1) / n
+
+    columns = GROUP_COLUMNS + ['Institutions', 'HHI'] + [f"CR{k}" for k in CONCENTRATION_RATIOS] + ['Gini']
+    return sums[columns]
@@ -0,0 +1,274 @@
+"""
+Dense institution x period x metric cubes of the ETL outputs, stored as memory-mapped NumPy files.
+
+The consumers of the long-format tables keep re-deriving the same shape from rows: the market share
+and credit plots group by quarter and institution and pivot, for every request. A MetricCube holds
+that shape once: one float64 array per value column ("layer") indexed by integer institution, period
+and metric ids, with NaN where an institution did not report a metric in a period (the mask of the
+rows that exist), and sidecar label arrays mapping the ids back to names.
+
+Saved cubes are directories of .npy files:
+
+    cubes/market_metrics/cube.json         layers, metric columns, shape
+    cubes/market_metrics/Saldo.npy         float64 (institutions, periods, metrics), one per layer
+    cubes/market_metrics/institutions.npy  NomeInstituicao of every institution id (sorted)
+    cubes/market_metrics/periods.npy       AnoMes (YYYYMM) of every period id (sorted)
+    cubes/market_metrics/metric_<col>.npy  metric column values of every metric id
+
+MetricCube.load opens the layers with np.load(mmap_mode='r'): nothing is read until a slice is
+used, and the pages of a slice are shared by every process that maps the file.
+
+The ETL writes the cubes of CUBES (see scripts.etl.make_metric_cubes); plot_market_share accepts
+the market_metrics cube in place of the market_metrics rows, and plot_share_credit_modality and
+plot_credit_portfolio the credit_data cube in place of the credit_data rows.
+"""
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from scripts.schema import concat_categorical, period_keys
+
+
+# Cube name -> tables it is built from, metric columns (one metric per distinct combination) and
+# value columns (one layer each)
+CUBES = {
+    'market_metrics': {
+        'tables': ['market_metrics'],
+        'metric_columns': ['NomeRelatorio_Grupo_Coluna'],
+        'value_columns': ['Saldo'],
+    },
+    # Kept apart from market_metrics, which repeats the PF and PJ portfolio totals
+    'credit_data': {
+        'tables': ['credit_pf', 'credit_pj'],
+        'metric_columns': ['NomeRelatorio_Grupo_Coluna'],
+        'value_columns': ['Saldo'],
+    },
+    'financial_metrics': {
+        'tables': ['financial_metrics'],
+        'metric_columns': ['NomeColuna'],
+        'value_columns': ['Saldo'],
+    },
+    'financial_metrics_processed': {
+        'tables': ['financial_metrics_processed'],
+        'metric_columns': ['ComponentType', 'Component'],
+        'value_columns': ['ValueAbsolute', 'ValuePercentRevenue', 'ValuePerClient'],
+    },
+}
+
+INSTITUTION_COLUMN = 'NomeInstituicao'
+PERIOD_COLUMN = 'AnoMes'
+
+# Label of the institution holding the rows without NomeInstituicao (CodInst missing from the
+# institutions registry): they count in market-wide totals but are never a column of their own
+UNNAMED_INSTITUTION = ''
+
+
+def _factorize(values):
+    """(codes, sorted uniques) of a column; missing values get code -1."""
+    codes, uniques = pd.factorize(values, sort=True)
+    return codes, np.asarray(uniques)
+
+
+class MetricCube:
+    """
+    Dense institution x period x metric arrays with their labels.
+
+    Parameters:
+        layers (dict): {value column: array of shape (institutions, periods, metrics)}.
+        institutions (array): Institution name of every institution id.
+        periods (array): AnoMes (YYYYMM int) of every period id.
+        metrics (pd.DataFrame): Metric columns of every metric id (one row per metric).
+    """
+
+    def __init__(self, layers, institutions, periods, metrics):
+        self.layers = layers
+        self.institutions = np.asarray(institutions)
+        self.periods = np.asarray(periods, dtype='int64')
+        self.metrics = metrics.reset_index(drop=True)
+        self._institution_ids = {name: i for i, name in enumerate(self.institutions)}
+        self._metric_ids = {key: i for i, key in enumerate(self.metrics.itertuples(index=False, name=None))}
+
+    @property
+    def shape(self):
+        return (len(self.institutions), len(self.periods), len(self.metrics))
+
+    #------------------------------------------------------------------------
+    # Building and storage
+
+    @classmethod
+    def from_frame(cls, df, metric_columns, value_columns, institution_column=INSTITUTION_COLUMN,
+                   period_column=PERIOD_COLUMN):
+        """
+        Builds a cube from long-format rows. Rows of the same institution, period and metric are
+        summed (as the plots' groupby does); cells without rows are NaN. Rows without an
+        institution name go to the UNNAMED_INSTITUTION.
+        """
+        inst_codes, institutions = _factorize(df[institution_column])
+        if (inst_codes < 0).any():
+            inst_codes = np.where(inst_codes < 0, len(institutions), inst_codes)
+            institutions = np.append(institutions.astype(str), UNNAMED_INSTITUTION)
+        period_codes, period_values = _factorize(df[period_column])
+        # Parsed once per distinct period; sorted again as YYYYMM whatever the format of AnoMes
+        period_ints = period_keys(pd.Series(period_values)).to_numpy(dtype='int64') if len(period_values) else \
+            np.array([], dtype='int64')
+        periods, period_positions = np.unique(period_ints, return_inverse=True)
+        period_codes = np.where(period_codes >= 0, period_positions[period_codes], -1)
+
+        metric_frame = df[metric_columns].astype(object)
+        metric_codes, metric_keys = pd.MultiIndex.from_frame(metric_frame).factorize(sort=True)
+        metrics = pd.DataFrame(list(metric_keys), columns=metric_columns)
+
+        shape = (len(institutions), len(periods), len(metrics))
+        valid = (inst_codes >= 0) & (period_codes >= 0) & (metric_codes >= 0)
+        flat = np.ravel_multi_index((inst_codes[valid], period_codes[valid], metric_codes[valid]), shape) \
+            if valid.any() else np.array([], dtype='int64')
+        size = int(np.prod(shape))
+
+        layers = {}
+        for col in value_columns:
+            values = df[col].to_numpy(dtype='float64', na_value=np.nan)[valid]
+            present = ~np.isnan(values)
+            sums = np.bincount(flat[present], weights=values[present], minlength=size)
+            counts = np.bincount(flat[present], minlength=size)
+            layers[col] = np.where(counts > 0, sums, np.nan).reshape(shape)
+
+        return cls(layers, institutions.astype(str), periods, metrics)
+
+    def save(self, path):
+        """
+        Writes the cube to the directory path, replacing the previous one only once every file is
+        written (readers that mapped the old files keep them until they close).
+        """
+        tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+        os.makedirs(tmp_path)
+        for name, values in self.layers.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(values, dtype='float64'))
+        np.save(os.path.join(tmp_path, "institutions.npy"), self.institutions.astype(str))
+        np.save(os.path.join(tmp_path, "periods.npy"), self.periods)
+        for col in self.metrics.columns:
+            np.save(os.path.join(tmp_path, f"metric_{col}.npy"), self.metrics[col].to_numpy(dtype=str))
+        with open(os.path.join(tmp_path, "cube.json"), "w", encoding="utf-8") as f:
+            json.dump({'layers': list(self.layers), 'metric_columns': list(self.metrics.columns),
+                       'shape': list(self.shape)}, f, ensure_ascii=False, indent=2)
+
+        old_path = f"{path}.old-{uuid.uuid4().hex}"
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Opens a saved cube; layers are memory-mapped (mmap_mode=None reads them into memory)."""
+        with open(os.path.join(path, "cube.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        layers = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in meta['layers']}
+        metrics = pd.DataFrame({col: np.load(os.path.join(path, f"metric_{col}.npy"))
+                                for col in meta['metric_columns']})
+        return cls(layers, np.load(os.path.join(path, "institutions.npy")),
+                   np.load(os.path.join(path, "periods.npy")), metrics)
+
+    #------------------------------------------------------------------------
+    # Lookups and slices
+
+    def institution_ids(self, names):
+        """Ids of the given institutions (names the cube does not have are skipped)."""
+        return np.array([self._institution_ids[name] for name in names if name in self._institution_ids], dtype='int64')
+
+    def period_ids(self, min_year=None):
+        """Ids of the periods from min_year on (every period by default)."""
+        if min_year is None:
+            return np.arange(len(self.periods))
+        return np.flatnonzero(self.periods >= int(min_year) * 100)
+
+    def metric_ids(self, labels):
+        """
+        Ids of the given metrics: values of the metric column, or tuples of the metric columns when
+        the cube has several. Metrics the cube does not have are skipped.
+        """
+        keys = [label if isinstance(label, tuple) else (label,) for label in labels]
+        return np.array([self._metric_ids[key] for key in keys if key in self._metric_ids], dtype='int64')
+
+    def slice(self, layer, institutions=None, periods=None, metrics=None):
+        """
+        Values of a layer for the given institution, period and metric ids (None: all of them), as a
+        (institutions, periods, metrics) array. NaN marks the cells without data.
+        """
+        values = self.layers[layer]
+        index = tuple(slice(None) if ids is None else np.asarray(ids) for ids in (institutions, periods, metrics))
+        # One fancy index at a time, so each selection keeps its own axis
+        for axis, ids in enumerate(index):
+            if not isinstance(ids, slice):
+                values = np.take(values, ids, axis=axis)
+        return np.asarray(values)
+
+    def quarterly(self, layer='Saldo', metrics=None, by=INSTITUTION_COLUMN, institutions=None,
+                  exclude_institutions=(), min_year=None):
+        """
+        Quarter x institution (by='NomeInstituicao') or quarter x metric (by=a metric column) table
+        of a layer summed over the other axis, as the plots' groupby(['AnoMes_Q', by]).sum() and
+        pivot_table produce it: quarters (and columns) without any data are left out, missing cells
+        are NaN.
+
+        Parameters:
+            metrics (list, optional): Metrics summed (see metric_ids). Default every metric.
+            institutions (list, optional): Only these institutions. Default every institution.
+            exclude_institutions (iterable): Institutions left out.
+            min_year (int, optional): Only the periods from this year on.
+        """
+        inst_ids = np.arange(len(self.institutions)) if institutions is None else self.institution_ids(institutions)
+        if exclude_institutions:
+            inst_ids = np.setdiff1d(inst_ids, self.institution_ids(exclude_institutions))
+        if by == INSTITUTION_COLUMN:
+            # As grouping rows by NomeInstituicao, which leaves out the missing names
+            inst_ids = inst_ids[self.institutions[inst_ids] != UNNAMED_INSTITUTION]
+        metric_ids = np.arange(len(self.metrics)) if metrics is None else self.metric_ids(metrics)
+        period_ids = self.period_ids(min_year)
+        values = self.slice(layer, inst_ids, period_ids, metric_ids)
+
+        if by == INSTITUTION_COLUMN:
+            axis, columns = 2, pd.Index(self.institutions[inst_ids], name=by)
+        else:
+            axis, columns = 0, pd.Index(self.metrics[by].to_numpy()[metric_ids], name=by)
+        present = ~np.isnan(values)
+        totals = np.where(present.any(axis=axis), np.nansum(values, axis=axis), np.nan)
+        # (periods, columns), whichever axis was summed
+        table = totals.T if axis == 2 else totals
+
+        quarters = pd.PeriodIndex(pd.to_datetime(self.periods[period_ids].astype(str), format='%Y%m'), freq='Q')
+        df = pd.DataFrame(table, index=pd.Index(quarters, name='AnoMes_Q'), columns=columns)
+        # Months of the same quarter (monthly data) are summed, as grouping rows by AnoMes_Q does;
+        # several metrics with the same column value are summed too
+        df = df.T.groupby(level=0, sort=True).sum(min_count=1).T
+        df = df.groupby(level=0, sort=True).sum(min_count=1)
+        return df.dropna(how='all').dropna(axis=1, how='all')
+
+
+def build_cubes(tables, output_dir="../data/cubes", cubes=None):
+    """
+    Builds and saves the cubes of CUBES whose tables are all given.
+
+    Parameters:
+        tables (dict): {table name: long-format DataFrame} (e.g. the ETL outputs).
+        output_dir (str): Directory of the cube directories.
+        cubes (list, optional): Names of the cubes to build. Default every cube of CUBES.
+
+    Returns:
+        dict: {cube name: MetricCube} of the cubes written.
+    """
+    built = {}
+    for name in cubes or CUBES:
+        spec = CUBES[name]
+        if not all(table in tables for table in spec['tables']):
+            continue
+        key_columns = [INSTITUTION_COLUMN, PERIOD_COLUMN, *spec['metric_columns']]
+        frames = [tables[table][key_columns + spec['value_columns']].copy() for table in spec['tables']]
+        df = frames[0] if len(frames) == 1 else concat_categorical(frames, columns=key_columns)
+        cube = MetricCube.from_frame(df, spec['metric_columns'], spec['value_columns'])
+        cube.save(os.path.join(output_dir, name))
+        built[name] = cube
+    return built
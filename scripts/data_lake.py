@@ -0,0 +1,182 @@
+"""
+Partitioned Parquet storage for the ETL outputs (alternative to the CSV intermediates).
+
+Each table is a directory of zstd-compressed Parquet files partitioned Hive-style by period
+and, when the table has one, by report number:
+
+    consolidated_cleaned.parquet/Periodo=202403/NumeroRelatorio=4/part-<uuid>-0.parquet
+
+Columns keep their types (floats, ints, dates as written by the ETL) and repeated strings such
+as NomeRelatorio_Grupo_Coluna are dictionary-encoded by the writer, so files are a fraction of
+the CSVs. Rows are sorted by metric inside each partition and written in small row groups, so
+reading one quarter touches one partition directory and reading one metric skips the row
+groups whose min/max statistics exclude it.
+
+The ETL uses this layer for any output path ending in ".parquet" (see scripts.etl).
+"""
+import os
+import shutil
+import uuid
+
+import pandas as pd
+
+from scripts.schema import period_keys
+
+
+# Partition column derived from AnoMes (YYYYMM)
+PERIOD_COLUMN = "Periodo"
+
+# Column the rows are sorted by inside each partition, first one present wins
+METRIC_COLUMNS = ['NomeRelatorio_Grupo_Coluna', 'NomeColuna', 'Component']
+
+# Rows per row group: small enough for metric pruning inside a quarter/report partition
+ROW_GROUP_SIZE = 16_384
+
+
+def is_lake_path(path):
+    """True for the paths stored as a partitioned Parquet table (suffix .parquet)."""
+    return str(path).endswith(".parquet")
+
+
+def as_stored(df):
+    """
+    df with the dtypes read_table returns for it: categoricals come back as plain values and
+    periods (AnoMes_M, AnoMes_Q, AnoMes_Y) as their string form, as in the CSV outputs. Columns
+    mixing numbers and strings (Conta of financial_metrics: account codes and 'Calculated') are
+    stored as strings, the way read_csv reads them back.
+    """
+    conversions = {}
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            conversions[col] = object
+        elif isinstance(df[col].dtype, pd.PeriodDtype):
+            conversions[col] = str
+    df = df.astype(conversions) if conversions else df
+
+    mixed = [col for col in df.columns if df[col].dtype == object
+             and pd.api.types.infer_dtype(df[col], skipna=True).startswith('mixed')]
+    if mixed:
+        df = df.assign(**{col: df[col].where(df[col].isna(), df[col].astype(str)) for col in mixed})
+    return df
+
+
+def _partition_columns(df):
+    return [PERIOD_COLUMN] + (['NumeroRelatorio'] if 'NumeroRelatorio' in df.columns else [])
+
+
+def write_table(df, path, periods=None, compression="zstd", row_group_size=ROW_GROUP_SIZE):
+    """
+    Writes df as a partitioned Parquet table.
+
+    Parameters:
+        df (pd.DataFrame): Rows to write; must have an AnoMes column.
+        path (str): Table directory.
+        periods (iterable, optional): Incremental mode: df only holds these AnoMes (YYYYMM), whose
+            partitions are replaced; the other partitions are left untouched. Default None
+            replaces the whole table.
+        compression (str): Parquet codec. Default "zstd".
+        row_group_size (int): Maximum rows per row group.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    df = as_stored(df).assign(**{PERIOD_COLUMN: period_keys(df['AnoMes']).astype('int64')})
+    partition_columns = _partition_columns(df)
+
+    # Rows of a metric next to each other, so row-group statistics can skip the others
+    sort_columns = partition_columns + [col for col in METRIC_COLUMNS if col in df.columns][:1]
+    df = df.sort_values(sort_columns, kind='mergesort')
+
+    # Drop what is being replaced
+    if periods is None:
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        for period in periods:
+            shutil.rmtree(os.path.join(path, f"{PERIOD_COLUMN}={int(period)}"), ignore_errors=True)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # All-null columns of a partition are stored as strings, the type they have elsewhere
+    table = table.cast(pa.schema([
+        pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field
+        for field in table.schema
+    ], metadata=table.schema.metadata))
+
+    ds.write_dataset(
+        table,
+        path,
+        format="parquet",
+        partitioning=partition_columns,
+        partitioning_flavor="hive",
+        file_options=ds.ParquetFileFormat().make_write_options(compression=compression),
+        max_rows_per_group=row_group_size,
+        min_rows_per_group=min(row_group_size, 1024),
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore"
+    )
+
+
+def _dataset(path, expression=None):
+    """
+    Dataset over every partition, with the schemas of the files matching expression unified
+    (int/float, null/string). Only the footers of those files are read.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    schemas = [fragment.physical_schema for fragment in dataset.get_fragments(filter=expression)]
+    if not schemas:
+        return dataset
+    schema = pa.unify_schemas(schemas + [dataset.partitioning.schema], promote_options="permissive")
+    return ds.dataset(path, format="parquet", partitioning="hive", schema=schema)
+
+
+def read_table(path, columns=None, periods=None, where=None):
+    """
+    Reads a partitioned Parquet table, loading only the partitions, row groups and columns needed.
+
+    Parameters:
+        path (str): Table directory.
+        columns (list, optional): Columns to load. Default every column.
+        periods (iterable, optional): AnoMes (YYYYMM) to load; other period partitions are not opened.
+        where (dict, optional): {column: [values]} filters, e.g. {'NumeroRelatorio': [4]} (partition
+            pruning) or {'NomeRelatorio_Grupo_Coluna': [...]} (row-group pruning).
+
+    Returns:
+        pd.DataFrame: The selected rows, without the Periodo partition column unless requested.
+    """
+    import pyarrow.dataset as ds
+
+    conditions = dict(where or {})
+    if periods is not None:
+        conditions[PERIOD_COLUMN] = [int(period) for period in periods]
+
+    expression = None
+    for column, values in conditions.items():
+        condition = ds.field(column).isin(list(values))
+        expression = condition if expression is None else expression & condition
+
+    dataset = _dataset(path, expression)
+    df = dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+    if PERIOD_COLUMN in df.columns and not (columns and PERIOD_COLUMN in columns):
+        df = df.drop(columns=PERIOD_COLUMN)
+    # Partition values come back as int32
+    if 'NumeroRelatorio' in df.columns and df['NumeroRelatorio'].notna().all():
+        df['NumeroRelatorio'] = df['NumeroRelatorio'].astype('int64')
+    return df
+
+
+def table_size(path):
+    """Bytes on disk of a table (directory) or file."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(path) for file in files)
+
+
+def table_periods(path):
+    """Sorted AnoMes (YYYYMM) of the period partitions of a table."""
+    if not os.path.isdir(path):
+        return []
+    prefix = f"{PERIOD_COLUMN}="
+    return sorted(int(name[len(prefix):]) for name in os.listdir(path) if name.startswith(prefix))
@@ -0,0 +1,295 @@
+"""
+Calculated financial indicators of financial_metrics (Receita Operacional, ROA, ROE, ...) declared
+as formulas over the items of the IF.data reports.
+
+Each indicator of DERIVED_METRICS is an arithmetic expression (+ - * /, parentheses, numbers,
+sum() and abs()) over the aliases of BASE_ITEMS and the keys of other indicators:
+
+    'roa': {
+        'name': 'ROA',
+        'report': 1,
+        'formula': 'lucro_liquido / ativo_total',
+        'description': 'Return on Assets (Lucro Líquido / Ativo Total)',
+    }
+
+derive_metrics pivots the rows of the base items once into an (institution, period) x item matrix,
+evaluates every formula on its whole columns and melts the results back into the long format of
+financial_metrics (NomeColuna = name, Grupo and Conta = 'Calculated', stored under the report
+given). Adding an indicator is one more entry here, not one more pass over the rows.
+
+Formulas are parsed with the ast module and only the operations above are evaluated, so a registry
+entry cannot run arbitrary code.
+"""
+import ast
+
+import numpy as np
+import pandas as pd
+
+
+# NumeroRelatorio -> NomeRelatorio of the reports the items come from
+REPORTS = {
+    1: 'Resumo',
+    4: 'Demonstração de Resultado',
+    10: 'Carteira de crédito ativa - quantidade de clientes e de operações',
+}
+
+# Alias used in the formulas -> (NumeroRelatorio, NomeColuna) of the item
+BASE_ITEMS = {
+    # Resumo
+    'ativo_total': (1, 'Ativo Total'),
+    'carteira_credito': (1, 'Carteira de Crédito Classificada'),
+    'captacoes': (1, 'Captações'),
+    'patrimonio_liquido': (1, 'Patrimônio Líquido'),
+    'lucro_liquido': (1, 'Lucro Líquido'),
+
+    # Demonstração de Resultado (expenses are negative)
+    'receitas_intermediacao': (4, 'Receitas de Intermediação Financeira \n(a) = (a1) + (a2) + (a3) + (a4) + (a5) + (a6)'),
+    'despesas_captacao': (4, 'Despesas de Captação \n(b1)'),
+    'resultado_intermediacao': (4, 'Resultado de Intermediação Financeira \n(c) = (a) + (b)'),
+    'rendas_servicos': (4, 'Rendas de Prestação de Serviços \n(d1)'),
+    'rendas_tarifas': (4, 'Rendas de Tarifas Bancárias \n(d2)'),
+    'despesas_pessoal': (4, 'Despesas de Pessoal \n(d3)'),
+    'despesas_administrativas': (4, 'Despesas Administrativas \n(d4)'),
+    'despesas_tributarias': (4, 'Despesas Tributárias \n(d5)'),
+    'outras_receitas_operacionais': (4, 'Outras Receitas Operacionais \n(d7)'),
+    'outras_despesas_operacionais': (4, 'Outras Despesas Operacionais \n(d8)'),
+
+    # Carteira de crédito ativa - quantidade de clientes e de operações
+    'clientes_ativos': (10, 'Quantidade de clientes com operações ativas'),
+}
+
+# Indicator key -> name (NomeColuna), report it is stored under, formula and description
+DERIVED_METRICS = {
+    'receita_operacional': {
+        'name': 'Receita Operacional',
+        'report': 4,
+        'formula': 'sum(receitas_intermediacao, rendas_servicos, rendas_tarifas, outras_receitas_operacionais)',
+        'description': 'Receita Intermediação Financeira + Rendas de Prestação de Serviços + Rendas de Tarifas Bancárias + Outras Receitas Operacionais',
+    },
+    'roa': {
+        'name': 'ROA',
+        'report': 1,
+        'formula': 'lucro_liquido / ativo_total',
+        'description': 'Return on Assets (Lucro Líquido / Ativo Total)',
+    },
+    'roe': {
+        'name': 'ROE',
+        'report': 1,
+        'formula': 'lucro_liquido / patrimonio_liquido',
+        'description': 'Return on Equity (Lucro Líquido / Patrimônio Líquido)',
+    },
+    'margem_financeira': {
+        'name': 'Margem Financeira Líquida',
+        'report': 4,
+        'formula': 'resultado_intermediacao / ativo_total',
+        'description': 'Net Interest Margin (Resultado de Intermediação Financeira / Ativo Total)',
+    },
+    'custo_captacao': {
+        'name': 'Custo de Captação',
+        'report': 4,
+        'formula': '-despesas_captacao / captacoes',
+        'description': 'Cost of Funding (Despesas de Captação / Captações)',
+    },
+    'indice_eficiencia': {
+        'name': 'Índice de Eficiência',
+        'report': 4,
+        'formula': '-sum(despesas_pessoal, despesas_administrativas) / sum(resultado_intermediacao, rendas_servicos, rendas_tarifas)',
+        'description': 'Efficiency Ratio ((Despesas de Pessoal + Despesas Administrativas) / (Resultado de Intermediação Financeira + Rendas de Prestação de Serviços + Rendas de Tarifas Bancárias))',
+    },
+    'custo_receita': {
+        'name': 'Custo / Receita',
+        'report': 4,
+        'formula': '-sum(despesas_pessoal, despesas_administrativas, despesas_tributarias, outras_despesas_operacionais) / receita_operacional',
+        'description': 'Cost-to-Income (Despesas de Pessoal + Administrativas + Tributárias + Outras Despesas Operacionais) / Receita Operacional',
+    },
+    'credito_captacoes': {
+        'name': 'Crédito / Captações',
+        'report': 1,
+        'formula': 'carteira_credito / captacoes',
+        'description': 'Credit to Funding (Carteira de Crédito Classificada / Captações)',
+    },
+    'receita_por_cliente': {
+        'name': 'Receita Operacional por Cliente',
+        'report': 4,
+        'formula': 'receita_operacional / clientes_ativos',
+        'description': 'Receita Operacional / Quantidade de clientes com operações ativas',
+    },
+}
+
+# Columns that identify a report line rather than an institution and period
+_LINE_COLUMNS = ['NomeRelatorio', 'NumeroRelatorio', 'Grupo', 'Conta', 'NomeColuna', 'DescricaoColuna', 'Saldo',
+                 'NomeRelatorio_Grupo_Coluna']
+
+
+#----------------------------------------------------------------------------
+# Formulas
+
+def _nansum(*values):
+    """Sum of the items a row has (NaN only when it has none of them), as a groupby sum of the rows."""
+    stacked = np.vstack(values)
+    return np.where(np.isnan(stacked).all(axis=0), np.nan, np.nansum(stacked, axis=0))
+
+
+_BINARY_OPERATORS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide}
+_UNARY_OPERATORS = {ast.USub: np.negative, ast.UAdd: np.positive}
+_FUNCTIONS = {'sum': _nansum, 'abs': np.abs}
+
+
+def _evaluate(node, columns, item_sum=None):
+    """
+    Value of a parsed formula node; columns maps the names to arrays. item_sum, when given, computes
+    a sum() of base items from their report rows (see derive_metrics).
+    """
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body, columns, item_sum)
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+        return _BINARY_OPERATORS[type(node.op)](_evaluate(node.left, columns, item_sum),
+                                                _evaluate(node.right, columns, item_sum))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+        return _UNARY_OPERATORS[type(node.op)](_evaluate(node.operand, columns, item_sum))
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _FUNCTIONS \
+            and not node.keywords:
+        if node.func.id == 'sum' and item_sum is not None \
+                and all(isinstance(arg, ast.Name) and arg.id in BASE_ITEMS for arg in node.args):
+            return item_sum([arg.id for arg in node.args])
+        return _FUNCTIONS[node.func.id](*(_evaluate(arg, columns, item_sum) for arg in node.args))
+    if isinstance(node, ast.Name):
+        return columns[node.id]
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return float(node.value)
+    raise ValueError(f"Unsupported expression in formula: {ast.unparse(node)}")
+
+
+def formula_names(formula):
+    """Items and indicators a formula refers to (function names excluded)."""
+    tree = ast.parse(formula, mode='eval')
+    functions = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+    return {node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and id(node) not in functions}
+
+
+def evaluation_order(metrics=None):
+    """
+    Keys of the indicators, each after the indicators its formula uses.
+
+    Raises:
+        ValueError: A formula refers to an unknown name, or indicators depend on each other in a cycle.
+    """
+    metrics = DERIVED_METRICS if metrics is None else metrics
+    order, visiting = [], set()
+
+    def visit(key):
+        if key in order:
+            return
+        if key in visiting:
+            raise ValueError(f"Derived metrics depend on each other in a cycle: {key}")
+        visiting.add(key)
+        for name in formula_names(metrics[key]['formula']):
+            if name in metrics:
+                visit(name)
+            elif name not in BASE_ITEMS:
+                raise ValueError(f"Unknown name '{name}' in the formula of {key}")
+        visiting.discard(key)
+        order.append(key)
+
+    for key in metrics:
+        visit(key)
+    return order
+
+
+def _base_items(key, metrics):
+    """Base items an indicator depends on, through the indicators it uses."""
+    items = set()
+    for name in formula_names(metrics[key]['formula']):
+        items |= _base_items(name, metrics) if name in metrics else {name}
+    return items
+
+
+#----------------------------------------------------------------------------
+# Engine
+
+def item_matrix(df, items=None, key_columns=None):
+    """
+    (institution, period) x base item matrix of Saldo.
+
+    Parameters:
+        df (pd.DataFrame): Cleaned report rows (columns of consolidated_cleaned).
+        items (iterable, optional): Aliases of BASE_ITEMS to pivot. Default all of them.
+        key_columns (list, optional): Columns identifying an institution and period. Default every
+            column of df that does not describe a report line (CodInst, NomeInstituicao, AnoMes, ...).
+
+    Returns:
+        pd.DataFrame: One row per key, one column per item (NaN where the institution did not
+            report the item in that period).
+    """
+    items = list(BASE_ITEMS) if items is None else list(items)
+    if key_columns is None:
+        key_columns = [col for col in df.columns if col not in _LINE_COLUMNS]
+    return _pivot_items(_item_rows(df, items, key_columns), items, key_columns)
+
+
+def _item_rows(df, items, key_columns):
+    """Rows of df of the base items, in their order in df, labelled with their alias (column item)."""
+    lines = pd.DataFrame([BASE_ITEMS[item] for item in items], columns=['NumeroRelatorio', 'NomeColuna'])
+    lines['item'] = items
+    rows = df.loc[df['NomeColuna'].isin(lines['NomeColuna']), key_columns + ['NumeroRelatorio', 'NomeColuna', 'Saldo']]
+    return rows.astype({'NumeroRelatorio': 'int64', 'NomeColuna': str}).merge(lines, on=['NumeroRelatorio', 'NomeColuna'])
+
+
+def _pivot_items(rows, items, key_columns):
+    wide = rows.groupby(key_columns + ['item'], observed=True)['Saldo'].sum(min_count=1).unstack('item')
+    return wide.reindex(columns=items)
+
+
+def derive_metrics(df, metrics=None, key_columns=None):
+    """
+    Evaluates every indicator of metrics (DERIVED_METRICS by default) on the cleaned report rows of
+    df in one pass, in the long format of financial_metrics.
+
+    An indicator gets a row for every institution and period that reported any of the items its
+    formula depends on (its value is NaN, or inf, when a term is missing or a divisor is 0).
+
+    Returns:
+        pd.DataFrame: The key columns plus NomeRelatorio, NumeroRelatorio, Grupo, Conta, NomeColuna,
+            DescricaoColuna, Saldo and NomeRelatorio_Grupo_Coluna, indicators in registry order.
+    """
+    metrics = DERIVED_METRICS if metrics is None else metrics
+    order = evaluation_order(metrics)
+    needed = {key: _base_items(key, metrics) for key in metrics}
+
+    items = sorted(set().union(*needed.values()))
+    if key_columns is None:
+        key_columns = [col for col in df.columns if col not in _LINE_COLUMNS]
+    rows = _item_rows(df, items, key_columns)
+    wide = _pivot_items(rows, items, key_columns)
+    columns = {item: wide[item].to_numpy(dtype='float64', na_value=np.nan) for item in wide.columns}
+    present = wide.notna()
+
+    def item_sum(sum_items):
+        # A sum() of report items adds up their rows in the order of df, with the same groupby as a
+        # sum over the report, so it keeps the exact floats of that sum (not those of adding the
+        # item columns in formula order)
+        sums = rows[rows['item'].isin(sum_items)].groupby(key_columns, observed=True)['Saldo'].sum(min_count=1)
+        return sums.reindex(wide.index).to_numpy(dtype='float64', na_value=np.nan)
+
+    # Every formula on whole columns, indicators used by others first
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for key in order:
+            values = _evaluate(ast.parse(metrics[key]['formula'], mode='eval'), columns, item_sum)
+            columns[key] = np.broadcast_to(values, len(wide)).astype('float64')
+
+    # Long format, one block of rows per indicator
+    keys = wide.index.to_frame(index=False)
+    blocks = []
+    for key, spec in metrics.items():
+        rows = present[sorted(needed[key])].any(axis=1).to_numpy()
+        block = keys[rows].reset_index(drop=True)
+        block['NomeRelatorio'] = REPORTS[spec['report']]
+        block['NumeroRelatorio'] = spec['report']
+        block['Grupo'] = 'Calculated'
+        block['Conta'] = 'Calculated'
+        block['NomeColuna'] = spec['name']
+        block['DescricaoColuna'] = spec['description']
+        block['Saldo'] = columns[key][rows]
+        block['NomeRelatorio_Grupo_Coluna'] = 'Calculated_' + spec['name']
+        blocks.append(block)
+    return pd.concat(blocks, ignore_index=True)
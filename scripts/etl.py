@@ -1,56 +1,355 @@
 import pandas as pd
+import numpy as np
 import os
+import sys
 import json
-import sqlite3
+import contextvars
+from datetime import datetime
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from scripts.schema import (
+    concat_categorical,
+    join_columns,
+    parse_decimal_comma,
+    period_keys,
+    read_raw_report_csv,
+    to_categories
+)
+from scripts import data_lake, profiling, sqlite_store
+from scripts.derived_metrics import derive_metrics
+from scripts.profiling import profiled_stage
+from scripts.change_detection import (
+    changed_periods,
+    input_changed,
+    mark_input_processed,
+    mark_periods_processed,
+    processed_periods
+)
 
+#----------------------------------------------------------------------------
+# Incremental mode helpers: every output is partitioned by AnoMes, so a run that only got new or
+# revised quarters rebuilds those periods and merges them into the outputs of the previous run.
+
+def _select_periods(df, periods):
+    """Rows of df whose AnoMes is in periods (every row when periods is None)."""
+    if periods is None:
+        return df
+    return df[period_keys(df['AnoMes']).isin({int(period) for period in periods})]
+
+
+def _csv_text(values):
+    """
+    values as pd.read_csv reads back the text df.to_csv writes for them, before any type inference:
+    strings, missing where the cell would be empty. Categoricals keep their codes and get text
+    categories, in sorted order and without the unused ones (as read_csv makes them).
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.cat.remove_unused_categories()
+        text = values.cat.categories.astype(str)
+        values = values.cat.rename_categories(text).cat.remove_categories(text[text == ''])
+        return values.cat.reorder_categories(sorted(values.cat.categories))
+    text = values.astype(str).where(values.notna())
+    return text.where(text != '')
+
+
+def _coerce_report_dtypes(df, dtype=None):
+    """
+    df with the dtypes pd.read_csv(path, dtype=dtype) gives it once written with df.to_csv, without
+    writing and parsing it: columns of dtype get that dtype from their text; numbers stay as they
+    are (nullable integers become int64, or float64 with missing values); dates, periods and strings
+    become text, or numbers when every value is numeric (e.g. Conta, held as a categorical of codes).
+    Used on the rows a stage hands over in memory, so the next stage sees the dtypes of its file.
+    """
+    dtype = dtype or {}
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        if col not in dtype and not isinstance(values.dtype, pd.CategoricalDtype) \
+                and (pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values)):
+            if pd.api.types.is_extension_array_dtype(values) and pd.api.types.is_integer_dtype(values):
+                values = values.astype('int64' if values.notna().all() else 'float64')
+            columns[col] = values
+            continue
+
+        text = _csv_text(values)
+        if col in dtype:
+            if dtype[col] != 'category':
+                columns[col] = text.astype(dtype[col]).where(text.notna())
+            elif not isinstance(text.dtype, pd.CategoricalDtype):
+                columns[col] = text.astype('category')
+            else:
+                columns[col] = text
+            continue
+
+        # Inferred as read_csv does: numbers when every value parses as one
+        if isinstance(text.dtype, pd.CategoricalDtype):
+            try:
+                numbers = pd.to_numeric(text.cat.categories.to_numpy())
+            except (ValueError, TypeError):
+                columns[col] = text.astype(str).where(text.notna())
+                continue
+            codes = text.cat.codes.to_numpy()
+            if (codes < 0).any():
+                # Code -1 (missing) picks the NaN appended last
+                numbers = np.append(numbers.astype('float64'), np.nan)
+            columns[col] = pd.Series(numbers[codes], index=df.index, name=col)
+        else:
+            try:
+                columns[col] = pd.to_numeric(text)
+            except (ValueError, TypeError):
+                columns[col] = text
+    return pd.DataFrame(columns, index=df.index)
+
+
+def _read_periods(input_data_path, periods=None, df=None, chunksize=200_000, **read_csv_kwargs):
+    """
+    Reads a stage's input, keeping only the rows of periods.
+
+    df, when given, holds the rows handed over in memory by the previous stage; it gets the dtypes
+    the same read_csv options give the file (see _coerce_report_dtypes), so the stage sees the same
+    dtypes whichever way its input comes. Otherwise the file is read
+    whole, or in chunks filtered on AnoMes when periods is given. Parquet tables (paths ending in
+    .parquet, see scripts.data_lake) are typed already and only open the partitions of periods.
+    """
+    if data_lake.is_lake_path(input_data_path):
+        if df is None:
+            df = data_lake.read_table(input_data_path, periods=periods)
+        else:
+            df = _select_periods(data_lake.as_stored(df), periods)
+    elif df is not None:
+        df = _coerce_report_dtypes(_select_periods(df, periods), read_csv_kwargs.get('dtype')).reset_index(drop=True)
+    elif periods is None:
+        df = pd.read_csv(input_data_path, **read_csv_kwargs)
+    else:
+        chunks = pd.read_csv(input_data_path, chunksize=chunksize, **read_csv_kwargs)
+        df = pd.concat([_select_periods(chunk, periods) for chunk in chunks], ignore_index=True)
+
+    # Input rows of the stage being profiled (see scripts.profiling)
+    profiling.record(rows_in=len(df))
+    return df
+
+
+def _iter_periods(input_data_path, periods=None, df=None, chunksize=200_000, **read_csv_kwargs):
+    """
+    _read_periods one piece at a time: chunks of chunksize rows of the CSV file (or of df), or one
+    period partition at a time for Parquet tables. Pieces without rows of periods are skipped.
+    """
+    if data_lake.is_lake_path(input_data_path) and df is None:
+        wanted = None if periods is None else {int(period) for period in periods}
+        pieces = (data_lake.read_table(input_data_path, periods=[period])
+                  for period in data_lake.table_periods(input_data_path) if wanted is None or period in wanted)
+    elif df is not None:
+        pieces = (_read_periods(input_data_path, periods, df.iloc[start:start + chunksize], **read_csv_kwargs)
+                  for start in range(0, len(df), chunksize))
+    else:
+        pieces = (_select_periods(chunk, periods)
+                  for chunk in pd.read_csv(input_data_path, chunksize=chunksize, **read_csv_kwargs))
+
+    for piece in pieces:
+        if len(piece):
+            profiling.record(rows_in=len(piece))
+            yield piece
+
+
+def merge_periods(output_path, new_df, periods, replace_existing=True, chunksize=200_000):
+    """
+    Merges the rows of periods (new_df) into an existing CSV output.
+
+    Parameters:
+        output_path (str): CSV written by a previous run. Created from new_df if missing.
+        new_df (pd.DataFrame): Rebuilt rows of periods, in any column order.
+        periods (iterable): AnoMes (YYYYMM) rebuilt in new_df.
+        replace_existing (bool): If True (revised quarters), the output is streamed in chunks to a
+            temporary file without its rows of periods and new_df is appended before replacing it.
+            If False (quarters never processed before), new_df is appended in place without
+            reading the output. Default True.
+        chunksize (int): Rows read at a time while rewriting the output.
+    """
+    if not Path(output_path).exists():
+        new_df.to_csv(output_path, encoding='utf-8', index=False)
+        return
+
+    # Same column order as the existing output
+    columns = pd.read_csv(output_path, nrows=0, encoding='utf-8').columns
+    new_df = new_df.reindex(columns=columns)
+
+    if not replace_existing:
+        new_df.to_csv(output_path, mode='a', header=False, encoding='utf-8', index=False)
+        return
+
+    periods = {int(period) for period in periods}
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as out:
+        header = True
+        # Kept rows are read as raw strings so they are written back exactly as they were
+        for chunk in pd.read_csv(output_path, dtype=str, keep_default_na=False, chunksize=chunksize,
+                                 encoding='utf-8'):
+            chunk[~period_keys(chunk['AnoMes']).isin(periods)].to_csv(out, header=header, index=False)
+            header = False
+        new_df.to_csv(out, header=header, index=False)
+    os.replace(tmp_path, output_path)
+
+
+def _write_output(df, output_path, periods=None, replace_existing=True):
+    """
+    Writes a stage's output whole, or merges the rows of periods into the previous one.
+    Paths ending in .parquet are written as partitioned Parquet tables (see scripts.data_lake).
+    """
+    if data_lake.is_lake_path(output_path):
+        data_lake.write_table(df, output_path, periods)
+    elif periods is None:
+        df.to_csv(output_path, encoding='utf-8', index=False)
+    else:
+        merge_periods(output_path, df, periods, replace_existing)
+
+
+def _write_output_chunks(chunks, output_path, periods=None, replace_existing=True):
+    """
+    Writes a stage's output from an iterator of chunks, holding one chunk in memory at a time. The
+    first chunk is written as _write_output writes a whole frame (replacing the output, or the rows
+    of periods in it); the next ones are appended.
+
+    Returns:
+        int: Rows written.
+    """
+    rows = 0
+    for chunk in chunks:
+        if not rows:
+            _write_output(chunk, output_path, periods, replace_existing)
+        elif data_lake.is_lake_path(output_path):
+            # New files next to the ones of the previous chunks
+            data_lake.write_table(chunk, output_path, periods=[])
+        else:
+            merge_periods(output_path, chunk, periods=[], replace_existing=False)
+        rows += len(chunk)
+    return rows
+
+#----------------------------------------------------------------------------
+
+def _read_raw_period(path, input_format):
+    """
+    Reads one raw period file with the report schema (see scripts.schema), drops its duplicate
+    rows and converts its string columns to categoricals. Runs in the worker processes of
+    combine_csv_files.
+    """
+    if input_format == "parquet":
+        df = pd.read_parquet(path)
+    else:
+        df = read_raw_report_csv(path)
+    return to_categories(df.drop_duplicates(ignore_index=True))
+
+
+@profiled_stage()
 def combine_csv_files(input_dir="../data/data_raw_reports",
-                      output_file="../data/consolidated_reports.csv"):
+                      output_file="../data/consolidated_reports.csv",
+                      input_format="csv",
+                      periods=None,
+                      max_workers=None,
+                      replace_existing=True):
     """
     Combines multiple CSV files in the specified directory into a single DataFrame.
 
+    Files are read in parallel on a pool of max_workers processes, each one typed with the explicit
+    raw report schema (Saldo as float from its decimal comma, CodInst padded to 8 digits, integer
+    ids, categorical strings) and deduplicated as it is read. Only the small per-file frames travel
+    between processes and the combined frame holds categorical codes instead of repeated strings,
+    so peak memory stays well below reading everything untyped and deduplicating at the end.
+
     Parameters:
         input_dir (str): Directory containing the CSV files. Default is "data/data_raw_reports".
         output_file (str, optional): Path to save the combined CSV file. Default is "data/consolidated_reports.csv".
+        input_format (str): "csv" reads the raw *_Tipo2_RelatorioT.csv files (default). "parquet" reads the
+            typed per-period files written by download_historical_data(output_format="parquet") from
+            input_dir/parquet/AnoMes=*/, skipping CSV parsing (Saldo already float, CodInst already padded).
+        periods (list of str, optional): Only read the raw files of these periods (e.g. the output of
+            scripts.change_detection.changed_periods) and merge them into the existing output_file
+            (see merge_periods). Default None reads every file.
+        max_workers (int, optional): Number of reader processes. Default None uses every core;
+            1 reads the files one after another in the current process.
+        replace_existing (bool): With periods, whether output_file may already hold rows of those
+            periods (revised quarters) that must be replaced. False appends without reading it. Default True.
 
     Returns:
-        pd.DataFrame: Combined DataFrame from all CSV files and saved as csv to output_file.
+        pd.DataFrame: Combined DataFrame from all CSV files and saved as csv to output_file
+            (only the rows of periods when periods is given).
     """
 
     # Initialize an empty list to hold DataFrames
     combined_data = []
 
-    # Iterate over all files in the input directory
-    for file in os.listdir(input_dir):
-        if file.endswith('_Tipo2_RelatorioT.csv'):
-            # Read each CSV file into a DataFrame
-            df = pd.read_csv(os.path.join(input_dir, file))
-            combined_data.append(df)
-
-    # Combine all DataFrames into a single DataFrame
-    combined_df = pd.concat(combined_data, ignore_index=True)
-
-    # Remove duplicates identical rows
-    combined_df = combined_df.drop_duplicates()
+    # Merging only makes sense on top of a previous output
+    if periods is not None and not (output_file and Path(output_file).exists()):
+        periods = None
+    if periods is not None:
+        periods = {int(period) for period in periods}
+
+    def wanted(file):
+        return periods is None or int(file.split('_')[1]) in periods
+
+    if input_format == "parquet":
+        # Typed period partitions
+        files = sorted(Path(input_dir, "parquet").glob("AnoMes=*/*_Tipo2_RelatorioT.parquet"))
+        files = [str(file) for file in files if wanted(file.name)]
+    elif input_format == "csv":
+        # Raw CSV files of the input directory
+        files = sorted(
+            os.path.join(input_dir, file) for file in os.listdir(input_dir)
+            if file.endswith('_Tipo2_RelatorioT.csv') and wanted(file)
+        )
+    else:
+        raise ValueError(f"Invalid input_format: {input_format}")
+
+    # Read, type and deduplicate every file, in parallel when there is more than one
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(files))) as pool:
+            combined_data += pool.map(_read_raw_period, files, [input_format] * len(files))
+        # The reader processes' I/O is not in this process' counters
+        profiling.record(bytes_read=sum(os.path.getsize(file) for file in files))
+    else:
+        combined_data += [_read_raw_period(file, input_format) for file in files]
+    profiling.record(rows_in=sum(len(df) for df in combined_data))
+
+    # Combine all DataFrames into a single DataFrame. Every raw file holds a single period and
+    # AnoMes is part of each row, so rows of different files never duplicate each other and the
+    # per-file deduplication above is enough.
+    combined_df = concat_categorical(combined_data)
+    del combined_data
 
     # Save the combined DataFrame to a CSV file if output_file is provided
     if output_file:
-        combined_df.to_csv(output_file, encoding='utf-8', index=False)
+        _write_output(combined_df, output_file, periods, replace_existing)
         print(f"Combined data saved to {output_file}")
 
     return combined_df
 
 
 
-def transform_data(
-    input_data_path="../data/consolidated_reports.csv",
-    output_data_path="../data/consolidated_cleaned.csv"
-):
-    # Load the data
-    df = pd.read_csv(input_data_path, dtype={'CodInst': str}, encoding='utf-8')
+# Rows of consolidated_reports.csv cleaned at a time by the full ETL run (see transform_data's chunksize)
+TRANSFORM_CHUNKSIZE = 500_000
+
+# Repeated report strings read as categoricals by transform_data
+_REPORT_STRING_COLUMNS = ['NomeRelatorio', 'Grupo', 'NomeColuna', 'DescricaoColuna']
+
+
+def _load_institution_names(institutions_path):
+    """CodInst (string) -> NomeInstituicao table of consolidated_institutions.json."""
+    # Load consolidated_institutions.json to add NomeInstituicao to the dataframe
+    consolidated_institutions = pd.read_json(institutions_path)
+    #Filter the dictionary for only CodInst and NomeInstituicao
+    consolidated_institutions = consolidated_institutions[['CodInst','NomeInstituicao']]
+    consolidated_institutions['CodInst'] = consolidated_institutions['CodInst'].astype(str)
+    return consolidated_institutions
+
+
+def _clean_report(df, consolidated_institutions):
+    """Cleans rows of the consolidated report (all of them, or one chunk), see transform_data."""
+    to_categories(df, _REPORT_STRING_COLUMNS)
 
     # Convert Saldo from Brazilian format (comma as decimal separator) to decimal
-    df['Saldo'] = df['Saldo'].str.replace(',', '.').astype(float)
+    # (already float when the raw data came from the Parquet ingestion mode)
+    df['Saldo'] = parse_decimal_comma(df['Saldo'])
     df['Saldo'] = df['Saldo'].round(2)
 
     # Convert AnoMes to datetime and create new columns for month and quarter
@@ -63,6 +362,8 @@ def transform_data(
     df = df[df['Saldo'].notna()]
 
     #Replace all NaN values in 'Grupo'to 'nagroup'
+    if 'nagroup' not in df['Grupo'].cat.categories:
+        df['Grupo'] = df['Grupo'].cat.add_categories('nagroup')
     df['Grupo'] = df['Grupo'].fillna('nagroup')
 
     # Convert CodInst to string
@@ -72,24 +373,67 @@ def transform_data(
     df['CodInst'] = df['CodInst'].str.zfill(8)
 
     # Create a columns appending NomeRelatorio, Grupo & NomeColuna
-    df['NomeRelatorio_Grupo_Coluna'] = df['NomeRelatorio'] + '_' + df['Grupo'] + '_' + df['NomeColuna']
+    # (built once per distinct combination, see scripts.schema.join_columns)
+    df['NomeRelatorio_Grupo_Coluna'] = join_columns(df, ['NomeRelatorio', 'Grupo', 'NomeColuna'])
 
-    # Load consolidated_institutions.json to add NomeInstituicao to the dataframe
-    consolidated_institutions = pd.read_json("../data/consolidated_institutions.json")
-    #Filter the dictionary for only CodInst and NomeInstituicao
-    consolidated_institutions = consolidated_institutions[['CodInst','NomeInstituicao']]
+    # Add NomeInstituicao to df (a left merge keeps the row order, so cleaned chunks
+    # concatenate to the cleaned whole)
+    df = df.merge(consolidated_institutions, on='CodInst', how='left')
+    to_categories(df, ['NomeInstituicao'])
+    return df
 
-    # Enforce CodInst to string in both dataframes
-    df['CodInst'] = df['CodInst'].astype(str)
-    consolidated_institutions['CodInst'] = consolidated_institutions['CodInst'].astype(str)
 
+@profiled_stage()
+def transform_data(
+    input_data_path="../data/consolidated_reports.csv",
+    output_data_path="../data/consolidated_cleaned.csv",
+    periods=None,
+    df=None,
+    replace_existing=True,
+    institutions_path="../data/consolidated_institutions.json",
+    chunksize=None
+):
+    """
+    Cleans the consolidated report (typed Saldo and dates, padded CodInst, NomeInstituicao added).
 
-    # Add NomeInstituicao to df
-    df = df.merge(consolidated_institutions, on='CodInst', how='left')
+    Parameters:
+        periods (list, optional): Incremental mode: only transform these AnoMes (YYYYMM) and merge them
+            into the existing output_data_path (see merge_periods). Default None transforms everything.
+        df (pd.DataFrame, optional): Rows of the consolidated report already in memory (e.g. returned by
+            combine_csv_files(periods=...)); input_data_path is not read when given.
+        replace_existing (bool): With periods, whether the output may already hold rows of those periods.
+        institutions_path (str): consolidated_institutions.json written by get_consolidated_institutions.
+        chunksize (int, optional): Streaming mode: read, clean and write this many input rows at a time
+            (one period partition at a time for a Parquet input), so memory stays bounded by the chunk
+            size however many years are loaded. The output is the same. Default None cleans everything
+            at once.
 
+    Returns:
+        pd.DataFrame: Cleaned rows, with NomeRelatorio, Grupo, NomeColuna, DescricaoColuna,
+            NomeRelatorio_Grupo_Coluna and NomeInstituicao held as categoricals (the file written is
+            the same). AnoMes_Q is a quarterly Period, stored as an int64 ordinal.
+            None in streaming mode, where the cleaned rows are never held whole.
+    """
+    consolidated_institutions = _load_institution_names(institutions_path)
+
+    # The repeated report strings are read as categoricals
+    read_csv_kwargs = dict(dtype={'CodInst': str, **{col: 'category' for col in _REPORT_STRING_COLUMNS}},
+                           encoding='utf-8')
+
+    if chunksize:
+        chunks = _iter_periods(input_data_path, periods, df, chunksize=chunksize, **read_csv_kwargs)
+        rows = _write_output_chunks((_clean_report(chunk, consolidated_institutions) for chunk in chunks),
+                                    output_data_path, periods, replace_existing)
+        profiling.record(rows_out=rows)
+        print(f"Transformed data saved to {output_data_path} ({rows} rows)")
+        return None
+
+    # Load the data
+    df = _read_periods(input_data_path, periods, df, **read_csv_kwargs)
+    df = _clean_report(df, consolidated_institutions)
 
     # Save the transformed data to a CSV file
-    df.to_csv(output_data_path, encoding='utf-8', index=False)
+    _write_output(df, output_data_path, periods, replace_existing)
     print(f"Transformed data saved to {output_data_path}")
 
 
@@ -98,9 +442,98 @@ def transform_data(
 
 #----------------------------------------------------------------------------
 
+def load_clean_data(input_data_path="../data/consolidated_cleaned.csv", periods=None, df=None):
+    """
+    Loads the cleaned dataset written by transform_data, the way every derived-table builder reads it.
+
+    Parameters:
+        input_data_path (str): Path to the cleaned CSV file. Default "../data/consolidated_cleaned.csv"
+        periods (list, optional): Only keep these AnoMes (YYYYMM), reading the file in chunks.
+        df (pd.DataFrame, optional): Cleaned rows already in memory (e.g. returned by transform_data),
+            given the dtypes they would have when read from the file.
+
+    Returns:
+        pd.DataFrame: Cleaned dataset with CodInst kept as zero-padded string.
+    """
+    return _read_periods(input_data_path, periods, df, dtype={'CodInst': str}, encoding='utf-8')
+
+
+def _infer_codinst(codinst):
+    """CodInst converted to numbers when every value is numeric, as pd.read_csv infers it without a dtype."""
+    try:
+        return pd.to_numeric(codinst)
+    except (ValueError, TypeError):
+        return codinst
+
+
+@profiled_stage(rows_in='df_clean')
+def build_derived_tables(
+    input_data_path="../data/consolidated_cleaned.csv",
+    output_dir="../data",
+    df_clean=None,
+    max_workers=1,
+    output_format="csv",
+    periods=None,
+    replace_existing=True
+):
+    """
+    Pipeline mode of the derived-table builders: loads the cleaned dataset once and fans it out in
+    memory to make_cred_pf_df, make_cred_pj_df, make_market_metrics_df and make_financial_metrics_df,
+    instead of each of them parsing consolidated_cleaned.csv again. Their outputs are the same as
+    when they are called on their own.
+
+    Parameters:
+        input_data_path (str): Path to the cleaned CSV file. Default "../data/consolidated_cleaned.csv"
+        output_dir (str): Directory of the builders' outputs (cred_pf, cred_pj, market_metrics,
+            financial_metrics). Default "../data"
+        output_format (str): "csv" (default) or "parquet" for partitioned Parquet tables (scripts.data_lake).
+        df_clean (pd.DataFrame, optional): Cleaned dataset already loaded with load_clean_data.
+        max_workers (int): Number of builders run concurrently on threads. Default 1 (one after another).
+            The builders only read the shared frame, so they can safely run side by side.
+        periods (list, optional): Incremental mode: only rebuild these AnoMes (YYYYMM) in every output
+            (see merge_periods). Default None rebuilds everything.
+        replace_existing (bool): With periods, whether the outputs may already hold rows of those periods.
+
+    Returns:
+        dict: {'consolidated_reports', 'credit_pf', 'credit_pj', 'market_metrics', 'financial_metrics'}
+            -> DataFrame, keyed like the SQLite tables (see save_to_sqlite(frames=...)). Only the rows
+            of periods in incremental mode.
+    """
+    # Parse the largest file a single time
+    df_clean = load_clean_data(input_data_path, periods) if df_clean is None else _select_periods(df_clean, periods)
+    incremental = dict(periods=periods, replace_existing=replace_existing)
+
+    builders = {
+        'credit_pf': lambda: make_cred_pf_df(
+            output_data_path=os.path.join(output_dir, f"cred_pf.{output_format}"), df_clean=df_clean, **incremental),
+        'credit_pj': lambda: make_cred_pj_df(
+            output_data_path=os.path.join(output_dir, f"cred_pj.{output_format}"), df_clean=df_clean, **incremental),
+        'market_metrics': lambda: make_market_metrics_df(
+            output_data_path=os.path.join(output_dir, f"market_metrics.{output_format}"), df_clean=df_clean, **incremental),
+        'financial_metrics': lambda: make_financial_metrics_df(
+            output_data_path=os.path.join(output_dir, f"financial_metrics.{output_format}"), df_cleaned=df_clean, **incremental)
+    }
+
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # Each builder runs in a copy of the current context, so its profiled stage knows its parent
+            futures = {name: pool.submit(contextvars.copy_context().run, builder) for name, builder in builders.items()}
+            tables = {name: future.result() for name, future in futures.items()}
+    else:
+        tables = {name: builder() for name, builder in builders.items()}
+    profiling.record(rows_out=sum(len(table) for table in tables.values()))
+
+    return {'consolidated_reports': df_clean, **tables}
+
+#----------------------------------------------------------------------------
+
+@profiled_stage(rows_in='df_clean')
 def make_cred_pf_df(
     input_data_path="../data/consolidated_cleaned.csv",
-    output_data_path="../data/cred_pf.csv"
+    output_data_path="../data/cred_pf.csv",
+    df_clean=None,
+    periods=None,
+    replace_existing=True
 ):
     """
     Filter the complete dataset to only the features related to Totals of PF credit (report 11)
@@ -109,6 +542,11 @@ def make_cred_pf_df(
     Parameters:
         input_data_path (str): Path to input CSV file. Default "../data/consolidated_cleaned.csv"
         output_data_path (str): Path to save filtered CSV file. Default "../data/cred_pf.csv"
+        df_clean (pd.DataFrame, optional): Cleaned dataset already in memory (see load_clean_data);
+            input_data_path is not read when given.
+        periods (list, optional): Incremental mode: only rebuild these AnoMes (YYYYMM) and merge them
+            into the existing output (see merge_periods). Default None rebuilds everything.
+        replace_existing (bool): With periods, whether the output may already hold rows of those periods.
 
     Returns:
         pd.DataFrame: DataFrame containing only credit data for individuals (PF), filtered for:
@@ -116,23 +554,27 @@ def make_cred_pf_df(
             - Only total values ('Total da Carteira de Pessoa Física', 'Total')
     """
     # Load the data from input_data_path
-    df_clean = pd.read_csv(input_data_path, dtype={'CodInst': str}, encoding='utf-8')
+    df_clean = load_clean_data(input_data_path, periods) if df_clean is None else _select_periods(df_clean, periods)
 
     # Filter for PF Credit report (11) and keep only totals
     cred_pf_df = df_clean[df_clean['NumeroRelatorio'] == 11]
     cred_pf_df = cred_pf_df[cred_pf_df['NomeColuna'].isin(['Total da Carteira de Pessoa Física', 'Total'])]
 
     # Save the filtered data to CSV
-    cred_pf_df.to_csv(output_data_path, encoding='utf-8', index=False)
+    _write_output(cred_pf_df, output_data_path, periods, replace_existing)
     print(f"PF Credit data saved to {output_data_path}")
 
     return cred_pf_df
 
 #----------------------------------------------------------------------------
 
+@profiled_stage(rows_in='df_clean')
 def make_cred_pj_df(
     input_data_path="../data/consolidated_cleaned.csv",
-    output_data_path="../data/cred_pj.csv"
+    output_data_path="../data/cred_pj.csv",
+    df_clean=None,
+    periods=None,
+    replace_existing=True
 ):
     """
     Filter the complete dataset to only the features related to PJ credit (report 13)
@@ -141,6 +583,11 @@ def make_cred_pj_df(
     Parameters:
         input_data_path (str): Path to input CSV file. Default "../data/consolidated_cleaned.csv"
         output_data_path (str): Path to save filtered CSV file. Default "../data/cred_pj.csv"
+        df_clean (pd.DataFrame, optional): Cleaned dataset already in memory (see load_clean_data);
+            input_data_path is not read when given.
+        periods (list, optional): Incremental mode: only rebuild these AnoMes (YYYYMM) and merge them
+            into the existing output (see merge_periods). Default None rebuilds everything.
+        replace_existing (bool): With periods, whether the output may already hold rows of those periods.
 
     Returns:
         pd.DataFrame: DataFrame containing only credit data for companies (PJ), filtered for:
@@ -148,25 +595,27 @@ def make_cred_pj_df(
             - Only total values ('Total da Carteira de Pessoa Jurídica', 'Total')
     """
     # Load the data from input_data_path
-    df_clean = pd.read_csv(input_data_path, dtype={'CodInst': str}, encoding='utf-8')
+    df_clean = load_clean_data(input_data_path, periods) if df_clean is None else _select_periods(df_clean, periods)
 
     # Filter for PJ Credit report (13,14) and keep only totals
     cred_pj_df = df_clean[df_clean['NumeroRelatorio'].isin([13,14])]
     cred_pj_df = cred_pj_df[cred_pj_df['NomeColuna'].isin(['Total da Carteira de Pessoa Jurídica', 'Total','Grande','Média','Pequena','Micro'])]
 
     # Save the filtered data to CSV
-    cred_pj_df.to_csv(output_data_path, encoding='utf-8', index=False)
+    _write_output(cred_pj_df, output_data_path, periods, replace_existing)
     print(f"PJ Credit data saved to {output_data_path}")
 
     return cred_pj_df
 
 #----------------------------------------------------------------------------
 
+@profiled_stage()
 def make_credit_data_df(cred_pf_df_path="../data/cred_pf.csv", cred_pj_df_path="../data/cred_pj.csv",output_path="../data/credit_data.csv"):
 
     # Load data
     cred_pf_df = pd.read_csv(cred_pf_df_path)
     cred_pj_df = pd.read_csv(cred_pj_df_path)
+    profiling.record(rows_in=len(cred_pf_df) + len(cred_pj_df))
 
     # Combine dataframes
     df = pd.concat([cred_pf_df, cred_pj_df])
@@ -181,9 +630,13 @@ def make_credit_data_df(cred_pf_df_path="../data/cred_pf.csv", cred_pj_df_path="
 #----------------------------------------------------------------------------
 
 
+@profiled_stage(rows_in='df_clean')
 def make_market_metrics_df(
     input_data_path="../data/consolidated_cleaned.csv",
-    output_data_path="../data/market_metrics.csv"
+    output_data_path="../data/market_metrics.csv",
+    df_clean=None,
+    periods=None,
+    replace_existing=True
 ):
     """
     Filter the complete dataset to only the features available for market share analysis
@@ -192,6 +645,11 @@ def make_market_metrics_df(
     Parameters:
         input_data_path (str): Path to input CSV file. Default "../data/consolidated_cleaned.csv"
         output_data_path (str): Path to save filtered CSV file. Default "../data/market_metrics.csv"
+        df_clean (pd.DataFrame, optional): Cleaned dataset already in memory (see load_clean_data);
+            input_data_path is not read when given.
+        periods (list, optional): Incremental mode: only rebuild these AnoMes (YYYYMM) and merge them
+            into the existing output (see merge_periods). Default None rebuilds everything.
+        replace_existing (bool): With periods, whether the output may already hold rows of those periods.
 
     Returns:
         pd.DataFrame: DataFrame containing only the following market metrics for each institution:
@@ -207,7 +665,7 @@ def make_market_metrics_df(
             - Passivo Captacoes: Emissão de Títulos (LCI,LCA,LCF...)
     """
     # Load the data from input_data_path
-    df_clean = pd.read_csv(input_data_path, dtype={'CodInst': str}, encoding='utf-8')
+    df_clean = load_clean_data(input_data_path, periods) if df_clean is None else _select_periods(df_clean, periods)
 
     # Dictionary mapping features to their full column names
     feature_name_dict = {
@@ -234,24 +692,34 @@ def make_market_metrics_df(
     market_metrics_df = df_clean[df_clean['NomeRelatorio_Grupo_Coluna'].isin(feature_long)]
 
     # Save the filtered data to a CSV file
-    market_metrics_df.to_csv(output_data_path, encoding='utf-8', index=False)
+    _write_output(market_metrics_df, output_data_path, periods, replace_existing)
     print(f"Transformed data saved to {output_data_path}")
 
     return market_metrics_df
 
 #----------------------------------------------------------------------------
 
+@profiled_stage(rows_in='df_cleaned')
 def make_financial_metrics_df(
     input_data_path="../data/consolidated_cleaned.csv",
-    output_data_path="../data/financial_metrics.csv"
+    output_data_path="../data/financial_metrics.csv",
+    df_cleaned=None,
+    periods=None,
+    replace_existing=True
 ):
     """
         Generate financial metrics dataset for each institution and period.
 
         Parameters:
         -----------
-        df_cleaned : pandas.DataFrame
-            Input dataframe containing the raw financial data
+        df_cleaned : pandas.DataFrame, optional
+            Cleaned dataset already in memory (see load_clean_data); input_data_path
+            is not read when given.
+        periods : list, optional
+            Incremental mode: only recalculate the derived metrics for these AnoMes
+            (YYYYMM) and merge them into the existing output (see merge_periods).
+        replace_existing : bool
+            With periods, whether the output may already hold rows of those periods.
 
         Returns:
         --------
@@ -261,7 +729,14 @@ def make_financial_metrics_df(
 
     import pandas as pd
     # Load data
-    df_cleaned = pd.read_csv(input_data_path)
+    if df_cleaned is None:
+        df_cleaned = _read_periods(input_data_path, periods)
+    else:
+        df_cleaned = _select_periods(df_cleaned, periods)
+        # Only the three reports used below, with CodInst as the integers pd.read_csv infers
+        # when reading the file (this table has always stored CodInst unpadded)
+        df_cleaned = df_cleaned[df_cleaned['NumeroRelatorio'].isin([1, 4, 10])]
+        df_cleaned = df_cleaned.assign(CodInst=_infer_codinst(df_cleaned['CodInst']))
     # Filter for DRE Report
     df_dre = df_cleaned[df_cleaned['NumeroRelatorio'].isin([4])]
     # Filter for Resumo Report
@@ -269,82 +744,13 @@ def make_financial_metrics_df(
     # Filter for Clientes Report
     df_clientes = df_cleaned[df_cleaned['NumeroRelatorio'].isin([10])]
 
-    #######################################################
+    # Calculated indicators (Receita Operacional, ROA, ROE, ...), declared as formulas in
+    # scripts.derived_metrics and evaluated together in one pass over the three reports
+    derived = derive_metrics(df_cleaned)
 
-    # Within DRE, calculate Receita Operacional
-
-    # Create a new dataframe with the calculated Receita Operacional
-    group_cols = [col for col in df_dre.columns if col not in [
-        'NomeColuna',
-        'Saldo',
-        'Grupo',
-        'Conta',
-        'DescricaoColuna',
-        'NomeRelatorio_Grupo_Coluna'
-    ]]
-
-    # Calculate Receita Operacional
-    receita_operacional = df_dre[df_dre['NomeColuna'].isin([
-        'Receitas de Intermediação Financeira \n(a) = (a1) + (a2) + (a3) + (a4) + (a5) + (a6)',
-        'Rendas de Prestação de Serviços \n(d1)',
-        'Rendas de Tarifas Bancárias \n(d2)',
-        'Outras Receitas Operacionais \n(d7)'
-    ])].groupby(group_cols)['Saldo'].sum().reset_index()
-
-    # Add constant values for NomeColuna and dependencies
-    receita_operacional['NomeColuna'] = 'Receita Operacional'
-    receita_operacional['Grupo'] = 'Calculated'
-    receita_operacional['Conta'] = 'Calculated'
-    receita_operacional['DescricaoColuna'] = 'Receita Intermediação Financeira + Rendas de Prestação de Serviços + Rendas de Tarifas Bancárias + Outras Receitas Operacionais'
-    receita_operacional['NomeRelatorio_Grupo_Coluna'] = 'Calculated_Receita Operacional'
-
-    # Append to original dataframe
-    df_dre = pd.concat([df_dre, receita_operacional], ignore_index=True)
-
-    #######################################################
-    # Create grouping columns list
-    group_cols = [col for col in df_resumo.columns if col not in [
-        'NomeColuna',
-        'Saldo',
-        'Grupo',
-        'Conta',
-        'DescricaoColuna',
-        'NomeRelatorio_Grupo_Coluna'
-    ]]
-
-    # Create pivot table to make calculations easier
-    df_pivot = df_resumo.pivot_table(
-        index=group_cols,
-        columns='NomeColuna',
-        values='Saldo',
-        aggfunc='first'
-    ).reset_index()
-
-    # Calculate ROA and ROE
-    ratios = df_pivot.copy()
-    ratios['ROA'] = ratios['Lucro Líquido'] / ratios['Ativo Total']
-    ratios['ROE'] = ratios['Lucro Líquido'] / ratios['Patrimônio Líquido']
-
-    # Melt the ratios back to long format
-    ratios_melted = pd.melt(
-        ratios,
-        id_vars=group_cols,
-        value_vars=['ROA', 'ROE'],
-        var_name='NomeColuna',
-        value_name='Saldo'
-    )
-
-    # Add the additional columns
-    ratios_melted['Grupo'] = 'Calculated'
-    ratios_melted['Conta'] = 'Calculated'
-    ratios_melted['DescricaoColuna'] = ratios_melted['NomeColuna'].map({
-        'ROA': 'Return on Assets (Lucro Líquido / Ativo Total)',
-        'ROE': 'Return on Equity (Lucro Líquido / Patrimônio Líquido)'
-    })
-    ratios_melted['NomeRelatorio_Grupo_Coluna'] = 'Calculated_' + ratios_melted['NomeColuna']
-
-    # Append to original dataframe
-    df_resumo = pd.concat([df_resumo, ratios_melted], ignore_index=True)
+    # Appended to the report they are stored under
+    df_dre = pd.concat([df_dre, derived[derived['NumeroRelatorio'] == 4]], ignore_index=True)
+    df_resumo = pd.concat([df_resumo, derived[derived['NumeroRelatorio'] == 1]], ignore_index=True)
 
     # Filter for active clients only
     df_clientes = df_clientes[df_clientes['NomeColuna'] == 'Quantidade de clientes com operações ativas']
@@ -354,7 +760,7 @@ def make_financial_metrics_df(
     financial_metrics_df = pd.concat([df_dre, df_resumo,df_clientes], ignore_index=True)
 
     # Save the filtered data to a CSV file
-    financial_metrics_df.to_csv(output_data_path, encoding='utf-8', index=False)
+    _write_output(financial_metrics_df, output_data_path, periods, replace_existing)
     print(f"Transformed data saved to {output_data_path}")
 
     return financial_metrics_df
@@ -449,9 +855,193 @@ def initialize_financial_components():
 
 
 
+# Keys of an institution/period in the financial metrics
+FINANCIAL_GROUP_KEYS = ['NomeInstituicao', 'AnoMes_Q', 'AnoMes']
+
+# Define aggregation buckets for combining multiple components into summary metrics
+FINANCIAL_AGGREGATION_BUCKETS = {
+    'Outras Receitas Intermediação': [
+        'Rendas de Operações de Arrendamento Mercantil \n(a2)',
+        'Rendas de Operações com Instrumentos Financeiros Derivativos \n(a4)',
+        'Resultado de Operações de Câmbio \n(a5)',
+        'Rendas de Aplicações Compulsórias \n(a6)'
+    ]
+}
+
+# Define the components to be included in different types of waterfall charts
+FINANCIAL_COMPONENTS = {
+    'revenue_buildup': [
+        'Rendas de Operações de Crédito \n(a1)',
+        'Rendas de Operações com TVM \n(a3)',
+        'Outras Receitas Intermediação',
+        'Rendas de Prestação de Serviços \n(d1)',
+        'Rendas de Tarifas Bancárias \n(d2)',
+        'Outras Receitas Operacionais \n(d7)',
+        'Receita Operacional'
+    ],
+    'pl_decomposition': [
+        'Receita Operacional',
+        'Despesas de Intermediação Financeira \n(b) = (b1) + (b2) + (b3) + (b4) + (b5)',
+        'Despesas de Pessoal \n(d3)',
+        'Despesas Administrativas \n(d4)',
+        'Despesas Tributárias \n(d5)',
+        'Outras Despesas Operacionais \n(d8)',
+        'Lucro Líquido \n(j) = (g) + (h) + (i)'
+    ],
+    'store_receita_qtd_clientes': [
+        'Receita Operacional',
+        'Quantidade de clientes com operações ativas'
+    ],
+    'intermediation_breakdown': [
+        'Receitas de Intermediação Financeira \n(a) = (a1) + (a2) + (a3) + (a4) + (a5) + (a6)',
+        'Despesas de Captação \n(b1)',
+        'Despesas de Obrigações por Empréstimos e Repasses \n(b2)',
+        'Despesas de Operações de Arrendamento Mercantil \n(b3)',
+        'Resultado de Operações de Câmbio \n(b4)',
+        'Resultado de Provisão para Créditos de Difícil Liquidação \n(b5)',
+        'Resultado de Intermediação Financeira \n(c) = (a) + (b)'
+    ]
+}
+
+
+def filter_valid_financial_entries(df):
+    """
+    Keeps the institutions/periods whose Receita Operacional and number of active clients are both > 1.
+    """
+    # Compute the sums per institution and period
+    revenue_check = (
+        df[df['NomeColuna'] == 'Receita Operacional']
+        .groupby(FINANCIAL_GROUP_KEYS)['Saldo'].sum()
+    )
+    clients_check = (
+        df[df['NomeColuna'] == 'Quantidade de clientes com operações ativas']
+        .groupby(FINANCIAL_GROUP_KEYS)['Saldo'].sum()
+    )
+
+    # Identify valid records where both revenue and client counts are sufficient
+    valid_entries = (revenue_check > 1) & (clients_check > 1)
+    valid_entries = valid_entries[valid_entries].index
+
+    # Filter the main dataset based on valid entries
+    return df[df.set_index(FINANCIAL_GROUP_KEYS).index.isin(valid_entries)]
+
+
+def compute_financial_metrics(df):
+    """
+    Vectorized engine of process_financial_metrics2: the absolute value, percentage of revenue and
+    value per client of every component in FINANCIAL_COMPONENTS, for every institution and period.
+
+    Instead of looping over each (NomeInstituicao, AnoMes_Q, AnoMes) group, the data is pivoted once
+    into a groups x NomeColuna matrix and every metric is computed on whole columns, which gives
+    the same rows, in the same order, as the previous row-by-row loop.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Financial metrics with AnoMes as datetime and AnoMes_Q as quarterly period.
+
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per institution, period and component (see process_financial_metrics2).
+    """
+    df = filter_valid_financial_entries(df)
+
+    # Every institution/period, in groupby order
+    groups = df.groupby(FINANCIAL_GROUP_KEYS).size().index
+    if len(groups) == 0:
+        return pd.DataFrame()
+
+    # Last Saldo of each NomeColuna per group (as a dict built from the rows would keep)
+    last_values = df.dropna(subset=['NomeColuna']).drop_duplicates(
+        subset=FINANCIAL_GROUP_KEYS + ['NomeColuna'], keep='last'
+    )
+    # Groups x NomeColuna matrix; components a group does not report are 0, reported NaNs stay NaN
+    wide = (
+        last_values.set_index(FINANCIAL_GROUP_KEYS + ['NomeColuna'])['Saldo']
+        .astype(float)
+        .unstack(fill_value=0.0)
+        .reindex(groups, fill_value=0.0)
+    )
+
+    # Aggregation buckets, added in the same order as the components are listed
+    for agg_name, components in FINANCIAL_AGGREGATION_BUCKETS.items():
+        total = pd.Series(0.0, index=wide.index)
+        for comp in components:
+            if comp in wide.columns:
+                total = total + wide[comp]
+        wide[agg_name] = total
+
+    # Number of active clients and revenue per group (1 when missing)
+    def last_saldo(nome_coluna):
+        rows = df[df['NomeColuna'] == nome_coluna]
+        rows = rows[~rows.duplicated(subset=FINANCIAL_GROUP_KEYS, keep='last')]
+        values = rows.set_index(FINANCIAL_GROUP_KEYS)['Saldo'].astype(float)
+        return values.reindex(groups, fill_value=1.0).to_numpy()
+
+    num_clients = last_saldo('Quantidade de clientes com operações ativas')
+    receita_op = last_saldo('Receita Operacional')
+
+    # Groups x (component type, component) matrix of absolute values
+    pairs = [(component_type, comp) for component_type, components in FINANCIAL_COMPONENTS.items()
+             for comp in components]
+    components = [comp for _, comp in pairs]
+    values = wide.reindex(columns=pd.Index(components).unique(), fill_value=0.0)[components].to_numpy()
+
+    # Percentage of revenue and value per client, 0 where revenue/clients are not > 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent_revenue = np.where((receita_op > 1)[:, None], (values / receita_op[:, None]) * 100, 0.0)
+        per_client = np.where((num_clients > 1)[:, None], values / num_clients[:, None], 0.0)
+
+    # Long format: one row per group and component, groups first
+    n_groups, n_pairs = values.shape
+    group_position = np.repeat(np.arange(n_groups), n_pairs)
+    return pd.DataFrame({
+        'NomeInstituicao': groups.get_level_values('NomeInstituicao')[group_position],
+        'AnoMes_Q': groups.get_level_values('AnoMes_Q')[group_position],
+        'AnoMes': groups.get_level_values('AnoMes')[group_position],
+        'ComponentType': np.tile([component_type for component_type, _ in pairs], n_groups),
+        'Component': np.tile(components, n_groups),
+        'ValueAbsolute': values.ravel(),
+        'ValuePercentRevenue': percent_revenue.ravel(),
+        'ValuePerClient': per_client.ravel(),
+        'NumClients': np.repeat(num_clients, n_pairs),
+        'ReceitaOperacional': np.repeat(receita_op, n_pairs)
+    })
+
+
+def load_financial_metrics(input_data_path="../data/financial_metrics.csv"):
+    """
+    Loads financial_metrics.csv for process_financial_metrics2, with AnoMes as datetime and
+    AnoMes_Q as quarterly period.
+    """
+    if data_lake.is_lake_path(input_data_path):
+        df = data_lake.read_table(input_data_path)
+    else:
+        # Load data with low_memory=False to avoid DtypeWarning
+        df = pd.read_csv(input_data_path, dtype={
+            'AnoMes': str,
+            'AnoMes_M': str,
+            'AnoMes_Q': str,
+            'Grupo': str,
+            'Conta': str
+        }, low_memory=False)
+
+    # Convert AnoMes to datetime for proper sorting
+    df['AnoMes'] = pd.to_datetime(df['AnoMes'])
+    #Reasign AnoMes_Q as period Q datatype
+    df['AnoMes_Q'] = df['AnoMes'].dt.to_period('Q')
+
+    profiling.record(rows_in=len(df))
+    return df
+
+
+@profiled_stage()
 def process_financial_metrics2(
     input_data_path="../data/financial_metrics.csv",
-    output_data_path="../data/financial_metrics_processed.csv"
+    output_data_path="../data/financial_metrics_processed.csv",
+    periods=None,
+    replace_existing=True
 ):
     """
     Processes financial metrics for banking data to create pre-calculated values
@@ -463,6 +1053,11 @@ def process_financial_metrics2(
         Path to the input CSV file containing raw financial metrics.
     output_data_path : str
         Path to save the processed financial metrics CSV file.
+    periods : list, optional
+        Incremental mode: only recalculate the components, percentages of revenue and per-client
+        values of these AnoMes (YYYYMM) and merge them into the existing output (see merge_periods).
+    replace_existing : bool
+        With periods, whether the output may already hold rows of those periods.
 
     Returns:
     --------
@@ -472,152 +1067,14 @@ def process_financial_metrics2(
         - Percentage of revenue for each component.
         - Per-client metrics.
     """
-    # Load data with low_memory=False to avoid DtypeWarning
-    df = pd.read_csv(input_data_path, dtype={
-        'AnoMes': str,
-        'AnoMes_M': str,
-        'AnoMes_Q': str,
-        'Grupo': str,
-        'Conta': str
-    }, low_memory=False)
-
-    # Convert AnoMes to datetime for proper sorting
-    df['AnoMes'] = pd.to_datetime(df['AnoMes'])
-    #Reasign AnoMes_Q as period Q datatype
-    df['AnoMes_Q'] = df['AnoMes'].dt.to_period('Q')
-
-
-    # Filter out rows where revenue or number of clients is insufficient
-    # Compute the sums per institution and period
-    revenue_check = (
-        df[df['NomeColuna'] == 'Receita Operacional']
-        .groupby(['NomeInstituicao', 'AnoMes_Q', 'AnoMes'])['Saldo'].sum()
-    )
-    clients_check = (
-        df[df['NomeColuna'] == 'Quantidade de clientes com operações ativas']
-        .groupby(['NomeInstituicao', 'AnoMes_Q', 'AnoMes'])['Saldo'].sum()
-    )
-
-    # Identify valid records where both revenue and client counts are sufficient
-    valid_entries = (revenue_check > 1) & (clients_check > 1)
-    valid_entries = valid_entries[valid_entries].index
-
-    # Filter the main dataset based on valid entries
-    df = df[df.set_index(['NomeInstituicao', 'AnoMes_Q', 'AnoMes']).index.isin(valid_entries)]
-
-    # Define aggregation buckets for combining multiple components into summary metrics
-    AGGREGATION_BUCKETS = {
-        'Outras Receitas Intermediação': [
-            'Rendas de Operações de Arrendamento Mercantil \n(a2)',
-            'Rendas de Operações com Instrumentos Financeiros Derivativos \n(a4)',
-            'Resultado de Operações de Câmbio \n(a5)',
-            'Rendas de Aplicações Compulsórias \n(a6)'
-        ]
-    }
-
-    # Define the components to be included in different types of waterfall charts
-    COMPONENTS = {
-        'revenue_buildup': [
-            'Rendas de Operações de Crédito \n(a1)',
-            'Rendas de Operações com TVM \n(a3)',
-            'Outras Receitas Intermediação',
-            'Rendas de Prestação de Serviços \n(d1)',
-            'Rendas de Tarifas Bancárias \n(d2)',
-            'Outras Receitas Operacionais \n(d7)',
-            'Receita Operacional'
-        ],
-        'pl_decomposition': [
-            'Receita Operacional',
-            'Despesas de Intermediação Financeira \n(b) = (b1) + (b2) + (b3) + (b4) + (b5)',
-            'Despesas de Pessoal \n(d3)',
-            'Despesas Administrativas \n(d4)',
-            'Despesas Tributárias \n(d5)',
-            'Outras Despesas Operacionais \n(d8)',
-            'Lucro Líquido \n(j) = (g) + (h) + (i)'
-        ],
-        'store_receita_qtd_clientes': [
-            'Receita Operacional',
-            'Quantidade de clientes com operações ativas'
-        ],
-        'intermediation_breakdown': [
-            'Receitas de Intermediação Financeira \n(a) = (a1) + (a2) + (a3) + (a4) + (a5) + (a6)',
-            'Despesas de Captação \n(b1)',
-            'Despesas de Obrigações por Empréstimos e Repasses \n(b2)',
-            'Despesas de Operações de Arrendamento Mercantil \n(b3)',
-            'Resultado de Operações de Câmbio \n(b4)',
-            'Resultado de Provisão para Créditos de Difícil Liquidação \n(b5)',
-            'Resultado de Intermediação Financeira \n(c) = (a) + (b)'
-        ]
-    }
+    # Load data
+    df = _select_periods(load_financial_metrics(input_data_path), periods)
 
-    # Create separate DataFrames for clients and revenue
-    clients_df = df[
-        df['NomeColuna'] == 'Quantidade de clientes com operações ativas'
-    ].copy()
-
-    revenue_df = df[
-        df['NomeColuna'] == 'Receita Operacional'
-    ].copy()
-
-    # Convert filtered data into dictionaries for faster lookup by institution and period
-    clients_dict = clients_df.set_index(['NomeInstituicao', 'AnoMes_Q','AnoMes'])['Saldo'].to_dict()
-    revenue_dict = revenue_df.set_index(['NomeInstituicao', 'AnoMes_Q','AnoMes'])['Saldo'].to_dict()
-
-    # Initialize an empty list to store the results of the data processing for each institution and period
-    results = []
-    # Group data by institution, quarterly period, and monthly period
-    for (inst, period, anomes), group in df.groupby(['NomeInstituicao', 'AnoMes_Q','AnoMes']):
-        # Convert the group's values to a dictionary for easier processing base metrics
-        metrics = group.set_index('NomeColuna')['Saldo'].to_dict()
-
-        # Group data by institution, quarterly period, and monthly period
-        for agg_name, components in AGGREGATION_BUCKETS.items():
-            metrics[agg_name] = sum(metrics.get(comp, 0) for comp in components)
-
-        # Get number of active clients and revenue using dictionary lookup per period
-        num_clients = float(clients_dict.get((inst, period, anomes), 1))
-        receita_op = float(revenue_dict.get((inst, period, anomes), 1))
-
-        # Calculate all three formats for each component
-        # Process each financial component and calculate absolute, percentage, and per-client metrics
-
-        for component_type, components in COMPONENTS.items():
-            for comp in components:
-                value = float(metrics.get(comp, 0))
-
-                # Calculate metrics
-                # Calculate the percentage of revenue if revenue is non-zero
-
-                if receita_op > 1:
-                    percent_revenue = (value / receita_op) * 100
-                else:
-                    percent_revenue = 0
-
-                # Calculate the value per client if clients exist
-                if num_clients > 1:
-                    per_client = value / num_clients
-                else:
-                    per_client = 0
-
-                # Append the calculated metrics to the results list
-                results.append({
-                    'NomeInstituicao': inst,
-                    'AnoMes_Q': period,
-                    'AnoMes': anomes,
-                    'ComponentType': component_type,
-                    'Component': comp,
-                    'ValueAbsolute': value,
-                    'ValuePercentRevenue': percent_revenue,
-                    'ValuePerClient': per_client,
-                    'NumClients': num_clients,
-                    'ReceitaOperacional': receita_op
-                })
-
-    # Convert to DataFrame
-    result_df = pd.DataFrame(results)
+    # Pre-calculate every component per institution and period
+    result_df = compute_financial_metrics(df)
 
     # Save processed data
-    result_df.to_csv(output_data_path, index=False)
+    _write_output(result_df, output_data_path, periods, replace_existing)
     print(f"Processed data saved to {output_data_path}")
 
     return result_df
@@ -625,14 +1082,25 @@ def process_financial_metrics2(
 #----------------------------------------------------------------------------
 
 
-def save_to_sqlite(db_path="../data/bacen_data.db", additional_files=None):
+@profiled_stage()
+def save_to_sqlite(db_path="../data/bacen_data.db", additional_files=None, frames=None, periods=None,
+                   replace_existing=True):
     """
-    Saves multiple data files to a SQLite database.
+    Saves multiple data files to a SQLite database, bulk loaded in a single transaction.
+
+    The report tables (consolidated_reports, credit_pf, credit_pj, market_metrics) are stored as a
+    star schema (fact_saldo with institution, metric and period dimensions and covering indexes)
+    and exposed as views with their usual columns; see scripts.sqlite_store.
 
     Parameters:
         db_path (str): Path to the SQLite database file.
         additional_files (dict, optional): Dictionary of additional files to save
             in format {'table_name': 'file_path'}
+        frames (dict, optional): DataFrames already in memory in format {'table_name': df}
+            (e.g. consolidated_reports from build_derived_tables); their files are not read again.
+        periods (list, optional): Incremental mode: frames only hold the rows of these AnoMes (YYYYMM),
+            which replace the rows of the same periods in their tables instead of the whole tables.
+        replace_existing (bool): With periods, whether the tables may already hold rows of those periods.
 
     Returns:
         None
@@ -643,7 +1111,9 @@ def save_to_sqlite(db_path="../data/bacen_data.db", additional_files=None):
         'institutions': '../data/consolidated_institutions.json',
         'credit_pf': '../data/cred_pf.csv',
         'credit_pj': '../data/cred_pj.csv',
-        'market_metrics': '../data/market_metrics.csv'
+        'market_metrics': '../data/market_metrics.csv',
+        'financial_metrics': '../data/financial_metrics.csv',
+        'financial_metrics_processed': '../data/financial_metrics_processed.csv'
     }
 
     # Combine default_files with any additional files
@@ -651,12 +1121,15 @@ def save_to_sqlite(db_path="../data/bacen_data.db", additional_files=None):
     if additional_files:
         files_to_save.update(additional_files)
 
-    # Connect to SQLite database (create if it doesn't exist)
-    conn = sqlite3.connect(db_path)
-
-    try:
-        # Process each file
+    def load_tables():
+        """(table_name, df) of each table, loaded one at a time while the previous one is written."""
         for table_name, file_path in files_to_save.items():
+            if frames and table_name in frames:
+                print(f"Data from memory saved to table '{table_name}'")
+                profiling.record(rows_in=len(frames[table_name]), rows_out=len(frames[table_name]))
+                yield table_name, frames[table_name]
+                continue
+
             if not Path(file_path).exists():
                 print(f"Warning: File {file_path} not found, skipping...")
                 continue
@@ -664,13 +1137,21 @@ def save_to_sqlite(db_path="../data/bacen_data.db", additional_files=None):
             # Read the file based on its extension
             if file_path.endswith('.json'):
                 df = pd.read_json(file_path)
+            elif data_lake.is_lake_path(file_path):
+                df = data_lake.read_table(file_path)
             else:  # csv files
                 df = pd.read_csv(file_path, dtype={'CodInst': str}, encoding='utf-8')
 
-            # Save DataFrame to SQLite table
-            df.to_sql(table_name, conn, if_exists="replace", index=False)
             print(f"Data from {file_path} saved to table '{table_name}'")
+            profiling.record(rows_in=len(df), rows_out=len(df))
+            yield table_name, df
 
+    # Connect to SQLite database (create if it doesn't exist)
+    conn = sqlite_store.connect(db_path)
+
+    try:
+        # Only the frames are restricted to periods, the files hold whole tables
+        sqlite_store.write_tables(conn, load_tables(), periods, replace_existing, partial_tables=set(frames or {}))
     finally:
         conn.close()
         print(f"All data saved to database {db_path}")
@@ -678,23 +1159,228 @@ def save_to_sqlite(db_path="../data/bacen_data.db", additional_files=None):
 
 #----------------------------------------------------------------------------
 
-# Make the script runnable
-if __name__ == "__main__":
-    # Step 1: Combine all raw CSV files into one consolidated report
-    combined_df = combine_csv_files()
 
-    # Step 2: Transform data to clean version
-    clean_df = transform_data()
+@profiled_stage()
+def make_metric_cubes(output_dir="../data/cubes", input_paths=None, frames=None):
+    """
+    Materializes the institution x period x metric cubes of scripts.cube (market_metrics,
+    credit_data, financial_metrics, financial_metrics_processed) as memory-mapped NumPy files, so the
+    plots and the API slice them instead of grouping and pivoting rows on every request.
 
-    # Step 3: Create specialized datasets
-    cred_pf_df = make_cred_pf_df()
-    cred_pj_df = make_cred_pj_df()
-    market_metrics_df = make_market_metrics_df()
+    The cubes are always rebuilt from the whole tables (also after an incremental run).
 
-    # Step 4: Create financial_metrics_df (when implemented)
-    financial_metrics_df = make_financial_metrics_df()
+    Parameters:
+        output_dir (str): Directory of the cubes. Default "../data/cubes"
+        input_paths (dict, optional): Files of the tables in format {'table_name': 'file_path'}
+            (CSV or partitioned Parquet); updates the default CSV paths.
+        frames (dict, optional): Whole tables already in memory in format {'table_name': df};
+            their files are not read.
 
-    # Step 5: Save all data to SQLite
-    save_to_sqlite()
+    Returns:
+        dict: {cube name: MetricCube} of the cubes written (cubes whose tables are missing are skipped).
+    """
+    from scripts.cube import CUBES, build_cubes
+    from scripts.schema import read_report_csv
 
+    # Default files of the tables
+    files = {
+        'market_metrics': '../data/market_metrics.csv',
+        'credit_pf': '../data/cred_pf.csv',
+        'credit_pj': '../data/cred_pj.csv',
+        'financial_metrics': '../data/financial_metrics.csv',
+        'financial_metrics_processed': '../data/financial_metrics_processed.csv'
+    }
+    if input_paths:
+        files.update(input_paths)
+
+    # Columns of each table the cubes use (the only ones loaded)
+    table_columns = {}
+    for spec in CUBES.values():
+        for table_name in spec['tables']:
+            columns = table_columns.setdefault(table_name, ['NomeInstituicao', 'AnoMes'])
+            columns.extend(col for col in spec['metric_columns'] + spec['value_columns'] if col not in columns)
+
+    tables = dict(frames or {})
+    for table_name, columns in table_columns.items():
+        if table_name in tables:
+            continue
+        file_path = files.get(table_name)
+        if file_path is None or not Path(file_path).exists():
+            print(f"Warning: File {file_path} not found, cubes of '{table_name}' skipped...")
+            continue
+        tables[table_name] = data_lake.read_table(file_path, columns=columns) if data_lake.is_lake_path(file_path) \
+            else read_report_csv(file_path, usecols=columns)
+        profiling.record(rows_in=len(tables[table_name]))
+
+    cubes = build_cubes(tables, output_dir)
+    for name, cube in cubes.items():
+        print(f"Cube '{name}' {cube.shape} saved to {os.path.join(output_dir, name)}")
+    return cubes
+
+
+@profiled_stage()
+def make_market_share_df(output_data_path="../data/market_share.csv", cubes=None, cube_dir="../data/cubes"):
+    """
+    Precomputes the quarterly market share (saldo, market total, share and rank of every
+    institution) of every plot_market_share feature and plot_share_credit_modality modality, so
+    the API serves them by lookup (see scripts.market_share).
+
+    Parameters:
+        output_data_path (str): Path of the share table (CSV, or .parquet). Default "../data/market_share.csv"
+        cubes (dict, optional): {name: MetricCube} from make_metric_cubes; the market_metrics and
+            credit_data cubes of cube_dir are loaded when not given.
+        cube_dir (str): Directory of the cubes. Default "../data/cubes"
+
+    Returns:
+        pd.DataFrame: The share table.
+    """
+    from scripts.cube import MetricCube
+    from scripts.market_share import SHARE_METRICS, build_share_table
+
+    if cubes is None:
+        cubes = {name: MetricCube.load(os.path.join(cube_dir, name)) for name in SHARE_METRICS
+                 if Path(cube_dir, name).exists()}
+
+    share_df = build_share_table(cubes)
+    _write_output(share_df, output_data_path)
+    print(f"Market share table saved to {output_data_path}")
+
+    return share_df
+
+
+@profiled_stage(rows_in='share_df')
+def make_concentration_df(
+    output_data_path="../data/market_concentration.csv",
+    share_df=None,
+    share_data_path="../data/market_share.csv",
+    periods=None
+):
+    """
+    Computes the market concentration (HHI, CR3/CR5/CR10, Gini) of every market share feature and
+    credit modality in every quarter (see scripts.concentration).
+
+    Parameters:
+        output_data_path (str): Path of the concentration table (CSV, or .parquet).
+            Default "../data/market_concentration.csv"
+        share_df (pd.DataFrame, optional): Market share table from make_market_share_df;
+            share_data_path is read when not given.
+        share_data_path (str): Path of the market share table.
+        periods (list, optional): Incremental mode: only recompute the quarters of these AnoMes
+            (YYYYMM) and replace them in the existing output. Default None recomputes every quarter.
+
+    Returns:
+        pd.DataFrame: The concentration of the quarters computed.
+    """
+    from scripts.concentration import concentration_metrics, quarter_end_periods
+
+    if share_df is None:
+        share_df = _read_periods(share_data_path)
+
+    concentration_df = concentration_metrics(share_df, periods)
+
+    # The share table is keyed by quarter: a quarter already in the output (monthly data) is replaced
+    _write_output(concentration_df, output_data_path, None if periods is None else quarter_end_periods(periods))
+    print(f"Market concentration saved to {output_data_path}")
+
+    return concentration_df
+
+
+#----------------------------------------------------------------------------
+
+# Make the script runnable
+if __name__ == "__main__":
+    # "python etl.py parquet" writes every output as a partitioned Parquet table (scripts.data_lake)
+    output_format = sys.argv[1] if len(sys.argv) > 1 else "csv"
+    if output_format not in ("csv", "parquet"):
+        raise SystemExit(f"Invalid output format: {output_format}")
+
+    institutions_path = "../data/consolidated_institutions.json"
+    reports_path = f"../data/consolidated_reports.{output_format}"
+    clean_path = f"../data/consolidated_cleaned.{output_format}"
+    table_paths = {table: f"../data/{name}.{output_format}" for table, name in
+                   [('credit_pf', 'cred_pf'), ('credit_pj', 'cred_pj'), ('market_metrics', 'market_metrics'),
+                    ('financial_metrics', 'financial_metrics'),
+                    ('financial_metrics_processed', 'financial_metrics_processed')]}
+    outputs = [reports_path, clean_path, *table_paths.values(), "../data/bacen_data.db"]
+    etl_args = dict(output_format=output_format, max_workers=4)
+
+    # Time, memory, rows and bytes of every stage, saved as a JSON run report at the end; two reports
+    # are compared with "python -m scripts.profiling diff old.json new.json"
+    run_report_path = f"../data/run_reports/etl_{datetime.now():%Y%m%dT%H%M%S}.json"
+    run = profiling.start_run(output_format=output_format)
+
+    # Step 0: Find the raw periods that are new or were revised since the last run
+    periods_to_process = changed_periods()
+    institutions_changed = input_changed("institutions", institutions_path)
+    if not periods_to_process and not institutions_changed:
+        print("No new or revised periods since the last ETL run, existing outputs reused.")
+        raise SystemExit(0)
+
+    # Incremental mode needs the outputs of a previous run (and a database already in the star
+    # schema). A new institutions registry can rename institutions of any period, so it triggers a
+    # full rebuild.
+    already_processed = processed_periods()
+    incremental = (bool(already_processed) and not institutions_changed and all(Path(p).exists() for p in outputs)
+                   and sqlite_store.has_star_schema("../data/bacen_data.db"))
+
+    run.meta.update(incremental=incremental, periods=sorted(int(period) for period in periods_to_process))
+
+    if incremental:
+        print(f"Periods to process: {periods_to_process}")
+        # Revised quarters must replace their rows; brand new ones are simply appended
+        incremental_args = dict(periods=periods_to_process,
+                                replace_existing=bool(set(periods_to_process) & already_processed))
+
+        # Step 1: Combine the raw CSV files of the changed periods into the consolidated report
+        combined_df = combine_csv_files(output_file=reports_path, **incremental_args)
+
+        # Step 2: Transform only those rows into the clean version
+        clean_df = transform_data(input_data_path=reports_path, output_data_path=clean_path, df=combined_df,
+                                  **incremental_args)
+
+        # Step 3: Rebuild the specialized datasets, financial metrics and waterfall components for
+        # those periods only
+        tables = build_derived_tables(df_clean=load_clean_data(clean_path, df=clean_df), **etl_args,
+                                      **incremental_args)
+        process_financial_metrics2(input_data_path=table_paths['financial_metrics'],
+                                   output_data_path=table_paths['financial_metrics_processed'], **incremental_args)
+
+        # Step 4: Replace those periods in SQLite
+        save_to_sqlite(frames={table: tables[table] for table in
+                               ['consolidated_reports', 'credit_pf', 'credit_pj', 'market_metrics', 'financial_metrics']},
+                       additional_files=table_paths, **incremental_args)
+    else:
+        print("Full rebuild of every ETL output.")
+
+        # Step 1: Combine all raw CSV files into one consolidated report
+        combine_csv_files(output_file=reports_path)
+
+        # Step 2: Transform data to clean version, streaming the consolidated report in chunks
+        transform_data(input_data_path=reports_path, output_data_path=clean_path, chunksize=TRANSFORM_CHUNKSIZE)
+
+        # Step 3: Create specialized datasets and financial_metrics_df, parsing the cleaned data once,
+        # then the waterfall components of financial_metrics_processed
+        tables = build_derived_tables(input_data_path=clean_path, **etl_args)
+        process_financial_metrics2(input_data_path=table_paths['financial_metrics'],
+                                   output_data_path=table_paths['financial_metrics_processed'])
+
+        # Step 4: Save all data to SQLite (the cleaned data straight from memory)
+        save_to_sqlite(frames={'consolidated_reports': tables['consolidated_reports']}, additional_files=table_paths)
+
+    # Step 5: Rebuild the institution x period x metric cubes the plots slice (whole tables), and
+    # the market shares and ranks the API serves from them
+    cubes = make_metric_cubes(input_paths=table_paths)
+    share_df = make_market_share_df(f"../data/market_share.{output_format}", cubes=cubes)
+
+    # Step 6: Market concentration of the quarters received (all of them on a full rebuild, or
+    # when there is no previous output to merge them into)
+    concentration_path = f"../data/market_concentration.{output_format}"
+    make_concentration_df(concentration_path, share_df=share_df,
+                          periods=periods_to_process if incremental and Path(concentration_path).exists() else None)
+
+    # Step 7: Remember what was processed, so the next run skips unchanged periods
+    mark_periods_processed(periods_to_process)
+    mark_input_processed("institutions", institutions_path)
+
+    profiling.print_report(profiling.finish_run(run_report_path))
     print("ETL process completed successfully!")
@@ -1,12 +1,490 @@
 import os
-import time
+import codecs
+import shutil
+import tempfile
+import threading
 import requests
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 from pathlib import Path
 from typing import List
+from urllib.parse import urlparse
 import pandas as pd
 import json
 
+from scripts.rate_limiter import get_default_rate_limiter, request_with_backoff
+from scripts.http_session import get_default_session, connection_stats, diff_connection_stats
+from scripts.manifest import Manifest
+from scripts.change_detection import DOWNLOAD_MANIFEST, file_sha256
+from scripts.schema import normalize_raw_report, raw_report_arrow_schema
+
+
+# Connection slots shared by all downloads, keyed by (host, max_connections_per_host)
+_HOST_SLOTS = {}
+_HOST_SLOTS_LOCK = threading.Lock()
+
+
+def _host_slots(url, max_connections_per_host):
+    """
+    Returns the semaphore shared by every request sent to the host of url, so concurrent
+    periods and pages never keep more than max_connections_per_host requests in flight.
+    """
+    key = (urlparse(url).netloc, max_connections_per_host)
+    with _HOST_SLOTS_LOCK:
+        if key not in _HOST_SLOTS:
+            _HOST_SLOTS[key] = threading.BoundedSemaphore(max_connections_per_host)
+        return _HOST_SLOTS[key]
+
+
+def _stream_page(response, out, drop_header, chunk_size):
+    """
+    Streams a page body into the open text file out, chunk by chunk.
+
+    The header line is dropped on the fly when drop_header is True and rows are counted
+    incrementally, so no page is ever held in memory as a whole. Chunks are decoded with
+    the response charset (utf-8 if the server sends none).
+
+    Returns:
+        tuple: (rows, is_last_page) where rows is the number of data lines in the page and
+        is_last_page is True when the page is empty or holds only the header line.
+    """
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+    newlines = 0
+    has_content = False
+    ends_with_newline = True
+    header_pending = drop_header
+
+    def consume(chunk):
+        nonlocal newlines, has_content, ends_with_newline, header_pending
+        if not chunk:
+            return
+        newlines += chunk.count('\n')
+        has_content = has_content or not chunk.isspace()
+        ends_with_newline = chunk.endswith('\n')
+
+        # Drop everything up to and including the first newline (the CSV header)
+        if header_pending:
+            header_end = chunk.find('\n')
+            if header_end == -1:
+                return
+            chunk = chunk[header_end + 1:]
+            header_pending = False
+        out.write(chunk)
+
+    for raw_chunk in response.iter_content(chunk_size=chunk_size):
+        consume(decoder.decode(raw_chunk))
+    consume(decoder.decode(b"", final=True))
+
+    lines = newlines + (0 if ends_with_newline else 1)
+    rows = max(lines - 1, 0)
+    is_last_page = not has_content or newlines <= 1
+    return rows, is_last_page
+
+
+def _fetch_page(session, url, skip, page_size, data_format, timeout, max_retries, period,
+                host_slots, rate_limiter, out, chunk_size, keep_header=False):
+    """
+    Requests a single page ($top/$skip) of a period through the shared rate limiter and
+    streams it into out (header dropped for every page but the first, unless keep_header),
+    holding one of the host's connection slots from the request until the body is read.
+
+    Network errors, 429 and 5xx responses are retried with jittered exponential backoff;
+    if the connection breaks mid-body, out is rolled back and the page is requested again.
+
+    Returns:
+        tuple: (rows, is_last_page), see _stream_page.
+
+    Raises:
+        requests.exceptions.RequestException: If the page still fails after max_retries retries.
+    """
+    # Set up parameters for pagination and format
+    params = {
+        "$top": page_size,
+        "$skip": skip,
+        "$format": data_format
+    }
+
+    # API Request, taking one of the host's connection slots. A failed request gives it back
+    # right away (not held through the backoff); a successful one keeps it until its body is read.
+    def send():
+        host_slots.acquire()
+        try:
+            response = session.get(url, params=params, timeout=timeout, stream=True)
+            response.raise_for_status()
+        except BaseException:
+            host_slots.release()
+            raise
+        return response
+
+    start = out.tell()
+    attempt = 0
+    while True:
+        response = request_with_backoff(send, rate_limiter, max_retries, description=f"{period} ($skip={skip})")
+        try:
+            with response:
+                return _stream_page(response, out, skip > 0 and not keep_header, chunk_size)
+        except (requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout) as e:
+            attempt += 1
+            if attempt > max_retries:
+                raise
+            logging.warning(f"Page {period} ($skip={skip}) broke mid-stream, retrying ({attempt}/{max_retries}): {e}")
+            rate_limiter.record_retry()
+            out.seek(start)
+            out.truncate()
+        finally:
+            # The body is streamed (or the attempt failed): the connection slot is free
+            host_slots.release()
+
+
+def _fetch_page_to_spool(session, url, skip, page_size, data_format, timeout, max_retries, period,
+                         host_slots, rate_limiter, chunk_size, spool_max_size, keep_header=False):
+    """
+    Fetches a page into a SpooledTemporaryFile (kept in memory up to spool_max_size bytes,
+    on disk beyond that), so pages fetched ahead of their turn stay bounded in memory.
+
+    Returns:
+        tuple: (spool, rows, is_last_page) with spool rewound to the start.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_max_size, mode="w+", encoding="utf-8", newline="")
+    try:
+        rows, is_last_page = _fetch_page(session, url, skip, page_size, data_format, timeout, max_retries,
+                                         period, host_slots, rate_limiter, spool, chunk_size, keep_header)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, rows, is_last_page
+
+
+def _resume_point(manifest, filepath, page_size):
+    """
+    Reads the checkpoint of filepath and prepares the file for resuming.
+
+    Returns:
+        int or None: $skip of the next page to download (0 for a fresh download), or None if
+        the period is already complete. A partial file is truncated back to the end of its
+        last checkpointed page, dropping anything written after it.
+    """
+    checkpoint = manifest.get(os.path.basename(filepath))
+    if not checkpoint or not os.path.exists(filepath) or checkpoint.get('page_size') != page_size:
+        return 0
+
+    # Never trust a file shorter than what the checkpoint recorded
+    if os.path.getsize(filepath) < checkpoint['bytes']:
+        return 0
+
+    if checkpoint.get('complete'):
+        return None
+
+    with open(filepath, 'r+b') as f:
+        f.truncate(checkpoint['bytes'])
+    # Manifests written before last_skip kept the list of every completed $skip
+    last_skip = checkpoint.get('last_skip', (checkpoint.get('completed_skips') or [None])[-1])
+    return last_skip + page_size if last_skip is not None else 0
+
+
+def _download_period(
+    session,
+    period,
+    filepath,
+    url,
+    page_size,
+    data_format,
+    timeout,
+    max_retries,
+    pages_in_flight,
+    host_slots,
+    rate_limiter,
+    stop_event,
+    manifest,
+    resume,
+    chunk_size,
+    spool_max_size
+):
+    """
+    Downloads every page of one period into filepath.
+
+    Pages are streamed in chunks of chunk_size bytes, so memory stays flat whatever the page_size.
+    With pages_in_flight > 1 pages are requested in windows of concurrent requests, spooled
+    (in memory up to spool_max_size, on disk beyond) and copied in $skip order, so the file is
+    identical to a one-page-at-a-time download.
+    After every page the manifest records the last completed $skip, the rows so far and the file
+    size (a fixed-size entry, so checkpointing stays cheap on long periods); with resume=True a rerun continues after the last good page and skips the
+    period altogether if it was already complete.
+
+    Returns:
+        str: "downloaded" if pagination completed, "skipped" if the period was already complete,
+        "stopped" if the download was stopped early.
+    """
+    filename = os.path.basename(filepath)
+    skip = _resume_point(manifest, filepath, page_size) if resume else 0
+    if skip is None:
+        logging.info(f"Period {period} already complete, skipping.")
+        return "skipped"
+
+    if skip == 0:
+        logging.info(f"Downloading data for period {period}...")
+        checkpoint = {'pages': 0, 'total_rows': 0}
+    else:
+        logging.info(f"Resuming period {period} from $skip={skip}...")
+        checkpoint = manifest.get(filename)
+        checkpoint.setdefault('pages', len(checkpoint.get('completed_skips', [])))
+
+    fetch_args = (session, url)
+    fetch_kwargs = dict(page_size=page_size, data_format=data_format, timeout=timeout,
+                        max_retries=max_retries, period=period, host_slots=host_slots,
+                        rate_limiter=rate_limiter, chunk_size=chunk_size)
+
+    # Open the target file once: from scratch, or positioned after the last checkpointed page
+    if skip == 0:
+        f = open(filepath, 'w', encoding="utf-8")
+    else:
+        f = open(filepath, 'r+', encoding="utf-8")
+        f.seek(0, os.SEEK_END)
+
+    def checkpoint_page(page_skip, rows, is_last_page):
+        f.flush()
+        checkpoint['pages'] += 1
+        checkpoint['total_rows'] += rows
+        manifest.update(
+            filename,
+            period=period,
+            page_size=page_size,
+            last_skip=page_skip,
+            pages=checkpoint['pages'],
+            total_rows=checkpoint['total_rows'],
+            bytes=os.path.getsize(filepath),
+            complete=is_last_page
+        )
+
+    with f:
+        # One page at a time: stream straight into the target file
+        if pages_in_flight == 1:
+            while not stop_event.is_set():
+                rows, is_last_page = _fetch_page(*fetch_args, skip=skip, out=f, **fetch_kwargs)
+                checkpoint_page(skip, rows, is_last_page)
+                if is_last_page:
+                    return "downloaded"
+                skip += page_size
+            return "stopped"
+
+        # Several pages at once: each page is spooled, then copied in $skip order
+        with ThreadPoolExecutor(max_workers=pages_in_flight) as page_pool:
+            while not stop_event.is_set():
+                # Request the next window of pages at once
+                window = [skip + i * page_size for i in range(pages_in_flight)]
+                futures = [
+                    page_pool.submit(_fetch_page_to_spool, *fetch_args, skip=page_skip,
+                                     spool_max_size=spool_max_size, **fetch_kwargs)
+                    for page_skip in window
+                ]
+
+                try:
+                    # Consume the window in order, stopping at the first empty page
+                    for page_skip, future in zip(window, futures):
+                        spool, rows, is_last_page = future.result()
+                        with spool:
+                            shutil.copyfileobj(spool, f)
+                        checkpoint_page(page_skip, rows, is_last_page)
+
+                        # Check if pagination is complete
+                        if is_last_page:
+                            return "downloaded"
+                finally:
+                    # Release spools of pages fetched past the end (or of an aborted window)
+                    for future in futures:
+                        if not future.cancel() and not future.exception():
+                            future.result()[0].close()
+
+                # Increment for next window
+                skip += page_size * pages_in_flight
+
+    return "stopped"
+
+
+def _download_period_parquet(
+    session,
+    period,
+    filepath,
+    url,
+    page_size,
+    data_format,
+    timeout,
+    max_retries,
+    pages_in_flight,
+    host_slots,
+    rate_limiter,
+    stop_event,
+    manifest,
+    resume,
+    chunk_size,
+    spool_max_size
+):
+    """
+    Downloads every page of one period and writes it as a single typed Parquet file.
+
+    Each page is parsed as soon as it arrives (Saldo as float, CodInst zero-padded, integer
+    report columns, see scripts.schema) and appended to the file as a row group. The file is
+    written under a temporary name and only moved into place once pagination completes, so
+    a partial period is simply downloaded again; complete periods are skipped when resume=True.
+
+    Returns:
+        str: "downloaded" if pagination completed, "skipped" if the period was already complete,
+        "stopped" if the download was stopped early.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    filename = os.path.basename(filepath)
+    checkpoint = manifest.get(filename)
+    if resume and checkpoint and checkpoint.get('complete') and os.path.exists(filepath):
+        logging.info(f"Period {period} already complete, skipping.")
+        return "skipped"
+
+    logging.info(f"Downloading data for period {period} to Parquet...")
+    Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{filepath}.partial"
+    writer = None
+    total_rows = 0
+    skip = 0
+
+    try:
+        with ThreadPoolExecutor(max_workers=pages_in_flight) as page_pool:
+            while not stop_event.is_set():
+                # Request the next window of pages at once, each one with its own header
+                window = [skip + i * page_size for i in range(pages_in_flight)]
+                futures = [
+                    page_pool.submit(_fetch_page_to_spool, session, url, page_skip, page_size, data_format,
+                                     timeout, max_retries, period, host_slots, rate_limiter, chunk_size,
+                                     spool_max_size, keep_header=True)
+                    for page_skip in window
+                ]
+
+                try:
+                    # Consume the window in order, stopping at the first empty page
+                    for future in futures:
+                        spool, rows, is_last_page = future.result()
+                        with spool:
+                            if rows > 0:
+                                page_df = normalize_raw_report(pd.read_csv(spool, dtype=str))
+                                if writer is None:
+                                    schema = raw_report_arrow_schema(page_df.columns)
+                                    writer = pq.ParquetWriter(tmp_path, schema)
+                                writer.write_table(pa.Table.from_pandas(page_df, schema=schema, preserve_index=False))
+                                total_rows += len(page_df)
+
+                        # Check if pagination is complete
+                        if is_last_page:
+                            if writer is None:
+                                # Period without data: keep an empty file so readers see the partition
+                                writer = pq.ParquetWriter(tmp_path, raw_report_arrow_schema([]))
+                            writer.close()
+                            writer = None
+                            os.replace(tmp_path, filepath)
+                            manifest.update(
+                                filename,
+                                period=period,
+                                page_size=page_size,
+                                total_rows=total_rows,
+                                bytes=os.path.getsize(filepath),
+                                complete=True
+                            )
+                            return "downloaded"
+                finally:
+                    # Release spools of pages fetched past the end (or of an aborted window)
+                    for future in futures:
+                        if not future.cancel() and not future.exception():
+                            future.result()[0].close()
+
+                # Increment for next window
+                skip += page_size * pages_in_flight
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return "stopped"
+
+
+def _download_job(period, tipo_instituicao, relatorio, resume, settings, manifest, stop_event):
+    """
+    Downloads one (AnoMes, TipoInstituicao, Relatorio) job into settings['output_dir'] and records
+    the content hash of the file read by the ETL change detection.
+
+    Parameters:
+        settings (dict): Fetch settings shared by every job of a run (session, rate limiter, host
+            slots, page size, output format...), see download_historical_data.
+
+    Returns:
+        tuple: (status, filepath) where status is "downloaded", "skipped" or "stopped".
+
+    Raises:
+        requests.exceptions.RequestException: If a page still fails after max_retries retries.
+    """
+    filename = f"data_{period}_Tipo{tipo_instituicao}_Relatorio{relatorio}"
+    if settings['output_format'] == "parquet":
+        filepath = os.path.join(settings['output_dir'], "parquet", f"AnoMes={period}", f"{filename}.parquet")
+        download_period_fn = _download_period_parquet
+    else:
+        filepath = os.path.join(settings['output_dir'], f"{filename}.csv")
+        download_period_fn = _download_period
+
+    # Build endpoint with proper query parameters
+    endpoint = f"{settings['endpoint_template']}?@AnoMes={period}&@TipoInstituicao={tipo_instituicao}&@Relatorio='{relatorio}'"
+
+    # Hash of the previous download, to tell revised periods from unchanged ones
+    previous_sha256 = (manifest.get(os.path.basename(filepath)) or {}).get('sha256')
+
+    status = download_period_fn(
+        settings['session'], period, filepath, settings['base_url'] + endpoint, settings['page_size'],
+        settings['data_format'], settings['timeout'], settings['max_retries'], settings['pages_in_flight'],
+        settings['host_slots'], settings['rate_limiter'], stop_event, manifest, resume,
+        settings['chunk_size'], settings['spool_max_size']
+    )
+
+    # Record the content hash read by the ETL change detection, and log successful download
+    if status == "downloaded":
+        sha256 = file_sha256(filepath)
+        manifest.update(os.path.basename(filepath), sha256=sha256, mtime_ns=os.stat(filepath).st_mtime_ns)
+        if previous_sha256 is None:
+            logging.info(f"Period {period} is new.")
+        elif previous_sha256 != sha256:
+            logging.info(f"Period {period} was revised since the last download.")
+        else:
+            logging.info(f"Period {period} is unchanged since the last download.")
+        logging.info(f"Successfully downloaded: {filepath}")
+
+    return status, filepath
+
+
+def _fetch_settings(output_dir, base_url, endpoint_template, output_format, data_format, page_size, timeout,
+                    max_retries, pages_in_flight, max_connections_per_host, rate_limiter, session,
+                    chunk_size, spool_max_size):
+    """Validates the fetch options shared by all jobs of a run and resolves the shared components."""
+    if output_format not in ("csv", "parquet"):
+        raise ValueError(f"Invalid output_format: {output_format}")
+
+    return {
+        'output_dir': output_dir,
+        'base_url': base_url,
+        'endpoint_template': endpoint_template,
+        'output_format': output_format,
+        'data_format': data_format,
+        'page_size': page_size,
+        'timeout': timeout,
+        'max_retries': max_retries,
+        'pages_in_flight': pages_in_flight,
+        'host_slots': _host_slots(base_url, max_connections_per_host),
+        'rate_limiter': rate_limiter or get_default_rate_limiter(),
+        'session': session or get_default_session(),
+        'chunk_size': chunk_size,
+        'spool_max_size': spool_max_size
+    }
+
 
 def download_historical_data(
     years: List[int],
@@ -19,100 +497,269 @@ def download_historical_data(
     data_format="text/csv",
     page_size=1000,
     timeout=30,
-    max_retries=3
+    max_retries=3,
+    max_workers=1,
+    pages_in_flight=1,
+    max_connections_per_host=4,
+    rate_limiter=None,
+    session=None,
+    resume=True,
+    chunk_size=64 * 1024,
+    spool_max_size=1024 * 1024,
+    output_format="csv",
+    refresh_last_n=0
 ):
     """
     Automates downloading historical data from Bacen Relatorios API, with pagination, retries, and file logging.
+
+    With the defaults periods and pages are fetched one at a time. Setting max_workers > 1 downloads
+    several periods at once and pages_in_flight > 1 requests several pages of a period at once; in both
+    cases no more than max_connections_per_host requests are sent to the API host simultaneously and
+    the files written are byte-identical to the serial download.
+
+    Request pacing is left to an AdaptiveRateLimiter (token bucket with jittered exponential backoff
+    that honours Retry-After), so pages are fetched as fast as the server allows.
+
+    Parameters:
+        max_workers (int): Number of periods downloaded concurrently. Default 1 (serial).
+        pages_in_flight (int): Number of pages of a period requested concurrently. Default 1.
+        max_connections_per_host (int): Cap on simultaneous requests to the API host. Default 4.
+        max_retries (int): Retries per page on network errors, 429 and 5xx responses. Default 3.
+        rate_limiter (AdaptiveRateLimiter, optional): Limiter shared by all Olinda requests.
+            Default is the process-wide limiter from get_default_rate_limiter().
+        session (requests.Session, optional): Pooled keep-alive session used for every page.
+            Default is the process-wide session from get_default_session(); the numbers of new
+            and reused connections are written to download.log.
+        resume (bool): If True, reads the checkpoint manifest (download_manifest.json in output_dir)
+            to skip periods that are already complete and to resume partial ones after their last
+            good page. If False every period is downloaded again from $skip=0. Default True.
+        chunk_size (int): Bytes read at a time while streaming a page to disk. Default 64 KiB.
+        spool_max_size (int): Bytes of a page fetched ahead of its turn (pages_in_flight > 1) kept in
+            memory before spilling to a temporary file. Default 1 MiB.
+        output_format (str): "csv" writes the raw API text to data_{period}_Tipo{t}_Relatorio{r}.csv
+            (default). "parquet" parses every page into typed columns and writes one file per period to
+            output_dir/parquet/AnoMes={period}/data_{period}_Tipo{t}_Relatorio{r}.parquet, which
+            combine_csv_files(input_format="parquet") reads without any CSV parsing. Requires pyarrow.
+        refresh_last_n (int): Number of most recent periods downloaded again even when complete, since
+            BACEN revises recent quarters. Default 0.
+
+    Every completed period file gets a sha256 in download_manifest.json; the ETL compares it with the
+    hashes it last processed (scripts.change_detection) to skip unchanged periods.
     """
+    settings = _fetch_settings(output_dir, base_url, endpoint_template, output_format, data_format, page_size,
+                               timeout, max_retries, pages_in_flight, max_connections_per_host, rate_limiter,
+                               session, chunk_size, spool_max_size)
+
     # Ensure output directory exists
     Path(output_dir).mkdir(parents=True, exist_ok=True)
     # Setup logging
     logging.basicConfig(filename=os.path.join(output_dir, "download.log"), level=logging.INFO)
     logging.info("Download process started.")
 
-    # Iterate through years and months
-    for year in years:
-        for month in months:
-            period = f"{year}{month:02d}"
-            filename = f"data_{period}_Tipo{tipo_instituicao}_Relatorio{relatorio}.csv"
-            filepath = os.path.join(output_dir, filename)
-
-            logging.info(f"Downloading data for period {period}...")
-            skip = 0
-            retry_count = 0
-            success = True
-            first_page = True
-
-            while True:
-                try:
-                    # Build endpoint with proper query parameters
-                    endpoint = f"{endpoint_template}?@AnoMes={period}&@TipoInstituicao={tipo_instituicao}&@Relatorio='{relatorio}'"
-
-                    # Set up parameters for pagination and format
-                    params = {
-                        "$top": page_size,
-                        "$skip": skip,
-                        "$format": data_format
-                    }
-
-                    # API Request
-                    response = requests.get(base_url + endpoint, params=params, timeout=timeout)
-                    response.raise_for_status()
-
-                    # Process response text (skip headers for subsequent pages)
-                    if skip > 0:
-                        response_text = '\n'.join(response.text.split('\n')[1:])
-                    else:
-                        response_text = response.text
-
-                    # Write/Append data to file
-                    mode = 'w' if first_page else 'a'
-                    with open(filepath, mode, encoding="utf-8") as f:
-                        f.write(response_text)
-
-                    # Check if pagination is complete
-                    if len(response.text.strip()) == 0 or len(response.text.split('\n')) <= 2:  # Only headers or empty
-                        break
-
-                    # Increment for next page
-                    skip += page_size
-                    first_page = False
-
-                    # Add delay between requests to avoid rate limiting
-                    time.sleep(1)
-
-                except requests.exceptions.RequestException as e:
-                    retry_count += 1
-                    if retry_count > max_retries:
-                        success = False
-                        logging.error(f"Failed to download {period} after {max_retries} retries: {e}")
-                        # Check if it's a server error (500)
-                        if hasattr(e.response, 'status_code') and e.response.status_code == 500:
-                            logging.error("Server returned 500 error. Stopping further downloads.")
-                            print("Server returned 500 error. Stopping further downloads.")
-                            return  # Early stop all downloads
-                        break
-                    logging.warning(f"Retrying {period}... ({retry_count}/{max_retries})")
-                    time.sleep(5)  # Longer delay on errors
-
-            # Log successful download
-            if success:
-                logging.info(f"Successfully downloaded: {filepath}")
+    connections_before = connection_stats(settings['session'])
+    manifest = Manifest(os.path.join(output_dir, DOWNLOAD_MANIFEST))
+    stop_event = threading.Event()
+
+    def download_period(period):
+        if stop_event.is_set():
+            return
+
+        try:
+            _download_job(period, tipo_instituicao, relatorio, resume and period not in refresh_periods,
+                          settings, manifest, stop_event)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Failed to download {period} after {max_retries} retries: {e}")
+            # Check if it's a server error (500)
+            if hasattr(e.response, 'status_code') and e.response.status_code == 500:
+                logging.error("Server returned 500 error. Stopping further downloads.")
+                print("Server returned 500 error. Stopping further downloads.")
+                stop_event.set()  # Early stop all downloads
 
+    # Iterate through years and months
+    periods = [f"{year}{month:02d}" for year in years for month in months]
+    refresh_periods = set(sorted(periods)[-refresh_last_n:]) if refresh_last_n else set()
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as period_pool:
+            list(period_pool.map(download_period, periods))
+    else:
+        for period in periods:
+            download_period(period)
+            if stop_event.is_set():
+                break
+
+    logging.info(f"HTTP connections: {diff_connection_stats(connection_stats(settings['session']), connections_before)}")
+    if stop_event.is_set():
+        return
+
+    logging.info(f"Rate limiter stats: {settings['rate_limiter'].stats()}")
     logging.info("Download process completed.")
 
 
+def schedule_downloads(
+    years: List[int],
+    months: List[int],
+    tipos_instituicao=(1, 2, 3),
+    relatorios=("T",),
+    jobs=None,
+    output_dir="data/data_raw_reports",
+    base_url="https://olinda.bcb.gov.br/olinda/servico/IFDATA/versao/v1/odata",
+    endpoint_template="/IfDataValores(AnoMes=@AnoMes,TipoInstituicao=@TipoInstituicao,Relatorio=@Relatorio)",
+    data_format="text/csv",
+    page_size=1000,
+    timeout=30,
+    max_retries=3,
+    max_workers=4,
+    pages_in_flight=1,
+    max_connections_per_host=4,
+    rate_limiter=None,
+    session=None,
+    resume=True,
+    chunk_size=64 * 1024,
+    spool_max_size=1024 * 1024,
+    output_format="csv"
+):
+    """
+    Downloads a matrix of (TipoInstituicao, Relatorio, AnoMes) jobs over one shared worker pool.
+
+    Every job goes through the same rate limiter, pooled session and per-host connection cap, so
+    adding institution types or reports grows the queue rather than the number of separate runs.
+    Jobs are queued most recent period first; each one's state (pending, running, downloaded,
+    skipped, failed) is kept in download_jobs_status.json in output_dir. A failed job is recorded
+    and the remaining jobs keep running.
+
+    Parameters:
+        years (List[int]), months (List[int]): Periods of the matrix.
+        tipos_instituicao (iterable): TipoInstituicao codes, e.g. 1 conglomerados financeiros,
+            2 conglomerados prudenciais, 3 instituições individuais. Default (1, 2, 3).
+        relatorios (iterable): Relatorio codes to download. Default ("T",).
+        jobs (list of tuple, optional): Explicit (tipo_instituicao, relatorio, period) jobs, used
+            instead of the years x months x tipos x relatorios matrix.
+        max_workers (int): Number of jobs downloaded concurrently. Default 4.
+        Other parameters: see download_historical_data.
+
+    Returns:
+        dict: {job_key: status} where job_key is "Tipo{t}_Relatorio{r}_{AnoMes}".
+    """
+    settings = _fetch_settings(output_dir, base_url, endpoint_template, output_format, data_format, page_size,
+                               timeout, max_retries, pages_in_flight, max_connections_per_host, rate_limiter,
+                               session, chunk_size, spool_max_size)
+
+    # Ensure output directory exists
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    # Setup logging
+    logging.basicConfig(filename=os.path.join(output_dir, "download.log"), level=logging.INFO)
+
+    if jobs is None:
+        jobs = [(tipo, relatorio, f"{year}{month:02d}")
+                for tipo in tipos_instituicao for relatorio in relatorios
+                for year in years for month in months]
+
+    # Most recent periods first, then by institution type and report
+    jobs = sorted(set(jobs), key=lambda job: (-int(job[2]), str(job[0]), str(job[1])))
+    logging.info(f"Download scheduler started with {len(jobs)} jobs.")
+
+    connections_before = connection_stats(settings['session'])
+    manifest = Manifest(os.path.join(output_dir, DOWNLOAD_MANIFEST))
+    status_file = Manifest(os.path.join(output_dir, "download_jobs_status.json"))
+    stop_event = threading.Event()
+
+    def job_key(job):
+        tipo, relatorio, period = job
+        return f"Tipo{tipo}_Relatorio{relatorio}_{period}"
+
+    status_file.update_many({job_key(job): {'status': "pending", 'error': None} for job in jobs})
+
+    def run_job(job):
+        tipo, relatorio, period = job
+        key = job_key(job)
+        status_file.update(key, status="running", started_at=datetime.now().isoformat(timespec='seconds'))
+        try:
+            status, filepath = _download_job(period, tipo, relatorio, resume, settings, manifest, stop_event)
+            status_file.update(key, status=status, file=filepath)
+        except Exception as e:
+            logging.error(f"Job {key} failed: {e}")
+            status = "failed"
+            status_file.update(key, status=status, error=str(e))
+        status_file.update(key, finished_at=datetime.now().isoformat(timespec='seconds'))
+        return key, status
+
+    with ThreadPoolExecutor(max_workers=max_workers) as job_pool:
+        results = dict(job_pool.map(run_job, jobs))
+
+    failed = [key for key, status in results.items() if status == "failed"]
+    logging.info(f"HTTP connections: {diff_connection_stats(connection_stats(settings['session']), connections_before)}")
+    logging.info(f"Rate limiter stats: {settings['rate_limiter'].stats()}")
+    logging.info(f"Download scheduler completed: {len(results) - len(failed)} jobs ok, {len(failed)} failed.")
+    return results
+
+
 ################################################################################
 
+def _fetch_institutions_period(session, url, period, rate_limiter, max_retries):
+    """
+    Fetches the IfDataCadastro records of one period.
+
+    Returns:
+        list or None: The records of the period, or None if the request failed (already logged).
+    """
+    parameters = {
+        "@AnoMes": period,
+        "$top": "100000",
+        "$skip": "0",
+        "$format": "json"
+    }
+
+    try:
+        response = request_with_backoff(
+            lambda: session.get(url, params=parameters),
+            rate_limiter,
+            max_retries,
+            description=f"period {period}"
+        )
+
+        data = response.json()
+        if 'value' in data:
+            logging.info(f"Successfully fetched {len(data['value'])} institutions for period {period}")
+            return data['value']
+        logging.warning(f"No 'value' key in response for period {period}")
+
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Network error for period {period}: {str(e)}")
+    except json.JSONDecodeError as e:
+        logging.error(f"JSON decode error for period {period}: {str(e)}")
+    except Exception as e:
+        logging.error(f"Unexpected error for period {period}: {str(e)}")
+    return None
+
+
 def get_consolidated_institutions(
     years_list,
     months_list,
     output_dir="data",
-    log_level=logging.INFO
+    log_level=logging.INFO,
+    max_retries=3,
+    rate_limiter=None,
+    session=None,
+    max_workers=1,
+    incremental=False,
+    base_url="https://olinda.bcb.gov.br/olinda/servico/IFDATA/versao/v1/odata"
 ):
     """
     Fetches institution data for multiple periods and consolidates them into a single mapping,
     keeping the most recent entry for each CodInst.
+
+    Requests go through the shared AdaptiveRateLimiter and pooled session (see download_historical_data),
+    retrying 429/5xx and network errors up to max_retries times per period.
+
+    Periods are fetched on a pool of max_workers threads and merged as they arrive into a running
+    latest-per-CodInst map, so memory is bounded by the number of unique institutions rather than
+    by periods x institutions.
+
+    Parameters:
+        max_workers (int): Number of periods fetched concurrently. Default 1.
+        incremental (bool): If True, starts from the existing consolidated_institutions.json and only
+            fetches periods newer than the most recent 'Data' it covers. Default False.
+        base_url (str): Olinda IF.data OData root.
     """
     # 1. Setup
     # Ensure output directory exists
@@ -130,76 +777,80 @@ def get_consolidated_institutions(
     )
 
     logging.info("Starting institution data consolidation process")
+    output_path = os.path.join(output_dir, "consolidated_institutions.json")
 
     # 2. Data Collection
-    # Initialize empty list to store all responses
-    all_institutions = []
+    # Running map CodInst -> most recent record
+    latest_by_codinst = {}
+    total_records = 0
+
+    def merge(records):
+        nonlocal total_records
+        total_records += len(records)
+        for record in records:
+            record_date = pd.to_numeric(record['Data'])
+            current = latest_by_codinst.get(record['CodInst'])
+            if current is None or record_date > current[0]:
+                latest_by_codinst[record['CodInst']] = (record_date, record)
+
+    periods = [f"{year}{month:02d}" for month in months_list for year in years_list]
+
+    # Incremental mode: keep what is already consolidated and only fetch newer periods
+    if incremental and os.path.exists(output_path):
+        with open(output_path, encoding="utf-8") as f:
+            existing_records = json.load(f)
+        merge(existing_records)
+        if existing_records:
+            covered_until = max(int(record['Data']) for record in existing_records)
+            periods = [period for period in periods if int(period) > covered_until]
+            logging.info(f"Existing data covers up to {covered_until}, fetching {len(periods)} newer periods")
 
     # Endpoint for institutions data
-    base_url = "https://olinda.bcb.gov.br/olinda/servico/IFDATA/versao/v1/odata"
     endpoint = "/IfDataCadastro(AnoMes=@AnoMes)"
 
-    total_periods = len(years_list) * len(months_list)
-    processed_periods = 0
-    # 3. Iterate through periods
-    for month in months_list:
-        for year in years_list:
-            period = f"{year}{month:02d}"
-            processed_periods += 1
+    total_periods = len(periods)
+    rate_limiter = rate_limiter or get_default_rate_limiter()
+    session = session or get_default_session()
+    connections_before = connection_stats(session)
+    fetched_any = False
 
+    # 3. Iterate through periods, merging each one as soon as it arrives
+    with ThreadPoolExecutor(max_workers=max_workers) as period_pool:
+        futures = {}
+        for processed_periods, period in enumerate(periods, start=1):
             logging.info(f"Processing period {period} ({processed_periods}/{total_periods})")
+            future = period_pool.submit(_fetch_institutions_period, session, base_url + endpoint,
+                                        period, rate_limiter, max_retries)
+            futures[future] = period
+
+        for future in as_completed(futures):
+            records = future.result()
+            if records:
+                fetched_any = True
+                merge(records)
+
+    logging.info(f"HTTP connections: {diff_connection_stats(connection_stats(session), connections_before)}")
 
-            parameters = {
-                "@AnoMes": period,
-                "$top": "100000",
-                "$skip": "0",
-                "$format": "json"
-            }
-
-            try:
-                response = requests.get(base_url + endpoint, params=parameters)
-                response.raise_for_status()
-
-                data = response.json()
-                if 'value' in data:
-                    institutions_count = len(data['value'])
-                    all_institutions.extend(data['value'])
-                    logging.info(f"Successfully fetched {institutions_count} institutions for period {period}")
-                else:
-                    logging.warning(f"No 'value' key in response for period {period}")
-
-            except requests.exceptions.RequestException as e:
-                logging.error(f"Network error for period {period}: {str(e)}")
-                continue
-            except json.JSONDecodeError as e:
-                logging.error(f"JSON decode error for period {period}: {str(e)}")
-                continue
-            except Exception as e:
-                logging.error(f"Unexpected error for period {period}: {str(e)}")
-                continue
-
-            time.sleep(0.5)
-
-    if not all_institutions:
+    if not latest_by_codinst:
         logging.error("No data was collected. Exiting.")
         return None
 
-    logging.info(f"Data collection complete. Processing {len(all_institutions)} total records")
+    if incremental and not fetched_any and periods:
+        logging.warning("No new period could be fetched, keeping the existing consolidated data")
+
+    logging.info(f"Data collection complete. Processed {total_records} total records")
 
     # Convert to DataFrame and process
     try:
-        df = pd.DataFrame(all_institutions)
+        df = pd.DataFrame([record for _, record in latest_by_codinst.values()])
         df['Data'] = pd.to_numeric(df['Data'])
-        df = df.sort_values('Data', ascending=False)
-
-        initial_count = len(df)
-        df = df.drop_duplicates(subset='CodInst', keep='first')
-        final_count = len(df)
+        # Newest first, then by CodInst: periods are merged in arrival order, so the insertion order
+        # of institutions with the same Data varies from run to run
+        df = df.sort_values(['Data', 'CodInst'], ascending=[False, True], kind='mergesort').reset_index(drop=True)
 
-        logging.info(f"Removed {initial_count - final_count} duplicate institutions")
+        logging.info(f"Removed {total_records - len(df)} duplicate institutions")
 
         # Save to JSON file
-        output_path = os.path.join(output_dir, "consolidated_institutions.json")
         df.to_json(output_path, orient='records', force_ascii=False, indent=2)
         logging.info(f"Successfully saved consolidated data to: {output_path}")
 
@@ -221,4 +872,4 @@ if __name__ == "__main__":
     years_list = list(range(2013, 2024+1))
     months_list = [3, 6, 9, 12]
     download_historical_data(years_list, months_list)
-    get_consolidated_institutions(years_list, months_list)
+    get_consolidated_institutions(years_list, months_list, max_workers=4)
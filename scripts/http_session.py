@@ -0,0 +1,115 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.poolmanager import PoolManager
+
+
+class _TrackingPoolManager(PoolManager):
+    """PoolManager that remembers every connection pool it creates, so their counters survive eviction."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created_pools = []
+        self._created_pools_lock = threading.Lock()
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super()._new_pool(scheme, host, port, request_context=request_context)
+        with self._created_pools_lock:
+            self.created_pools.append(pool)
+        return pool
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter with keep-alive connection pools that counts new vs reused connections.
+
+    urllib3 pools increment num_connections every time a TCP(+TLS) connection is opened and
+    num_requests for every request sent, so reused = requests - new connections.
+    """
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = _TrackingPoolManager(
+            num_pools=connections,
+            maxsize=maxsize,
+            block=block,
+            **pool_kwargs
+        )
+
+    def connection_stats(self):
+        """Returns {'requests', 'new_connections', 'reused_connections'} summed over all pools."""
+        with self.poolmanager._created_pools_lock:
+            pools = list(self.poolmanager.created_pools)
+        num_requests = sum(pool.num_requests for pool in pools)
+        new_connections = sum(pool.num_connections for pool in pools)
+        return {
+            'requests': num_requests,
+            'new_connections': new_connections,
+            'reused_connections': num_requests - new_connections
+        }
+
+
+def make_session(pool_connections=4, pool_maxsize=10, pool_block=True, headers=None):
+    """
+    Creates a requests.Session with pooled keep-alive connections and compressed responses.
+
+    Parameters:
+        pool_connections (int): Number of hosts whose pools are kept open. Default 4.
+        pool_maxsize (int): Maximum connections kept per host. Default 10.
+        pool_block (bool): If True, requests wait for a free connection instead of opening
+            connections beyond pool_maxsize. Default True.
+        headers (dict, optional): Extra headers sent with every request.
+
+    Returns:
+        requests.Session: Session with a PooledHTTPAdapter mounted for http and https.
+    """
+    session = requests.Session()
+
+    # Retries are handled by scripts.rate_limiter, not by urllib3
+    adapter = PooledHTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block,
+        max_retries=0
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    session.headers.update({
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive"
+    })
+    if headers:
+        session.headers.update(headers)
+
+    return session
+
+
+def connection_stats(session):
+    """Connection counters of the PooledHTTPAdapter mounted on session (zeros for plain sessions)."""
+    adapter = session.get_adapter("https://")
+    if isinstance(adapter, PooledHTTPAdapter):
+        return adapter.connection_stats()
+    return {'requests': 0, 'new_connections': 0, 'reused_connections': 0}
+
+
+def diff_connection_stats(after, before):
+    """Connection counters accumulated between two connection_stats() snapshots."""
+    return {key: after[key] - before[key] for key in after}
+
+
+# Session shared by all Olinda requests of the process
+_DEFAULT_SESSION = None
+_DEFAULT_SESSION_LOCK = threading.Lock()
+
+
+def get_default_session():
+    """Returns the process-wide pooled session used when a fetcher is not given one."""
+    global _DEFAULT_SESSION
+    with _DEFAULT_SESSION_LOCK:
+        if _DEFAULT_SESSION is None:
+            _DEFAULT_SESSION = make_session()
+        return _DEFAULT_SESSION
@@ -0,0 +1,68 @@
+import os
+import copy
+import json
+import tempfile
+import threading
+
+
+class Manifest:
+    """
+    Small JSON key/value store used to track pipeline state between runs
+    (e.g. download checkpoints per period file).
+
+    Every update is written to disk atomically (temporary file + os.replace), so an
+    interrupted run never leaves a half-written manifest behind. Safe to share between threads.
+
+    Parameters:
+        path (str): Location of the JSON file. Created on the first update if missing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+
+    def get(self, key, default=None):
+        """Returns a copy of the entry stored under key."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return copy.deepcopy(entry) if entry is not None else default
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def update(self, key, **fields):
+        """Merges fields into the entry stored under key and saves the manifest."""
+        with self._lock:
+            self._entries.setdefault(key, {}).update(copy.deepcopy(fields))
+            self._save()
+
+    def update_many(self, entries):
+        """Merges {key: fields} for several keys at once, saving the manifest a single time."""
+        with self._lock:
+            for key, fields in entries.items():
+                self._entries.setdefault(key, {}).update(copy.deepcopy(fields))
+            self._save()
+
+    def remove(self, key):
+        """Drops the entry stored under key and saves the manifest."""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._save()
+
+    def _save(self):
+        # Compact JSON: the manifest is rewritten on every update (e.g. after each downloaded page).
+        # A temporary file of its own, so two Manifest objects on the same path never share one.
+        directory, name = os.path.split(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{name}.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
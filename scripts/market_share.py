@@ -0,0 +1,145 @@
+"""
+Market share tables precomputed by the ETL for every feature of plot_market_share and every
+modality of plot_share_credit_modality.
+
+One long table holds, for each dataset (market_metrics, credit_data), metric, quarter and
+institution:
+
+    Saldo      institution's saldo in the quarter (months of a quarter summed)
+    Total      market total of the quarter (every named institution)
+    Share      Saldo / Total * 100
+    Rank       position of the institution in the quarter, 1 = largest saldo
+
+It is built from the metric cubes (scripts.cube) without grouping any rows, and written by the
+ETL as market_share.csv (or .parquet). The API loads it into a ShareTable, whose rows are sorted
+by dataset and metric: a chart's quarter x institution table is a slice of those rows, re-summed
+only when the request changes the market (Nubank left out, several modalities together).
+"""
+import pandas as pd
+
+from scripts.plotting import CREDIT_MODALITIES, MARKET_SHARE_FEATURES
+
+
+# Dataset (and cube) -> user-facing name -> NomeRelatorio_Grupo_Coluna of the metrics precomputed
+SHARE_METRICS = {
+    'market_metrics': MARKET_SHARE_FEATURES,
+    'credit_data': CREDIT_MODALITIES,
+}
+
+SHARE_COLUMNS = ['Dataset', 'NomeRelatorio_Grupo_Coluna', 'AnoMes_Q', 'AnoMes', 'NomeInstituicao',
+                 'Saldo', 'Total', 'Share', 'Rank']
+
+
+def build_share_table(cubes, share_metrics=None):
+    """
+    Long market share table of every metric of share_metrics (SHARE_METRICS by default).
+
+    Parameters:
+        cubes (dict): {dataset: MetricCube} of the datasets (e.g. make_metric_cubes's result).
+            Datasets without a cube are skipped.
+
+    Returns:
+        pd.DataFrame: SHARE_COLUMNS, sorted by dataset, metric, quarter and rank. AnoMes_Q is the
+            quarter label ("2024Q3") and AnoMes the first day of its last month.
+    """
+    share_metrics = SHARE_METRICS if share_metrics is None else share_metrics
+    blocks = []
+    for dataset, metrics in share_metrics.items():
+        if dataset not in cubes:
+            continue
+        for metric in dict.fromkeys(metrics.values()):
+            # Quarter x institution saldo, as plot_market_share groups it
+            saldo = cubes[dataset].quarterly('Saldo', metrics=[metric])
+            if saldo.empty:
+                continue
+            # Only the cells an institution reported (stack keeps the NaN of the others)
+            long = saldo.stack(future_stack=True).dropna().rename('Saldo').reset_index()
+            long['Total'] = long['AnoMes_Q'].map(saldo.sum(axis=1))
+            long['Share'] = long['Saldo'] / long['Total'] * 100
+            long['Rank'] = long.groupby('AnoMes_Q')['Saldo'].rank(ascending=False, method='first').astype('int64')
+            long.insert(0, 'Dataset', dataset)
+            long.insert(1, 'NomeRelatorio_Grupo_Coluna', metric)
+            blocks.append(long)
+
+    if not blocks:
+        return pd.DataFrame(columns=SHARE_COLUMNS)
+    table = pd.concat(blocks, ignore_index=True)
+    table['AnoMes'] = table['AnoMes_Q'].dt.asfreq('M', how='end').dt.to_timestamp().dt.strftime('%Y-%m-%d')
+    table['AnoMes_Q'] = table['AnoMes_Q'].astype(str)
+    return table.sort_values(['Dataset', 'NomeRelatorio_Grupo_Coluna', 'AnoMes_Q', 'Rank'],
+                             kind='mergesort', ignore_index=True)[SHARE_COLUMNS]
+
+
+class ShareTable:
+    """
+    Precomputed market shares (see build_share_table), sliced by dataset and metric.
+
+    Parameters:
+        table (pd.DataFrame): The long share table, with the SHARE_COLUMNS.
+    """
+
+    def __init__(self, table):
+        self.table = table.sort_values(['Dataset', 'NomeRelatorio_Grupo_Coluna', 'AnoMes_Q', 'Rank'],
+                                       kind='mergesort', ignore_index=True)
+        self.table['AnoMes_Q'] = self.table['AnoMes_Q'].astype(str)
+        # (dataset, metric) -> row range of the sorted table
+        keys = self.table[['Dataset', 'NomeRelatorio_Grupo_Coluna']].drop_duplicates()
+        bounds = list(keys.index) + [len(self.table)]
+        self._rows = {key: (start, stop) for key, start, stop in
+                      zip(keys.itertuples(index=False, name=None), bounds[:-1], bounds[1:])}
+
+    @classmethod
+    def load(cls, path):
+        """Reads the table written by the ETL (CSV, or a partitioned Parquet table)."""
+        from scripts import data_lake
+
+        if data_lake.is_lake_path(path):
+            return cls(data_lake.read_table(path, columns=SHARE_COLUMNS))
+        return cls(pd.read_csv(path, encoding='utf-8'))
+
+    def rows(self, dataset, metric):
+        """Rows of a metric (NomeRelatorio_Grupo_Coluna) of a dataset; empty if not precomputed."""
+        start, stop = self._rows.get((dataset, metric), (0, 0))
+        return self.table.iloc[start:stop]
+
+    def top(self, dataset, metric, n=10, quarter=None):
+        """The n largest institutions of a quarter (default the last one), by rank."""
+        rows = self.rows(dataset, metric)
+        if rows.empty:
+            return []
+        quarter = rows['AnoMes_Q'].iloc[-1] if quarter is None else str(quarter)
+        rows = rows[(rows['AnoMes_Q'] == quarter) & (rows['Rank'] <= n)]
+        return rows['NomeInstituicao'].tolist()
+
+    def quarterly(self, dataset, metrics, exclude_institutions=(), min_year=None, show_percentage=True):
+        """
+        Quarter x institution table of the metrics: shares (percent) or saldo.
+
+        The precomputed shares are returned as they are for a single metric of the whole market;
+        with several metrics (summed) or institutions left out, the shares are recomputed from the
+        saldo of the slice.
+
+        Parameters:
+            dataset (str): One of SHARE_METRICS.
+            metrics (list): NomeRelatorio_Grupo_Coluna of the metrics.
+            exclude_institutions (iterable): Institutions left out of the market.
+            min_year (int, optional): Only the quarters from this year on.
+            show_percentage (bool): Shares if True, saldo otherwise.
+        """
+        rows = pd.concat([self.rows(dataset, metric) for metric in dict.fromkeys(metrics)]) if metrics \
+            else self.table.iloc[0:0]
+        if min_year:
+            rows = rows[rows['AnoMes_Q'] >= f"{int(min_year)}Q1"]
+        if exclude_institutions:
+            rows = rows[~rows['NomeInstituicao'].isin(list(exclude_institutions))]
+
+        if len(dict.fromkeys(metrics)) == 1 and not exclude_institutions:
+            table = rows.pivot(index='AnoMes_Q', columns='NomeInstituicao',
+                               values='Share' if show_percentage else 'Saldo')
+        else:
+            table = rows.pivot_table(index='AnoMes_Q', columns='NomeInstituicao', values='Saldo', aggfunc='sum')
+            if show_percentage:
+                table = table.div(table.sum(axis=1), axis=0) * 100
+
+        table.index = pd.PeriodIndex(table.index, freq='Q', name='AnoMes_Q')
+        return table.sort_index().sort_index(axis=1)
@@ -1,3 +1,76 @@
+# plot_market_share features: user-facing name -> NomeRelatorio_Grupo_Coluna
+MARKET_SHARE_FEATURES = {
+    'Quantidade de clientes com operações ativas':'Carteira de crédito ativa - quantidade de clientes e de operações_nagroup_Quantidade de clientes com operações ativas',
+    'Carteira de Crédito Pessoa Física':'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_nagroup_Total da Carteira de Pessoa Física',
+    'Carteira de Crédito Pessoa Jurídica':'Carteira de crédito ativa Pessoa Jurídica - por porte do tomador_nagroup_Total da Carteira de Pessoa Jurídica',
+    'Carteira de Crédito Classificada':'Resumo_nagroup_Carteira de Crédito Classificada',
+    'Receitas de Intermediação Financeira':'Demonstração de Resultado_Resultado de Intermediação Financeira - Receitas de Intermediação Financeira_Receitas de Intermediação Financeira \n(a) = (a1) + (a2) + (a3) + (a4) + (a5) + (a6)',
+    'Rendas de Prestação de Serviços':'Demonstração de Resultado_Outras Receitas/Despesas Operacionais_Rendas de Prestação de Serviços \n(d1)',
+    'Captações':'Resumo_nagroup_Captações',
+    'Lucro Líquido':'Resumo_nagroup_Lucro Líquido',
+    'Passivo Captacoes: Depósitos Total':'Passivo_Captações - Depósito Total_Depósito Total \n(a)',
+    'Passivo Captacoes: Emissão de Títulos (LCI,LCA,LCF...)':'Passivo_Captações - Recursos de Aceites e Emissão de Títulos_Recursos de Aceites e Emissão de Títulos \n(c)',
+    #### NEW ADDITIONS
+    'Receita com Operações de Crédito':'Demonstração de Resultado_Resultado de Intermediação Financeira - Receitas de Intermediação Financeira_Rendas de Operações de Crédito \n(a1)',
+    'Receita com Operações de Títulos e Valores Mobiliários':'Demonstração de Resultado_Resultado de Intermediação Financeira - Receitas de Intermediação Financeira_Rendas de Operações com TVM \n(a3)',
+    'Receita com Operações de Câmbio':'Demonstração de Resultado_Resultado de Intermediação Financeira - Receitas de Intermediação Financeira_Resultado de Operações de Câmbio \n(a5)',
+}
+
+# plot_share_credit_modality modalities: user-facing name -> NomeRelatorio_Grupo_Coluna
+CREDIT_MODALITIES = {
+    # PF modalities
+    'Total PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_nagroup_Total da Carteira de Pessoa Física',
+    'Consignado PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Empréstimo com Consignação em Folha_Total',
+    'Não Consignado PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Empréstimo sem Consignação em Folha_Total',
+    'Veículos PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Veículos_Total',
+    'Outros Créditos PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Outros Créditos_Total',
+    'Habitação PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Habitação_Total',
+    'Cartão de Crédito PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Cartão de Crédito_Total',
+    'Rural PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Rural e Agroindustrial_Total',
+
+    # PJ modalities
+    'Total PJ': 'Carteira de crédito ativa Pessoa Jurídica - por porte do tomador_nagroup_Total da Carteira de Pessoa Jurídica',
+    'Recebíveis PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Operações com Recebíveis_Total',
+    'Comércio Exterior PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Comércio Exterior_Total',
+    'Outros Créditos PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Outros Créditos_Total',
+    'Infraestrutura PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Financiamento de Infraestrutura/Desenvolvimento/Projeto e Outros Créditos_Total',
+    'Capital de Giro PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Capital de Giro_Total',
+    'Investimento PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Investimento_Total',
+    'Capital de Giro Rotativo PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Capital de Giro Rotativo_Total',
+    'Rural PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Rural e Agroindustrial_Total',
+    'Habitação PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Habitacional_Total',
+    'Cheque Especial PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Cheque Especial e Conta Garantida_Total',
+
+}
+
+# plot_credit_portfolio modalities (detailed view): user-facing name -> NomeRelatorio_Grupo_Coluna
+CREDIT_PORTFOLIO = {
+    'Consignado PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Empréstimo com Consignação em Folha_Total',
+    'Não Consignado PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Empréstimo sem Consignação em Folha_Total',
+    'Veículos PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Veículos_Total',
+    'Outros Créditos PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Outros Créditos_Total',
+    'Habitação PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Habitação_Total',
+    'Cartão de Crédito PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Cartão de Crédito_Total',
+    'Rural PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Rural e Agroindustrial_Total',
+    'Recebíveis PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Operações com Recebíveis_Total',
+    'Comércio Exterior PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Comércio Exterior_Total',
+    'Outros Créditos PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Outros Créditos_Total',
+    'Infraestrutura PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Financiamento de Infraestrutura/Desenvolvimento/Projeto e Outros Créditos_Total',
+    'Capital de Giro PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Capital de Giro_Total',
+    'Investimento PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Investimento_Total',
+    'Capital de Giro Rotativo PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Capital de Giro Rotativo_Total',
+    'Rural PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Rural e Agroindustrial_Total',
+    'Habitação PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Habitacional_Total',
+    'Cheque Especial PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Cheque Especial e Conta Garantida_Total',
+}
+
+# plot_credit_portfolio modalities (grouped view, PF vs PJ)
+CREDIT_PORTFOLIO_GROUPED = {
+    'Total PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_nagroup_Total da Carteira de Pessoa Física',
+    'Total PJ': 'Carteira de crédito ativa Pessoa Jurídica - por porte do tomador_nagroup_Total da Carteira de Pessoa Jurídica'
+}
+
+
 def plot_market_share(df,feature='Quantidade de clientes com operações ativas', top_n=10, custom_selected_institutions=None, initial_year=None,drop_nubank=0):
     """
     Creates a stacked area plot showing the market share evolution over time for financial institutions for selected metric.
@@ -10,6 +83,8 @@ def plot_market_share(df,feature='Quantidade de clientes com operações ativas'
         - AnoMes: Date column
         - NomeInstituicao: Institution name
         - Saldo: Balance/value column
+        Or the market_metrics MetricCube (scripts.cube), sliced instead of grouping the rows, or
+        the precomputed ShareTable (scripts.market_share), whose shares are looked up.
 
     feature : str
         Feature name to analyze. Must be one of the keys in feature_name_dict.
@@ -50,60 +125,62 @@ def plot_market_share(df,feature='Quantidade de clientes com operações ativas'
     """
     import plotly.graph_objects as go
     import pandas as pd
+    from scripts.cube import MetricCube
+    from scripts.market_share import ShareTable
+    from scripts.schema import decode_report_frame
 
     # Dictionary mapping features to their full column names
     # Add more mappings as needed
-    feature_name_dict = {
-        'Quantidade de clientes com operações ativas':'Carteira de crédito ativa - quantidade de clientes e de operações_nagroup_Quantidade de clientes com operações ativas',
-        'Carteira de Crédito Pessoa Física':'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_nagroup_Total da Carteira de Pessoa Física',
-        'Carteira de Crédito Pessoa Jurídica':'Carteira de crédito ativa Pessoa Jurídica - por porte do tomador_nagroup_Total da Carteira de Pessoa Jurídica',
-        'Carteira de Crédito Classificada':'Resumo_nagroup_Carteira de Crédito Classificada',
-        'Receitas de Intermediação Financeira':'Demonstração de Resultado_Resultado de Intermediação Financeira - Receitas de Intermediação Financeira_Receitas de Intermediação Financeira \n(a) = (a1) + (a2) + (a3) + (a4) + (a5) + (a6)',
-        'Rendas de Prestação de Serviços':'Demonstração de Resultado_Outras Receitas/Despesas Operacionais_Rendas de Prestação de Serviços \n(d1)',
-        'Captações':'Resumo_nagroup_Captações',
-        'Lucro Líquido':'Resumo_nagroup_Lucro Líquido',
-        'Passivo Captacoes: Depósitos Total':'Passivo_Captações - Depósito Total_Depósito Total \n(a)',
-        'Passivo Captacoes: Emissão de Títulos (LCI,LCA,LCF...)':'Passivo_Captações - Recursos de Aceites e Emissão de Títulos_Recursos de Aceites e Emissão de Títulos \n(c)',
-        #### NEW ADDITIONS
-        'Receita com Operações de Crédito':'Demonstração de Resultado_Resultado de Intermediação Financeira - Receitas de Intermediação Financeira_Rendas de Operações de Crédito \n(a1)',
-        'Receita com Operações de Títulos e Valores Mobiliários':'Demonstração de Resultado_Resultado de Intermediação Financeira - Receitas de Intermediação Financeira_Rendas de Operações com TVM \n(a3)',
-        'Receita com Operações de Câmbio':'Demonstração de Resultado_Resultado de Intermediação Financeira - Receitas de Intermediação Financeira_Resultado de Operações de Câmbio \n(a5)',
-        }
-
-
-    # Map the feature name and filter the dataframe
+    feature_name_dict = MARKET_SHARE_FEATURES
+
+    # Nubank entity dropped by drop_nubank
+    nubank_dropped = {1: "NU PAGAMENTOS S.A. - INSTITUIÇÃO DE PAGAMENTO", 2: "NUBANK"}.get(drop_nubank)
+
     feature_name = feature_name_dict[feature]
-    df_filtered = df[df['NomeRelatorio_Grupo_Coluna'] == feature_name].copy()
-    # Convert date columns BEFORE filtering by initial_year
-    df_filtered['AnoMes'] = pd.to_datetime(df_filtered['AnoMes'])
-
-    # Handle Nubank filtering
-    if drop_nubank == 1:
-        df_filtered = df_filtered[df_filtered['NomeInstituicao'] != "NU PAGAMENTOS S.A. - INSTITUIÇÃO DE PAGAMENTO"]
-    elif drop_nubank == 2:
-        df_filtered = df_filtered[df_filtered['NomeInstituicao'] != "NUBANK"]
-
-    # Filter by initial_year if provided
-    if initial_year:
-        df_filtered = df_filtered[df_filtered['AnoMes'].dt.year >= initial_year]
-
-    # Group by quarter and institution to get total saldo
-    quarterly_data = df_filtered.groupby(['AnoMes_Q', 'NomeInstituicao'])['Saldo'].sum().reset_index()
-
-    # Calculate total market size per quarter
-    market_total = quarterly_data.groupby('AnoMes_Q')['Saldo'].sum().reset_index()
-
-    # Merge total market size back to calculate market share
-    quarterly_data = quarterly_data.merge(market_total, on='AnoMes_Q', suffixes=('', '_total'))
-    quarterly_data['market_share'] = (quarterly_data['Saldo'] / quarterly_data['Saldo_total'] * 100)
-
-    # Create pivot table for market share
-    pivot_share = quarterly_data.pivot_table(
-        index='AnoMes_Q',
-        columns='NomeInstituicao',
-        values='market_share',
-        aggfunc='first'
-    ).sort_index()
+
+    if isinstance(df, ShareTable):
+        # Precomputed quarter x institution shares (recomputed from saldo if Nubank is left out)
+        pivot_share = df.quarterly('market_metrics', [feature_name], min_year=initial_year,
+                                   exclude_institutions=[nubank_dropped] if nubank_dropped else ())
+    elif isinstance(df, MetricCube):
+        # Quarter x institution saldo sliced from the cube, no rows to group
+        quarterly_saldo = df.quarterly('Saldo', metrics=[feature_name], min_year=initial_year,
+                                       exclude_institutions=[nubank_dropped] if nubank_dropped else ())
+
+        # Market share: each institution's saldo over the quarter's total
+        pivot_share = quarterly_saldo.div(quarterly_saldo.sum(axis=1), axis=0) * 100
+    else:
+        # Filter the dataframe by the feature (works on the encoded frame of
+        # scripts.schema.read_report_csv); only the selected rows are decoded to plain strings
+        df_filtered = decode_report_frame(df[df['NomeRelatorio_Grupo_Coluna'] == feature_name])
+        # Convert date columns BEFORE filtering by initial_year
+        df_filtered['AnoMes'] = pd.to_datetime(df_filtered['AnoMes'])
+
+        # Handle Nubank filtering
+        if nubank_dropped:
+            df_filtered = df_filtered[df_filtered['NomeInstituicao'] != nubank_dropped]
+
+        # Filter by initial_year if provided
+        if initial_year:
+            df_filtered = df_filtered[df_filtered['AnoMes'].dt.year >= initial_year]
+
+        # Group by quarter and institution to get total saldo
+        quarterly_data = df_filtered.groupby(['AnoMes_Q', 'NomeInstituicao'])['Saldo'].sum().reset_index()
+
+        # Calculate total market size per quarter
+        market_total = quarterly_data.groupby('AnoMes_Q')['Saldo'].sum().reset_index()
+
+        # Merge total market size back to calculate market share
+        quarterly_data = quarterly_data.merge(market_total, on='AnoMes_Q', suffixes=('', '_total'))
+        quarterly_data['market_share'] = (quarterly_data['Saldo'] / quarterly_data['Saldo_total'] * 100)
+
+        # Create pivot table for market share
+        pivot_share = quarterly_data.pivot_table(
+            index='AnoMes_Q',
+            columns='NomeInstituicao',
+            values='market_share',
+            aggfunc='first'
+        ).sort_index()
 
     # Get the last period's values to identify top institutions
     last_period = pivot_share.iloc[-1].sort_values(ascending=False)
@@ -209,6 +286,8 @@ def plot_share_credit_modality(credit_data_df, modalities, initial_year=None, to
         - AnoMes_Q: Quarter column (period)
         - NomeInstituicao: Institution name
         - Saldo: Balance/value column
+        Or the credit_data MetricCube (scripts.cube), sliced instead of grouping the rows, or
+        the precomputed ShareTable (scripts.market_share), whose shares are looked up.
 
     modalities : str or list
         Credit modality or list of modalities to analyze. Must be one of the valid modalities from
@@ -238,33 +317,12 @@ def plot_share_credit_modality(credit_data_df, modalities, initial_year=None, to
     """
     import plotly.graph_objects as go
     import pandas as pd
+    from scripts.cube import MetricCube
+    from scripts.market_share import ShareTable
+    from scripts.schema import decode_report_frame
 
     # Dictionary mapping user-friendly names to full column names
-    modality_name_dict = {
-        # PF modalities
-        'Total PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_nagroup_Total da Carteira de Pessoa Física',
-        'Consignado PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Empréstimo com Consignação em Folha_Total',
-        'Não Consignado PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Empréstimo sem Consignação em Folha_Total',
-        'Veículos PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Veículos_Total',
-        'Outros Créditos PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Outros Créditos_Total',
-        'Habitação PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Habitação_Total',
-        'Cartão de Crédito PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Cartão de Crédito_Total',
-        'Rural PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Rural e Agroindustrial_Total',
-
-        # PJ modalities
-        'Total PJ': 'Carteira de crédito ativa Pessoa Jurídica - por porte do tomador_nagroup_Total da Carteira de Pessoa Jurídica',
-        'Recebíveis PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Operações com Recebíveis_Total',
-        'Comércio Exterior PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Comércio Exterior_Total',
-        'Outros Créditos PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Outros Créditos_Total',
-        'Infraestrutura PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Financiamento de Infraestrutura/Desenvolvimento/Projeto e Outros Créditos_Total',
-        'Capital de Giro PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Capital de Giro_Total',
-        'Investimento PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Investimento_Total',
-        'Capital de Giro Rotativo PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Capital de Giro Rotativo_Total',
-        'Rural PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Rural e Agroindustrial_Total',
-        'Habitação PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Habitacional_Total',
-        'Cheque Especial PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Cheque Especial e Conta Garantida_Total',
-
-    }
+    modality_name_dict = CREDIT_MODALITIES
 
 
     # Store credit_data_df as df
@@ -277,42 +335,51 @@ def plot_share_credit_modality(credit_data_df, modalities, initial_year=None, to
     # Map user-friendly names to full column names
     mapped_modalities = [modality_name_dict[mod] for mod in modalities]
 
-    # Convert date columns
-    df = df.copy()
-    df['AnoMes'] = pd.to_datetime(df['AnoMes'], format='%Y-%m-%d')
-    df['AnoMes_Q'] = pd.PeriodIndex(df['AnoMes_Q'], freq='Q')
-
-    # Filter dataframe for selected modalities
-    df_filtered = df[df['NomeRelatorio_Grupo_Coluna'].isin(mapped_modalities)].copy()
-
-    # Filter by initial_year if provided
-    if initial_year:
-        df_filtered = df_filtered[df_filtered['AnoMes'].dt.year >= initial_year]
-
-    # Group by quarter and institution to get total saldo
-    quarterly_data = df_filtered.groupby(['AnoMes_Q', 'NomeInstituicao'])['Saldo'].sum().reset_index()
-
-    # Calculate values based on show_percentage parameter
-    if show_percentage:
-        # Calculate percentages
-        market_total = quarterly_data.groupby('AnoMes_Q')['Saldo'].sum().reset_index()
-        quarterly_data = quarterly_data.merge(market_total, on='AnoMes_Q', suffixes=('', '_total'))
-        quarterly_data['value'] = (quarterly_data['Saldo'] / quarterly_data['Saldo_total'] * 100)
-        value_suffix = "%"
-        yaxis_title = "Market Share (%)"
+    # Values shown: share of the quarter's total or absolute saldo
+    value_suffix = "%" if show_percentage else ""
+    yaxis_title = "Market Share (%)" if show_percentage else "Portfolio Value (R$)"
+
+    if isinstance(df, ShareTable):
+        # Precomputed quarter x institution shares (several modalities are summed first)
+        pivot_share = df.quarterly('credit_data', mapped_modalities, min_year=initial_year,
+                                   show_percentage=show_percentage)
+    elif isinstance(df, MetricCube):
+        # Quarter x institution saldo of the modalities sliced from the cube, no rows to group
+        pivot_share = df.quarterly('Saldo', metrics=mapped_modalities, min_year=initial_year)
+        if show_percentage:
+            pivot_share = pivot_share.div(pivot_share.sum(axis=1), axis=0) * 100
     else:
-        # Use absolute values
-        quarterly_data['value'] = quarterly_data['Saldo']
-        value_suffix = ""
-        yaxis_title = "Portfolio Value (R$)"
-
-    # Create pivot table
-    pivot_share = quarterly_data.pivot_table(
-        index='AnoMes_Q',
-        columns='NomeInstituicao',
-        values='value',
-        aggfunc='first'
-    ).sort_index()
+        # Filter dataframe for selected modalities, decoding only the selected rows
+        df_filtered = decode_report_frame(df[df['NomeRelatorio_Grupo_Coluna'].isin(mapped_modalities)])
+
+        # Convert date columns
+        df_filtered['AnoMes'] = pd.to_datetime(df_filtered['AnoMes'], format='%Y-%m-%d')
+        df_filtered['AnoMes_Q'] = pd.PeriodIndex(df_filtered['AnoMes_Q'], freq='Q')
+
+        # Filter by initial_year if provided
+        if initial_year:
+            df_filtered = df_filtered[df_filtered['AnoMes'].dt.year >= initial_year]
+
+        # Group by quarter and institution to get total saldo
+        quarterly_data = df_filtered.groupby(['AnoMes_Q', 'NomeInstituicao'])['Saldo'].sum().reset_index()
+
+        # Calculate values based on show_percentage parameter
+        if show_percentage:
+            # Calculate percentages
+            market_total = quarterly_data.groupby('AnoMes_Q')['Saldo'].sum().reset_index()
+            quarterly_data = quarterly_data.merge(market_total, on='AnoMes_Q', suffixes=('', '_total'))
+            quarterly_data['value'] = (quarterly_data['Saldo'] / quarterly_data['Saldo_total'] * 100)
+        else:
+            # Use absolute values
+            quarterly_data['value'] = quarterly_data['Saldo']
+
+        # Create pivot table
+        pivot_share = quarterly_data.pivot_table(
+            index='AnoMes_Q',
+            columns='NomeInstituicao',
+            values='value',
+            aggfunc='first'
+        ).sort_index()
 
     # Get the last period's values to identify top institutions
     last_period = pivot_share.iloc[-1].sort_values(ascending=False)
@@ -423,6 +490,7 @@ def plot_credit_portfolio(credit_data_df, select_institutions="All", initial_yea
         - AnoMes_Q: Quarter column (period)
         - NomeInstituicao: Institution name
         - Saldo: Balance/value column
+        Or the credit_data MetricCube (scripts.cube), sliced instead of grouping the rows.
 
     select_institutions : str or list, optional (default="All")
         "All" to show market-wide breakdown, or list of institution names to show their specific breakdown
@@ -445,35 +513,16 @@ def plot_credit_portfolio(credit_data_df, select_institutions="All", initial_yea
     # Import required libraries
     import plotly.graph_objects as go
     import pandas as pd
+    from scripts.cube import MetricCube
+    from scripts.schema import decode_report_frame
 
     # Dictionary of modalities
 
     # Dictionary mapping user-friendly names to full column names for detailed credit portfolio
-    credit_portfolio = {
-        'Consignado PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Empréstimo com Consignação em Folha_Total',
-        'Não Consignado PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Empréstimo sem Consignação em Folha_Total',
-        'Veículos PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Veículos_Total',
-        'Outros Créditos PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Outros Créditos_Total',
-        'Habitação PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Habitação_Total',
-        'Cartão de Crédito PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Cartão de Crédito_Total',
-        'Rural PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_Rural e Agroindustrial_Total',
-        'Recebíveis PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Operações com Recebíveis_Total',
-        'Comércio Exterior PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Comércio Exterior_Total',
-        'Outros Créditos PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Outros Créditos_Total',
-        'Infraestrutura PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Financiamento de Infraestrutura/Desenvolvimento/Projeto e Outros Créditos_Total',
-        'Capital de Giro PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Capital de Giro_Total',
-        'Investimento PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Investimento_Total',
-        'Capital de Giro Rotativo PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Capital de Giro Rotativo_Total',
-        'Rural PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Rural e Agroindustrial_Total',
-        'Habitação PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Habitacional_Total',
-        'Cheque Especial PJ': 'Carteira de crédito ativa Pessoa Jurídica - modalidade e prazo de vencimento_Cheque Especial e Conta Garantida_Total',
-    }
+    credit_portfolio = CREDIT_PORTFOLIO
 
     # Dictionary for grouped view (PF vs PJ only)
-    credit_portfolio_grouped = {
-        'Total PF': 'Carteira de crédito ativa Pessoa Física - modalidade e prazo de vencimento_nagroup_Total da Carteira de Pessoa Física',
-        'Total PJ': 'Carteira de crédito ativa Pessoa Jurídica - por porte do tomador_nagroup_Total da Carteira de Pessoa Jurídica'
-    }
+    credit_portfolio_grouped = CREDIT_PORTFOLIO_GROUPED
 
     # Select appropriate portfolio dictionary based on grouped parameter
     portfolio_dict = credit_portfolio_grouped if grouped else credit_portfolio
@@ -481,45 +530,57 @@ def plot_credit_portfolio(credit_data_df, select_institutions="All", initial_yea
     # Load credit_data_df as store in df
     df = credit_data_df
 
-    # Convert date columns to appropriate formats
-    df['AnoMes'] = pd.to_datetime(df['AnoMes'])
-    df['AnoMes_Q'] = pd.PeriodIndex(df['AnoMes_Q'], freq='Q')
-
-    # Filter data by modalities and year
-    df_filtered = df[df['NomeRelatorio_Grupo_Coluna'].isin(portfolio_dict.values())].copy()
-    if initial_year:
-        df_filtered = df_filtered[df_filtered['AnoMes'].dt.year >= initial_year]
-
-    # Filter by specific institutions if requested
-    if select_institutions != "All":
-        if isinstance(select_institutions, str):
-            select_institutions = [select_institutions]
-        df_filtered = df_filtered[df_filtered['NomeInstituicao'].isin(select_institutions)]
-
-    # Group data by quarter and modality
-    quarterly_data = df_filtered.groupby(['AnoMes_Q', 'NomeRelatorio_Grupo_Coluna'])['Saldo'].sum().reset_index()
-
-    # Calculate values based on show_percentage parameter
-    if show_percentage:
-        # Calculate percentages
-        total_by_quarter = quarterly_data.groupby('AnoMes_Q')['Saldo'].sum().reset_index()
-        quarterly_data = quarterly_data.merge(total_by_quarter, on='AnoMes_Q', suffixes=('', '_total'))
-        quarterly_data['value'] = (quarterly_data['Saldo'] / quarterly_data['Saldo_total'] * 100)
-        value_suffix = "%"
-        yaxis_title = "Portfolio Share (%)"
+    # Specific institutions if requested
+    if select_institutions != "All" and isinstance(select_institutions, str):
+        select_institutions = [select_institutions]
+
+    # Values shown: share of the quarter's total or absolute saldo
+    value_suffix = "%" if show_percentage else ""
+    yaxis_title = "Portfolio Share (%)" if show_percentage else "Portfolio Value (R$)"
+
+    if isinstance(df, MetricCube):
+        # Quarter x modality saldo of the institutions sliced from the cube, no rows to group
+        pivot_data = df.quarterly('Saldo', metrics=list(portfolio_dict.values()), by='NomeRelatorio_Grupo_Coluna',
+                                  institutions=None if select_institutions == "All" else select_institutions,
+                                  min_year=initial_year)
+        if show_percentage:
+            pivot_data = pivot_data.div(pivot_data.sum(axis=1), axis=0) * 100
     else:
-        # Use absolute values
-        quarterly_data['value'] = quarterly_data['Saldo']
-        value_suffix = ""
-        yaxis_title = "Portfolio Value (R$)"
-
-    # Create pivot table for plotting
-    pivot_data = quarterly_data.pivot_table(
-        index='AnoMes_Q',
-        columns='NomeRelatorio_Grupo_Coluna',
-        values='value',
-        aggfunc='first'
-    ).sort_index()
+        # Filter data by modalities, decoding only the selected rows
+        df_filtered = decode_report_frame(df[df['NomeRelatorio_Grupo_Coluna'].isin(portfolio_dict.values())])
+
+        # Convert date columns to appropriate formats
+        df_filtered['AnoMes'] = pd.to_datetime(df_filtered['AnoMes'])
+        df_filtered['AnoMes_Q'] = pd.PeriodIndex(df_filtered['AnoMes_Q'], freq='Q')
+
+        # Filter by year
+        if initial_year:
+            df_filtered = df_filtered[df_filtered['AnoMes'].dt.year >= initial_year]
+
+        # Filter by specific institutions if requested
+        if select_institutions != "All":
+            df_filtered = df_filtered[df_filtered['NomeInstituicao'].isin(select_institutions)]
+
+        # Group data by quarter and modality
+        quarterly_data = df_filtered.groupby(['AnoMes_Q', 'NomeRelatorio_Grupo_Coluna'])['Saldo'].sum().reset_index()
+
+        # Calculate values based on show_percentage parameter
+        if show_percentage:
+            # Calculate percentages
+            total_by_quarter = quarterly_data.groupby('AnoMes_Q')['Saldo'].sum().reset_index()
+            quarterly_data = quarterly_data.merge(total_by_quarter, on='AnoMes_Q', suffixes=('', '_total'))
+            quarterly_data['value'] = (quarterly_data['Saldo'] / quarterly_data['Saldo_total'] * 100)
+        else:
+            # Use absolute values
+            quarterly_data['value'] = quarterly_data['Saldo']
+
+        # Create pivot table for plotting
+        pivot_data = quarterly_data.pivot_table(
+            index='AnoMes_Q',
+            columns='NomeRelatorio_Grupo_Coluna',
+            values='value',
+            aggfunc='first'
+        ).sort_index()
 
     # Map column names back to friendly names
     reverse_dict = {v: k for k, v in portfolio_dict.items()}
@@ -601,23 +662,24 @@ def plot_time_series(financial_metrics_df, df_fmp, control, list_institutions, m
     import plotly.graph_objects as go
     import numpy as np
     import pandas as pd
+    from scripts.schema import decode_report_frame
 
     fig = go.Figure()
 
     if control == "Valores Absolutos":
-        df = financial_metrics_df.copy()
+        df = financial_metrics_df
         value_col = 'Saldo'
         name_col = 'NomeColuna'
         date_col = 'AnoMes'
 
     elif control == "Valores Relativos por % da Receita Operacional":
-        df = df_fmp.copy()
+        df = df_fmp
         value_col = 'ValuePercentRevenue'
         name_col = 'Component'
         date_col = 'AnoMes'
 
     elif control == "Valores Relativos por Cliente":
-        df = df_fmp.copy()
+        df = df_fmp
         value_col = 'ValuePerClient'
         name_col = 'Component'
         date_col = 'AnoMes'
@@ -632,7 +694,7 @@ def plot_time_series(financial_metrics_df, df_fmp, control, list_institutions, m
     for institution in list_institutions:
         # Filter for institution and metric
         mask = (df['NomeInstituicao'] == institution) & (df[name_col] == metric_name)
-        inst_data = df[mask].copy()
+        inst_data = decode_report_frame(df[mask])
 
         if len(inst_data) == 0:
             print(f"No data found for institution: {institution}")
@@ -2,6 +2,8 @@ import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
 
+from scripts.schema import decode_report_frame
+
 #df_fmp = pd.read_csv("../data/financial_metrics_processed.csv")
 
 
@@ -30,8 +32,9 @@ def filter_agg (df_fmp,periods_list, institutions_list, chart_type, view_type):
 
     """
 
-    # Step 1: Filter by institution and period
-    df_fmp_f = df_fmp[df_fmp['NomeInstituicao'].isin(institutions_list)]
+    # Step 1: Filter by institution and period (the institution filter works on the encoded
+    # frame of scripts.schema.read_report_csv; the selected rows are decoded to plain strings)
+    df_fmp_f = decode_report_frame(df_fmp[df_fmp['NomeInstituicao'].isin(institutions_list)])
     df_fmp_f = df_fmp_f[df_fmp_f['AnoMes_Q'].isin(periods_list)]
 
     # Step 2: Retrieve Total Receita Operacional and Total Clientes for the filtered data
@@ -0,0 +1,406 @@
+"""
+Stage-level profiling of the ETL pipeline.
+
+Every builder of scripts.etl (combine_csv_files ... save_to_sqlite) is decorated with
+profiled_stage. While a run is being profiled (start_run ... finish_run, done by "python etl.py"),
+each call records:
+
+    - wall_s, cpu_s: elapsed and CPU time (user + system, including reader processes that finished)
+    - peak_rss_mib: highest resident memory of the process while the stage ran, sampled every
+      SAMPLE_INTERVAL seconds
+    - rows_in, rows_out: rows the stage read (or got in memory) and returned / wrote
+    - bytes_read, bytes_written: bytes that went through read/write calls (Linux I/O counters)
+
+CPU time, memory and I/O are process-wide: stages running side by side on threads (the builders of
+build_derived_tables with max_workers > 1) each see the work of the others. Such stages are marked
+concurrent in the report, and print_report flags their figures as process-wide; only the stage
+around the whole pool gives figures of its own. Stages called inside another one record its name
+as their parent.
+
+finish_run writes a JSON run report; diff_reports compares two of them to catch regressions:
+
+    python -m scripts.profiling show ../data/run_reports/etl_20250105T101500.json
+    python -m scripts.profiling diff old.json new.json --tolerance 0.1
+
+Outside a profiled run the decorator only checks whether a run is active.
+"""
+import argparse
+import contextvars
+import functools
+import inspect
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+
+# Seconds between two RSS samples of a profiled run
+SAMPLE_INTERVAL = 0.02
+
+# Metrics of a stage, in report order
+STAGE_METRICS = ['wall_s', 'cpu_s', 'peak_rss_mib', 'rows_in', 'rows_out', 'bytes_read', 'bytes_written']
+
+# Metrics where an increase is a regression, with the smallest difference that counts (noise floor)
+REGRESSION_FLOORS = {'wall_s': 0.05, 'cpu_s': 0.05, 'peak_rss_mib': 5, 'bytes_read': 2**20, 'bytes_written': 2**20}
+
+_MIB = 2**20
+
+# Profiler of the run in progress (None: profiling off) and stage being run in the current context
+_active_run = None
+_current_stage = contextvars.ContextVar("current_stage", default=None)
+
+
+#----------------------------------------------------------------------------
+# Process counters
+
+def _cpu_seconds():
+    """User + system CPU time of this process and of its finished child processes."""
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def _rss_bytes():
+    """Current resident memory of this process (Linux), or None when it cannot be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _max_rss_bytes():
+    """High-water mark of the process' resident memory (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _io_bytes():
+    """(bytes read, bytes written) through read/write calls of this process, or (None, None)."""
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(":") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, ValueError, KeyError):
+        return None, None
+
+
+#----------------------------------------------------------------------------
+# Run profiler
+
+class RunProfiler:
+    """
+    Records the stages of one run. A background thread samples the process RSS and keeps the peak
+    of every stage in progress.
+
+    Parameters:
+        **meta: Information saved in the report (e.g. output_format, periods).
+    """
+
+    def __init__(self, **meta):
+        self.meta = meta
+        self.stages = []
+        self._open = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._started_at = datetime.now()
+        self._start = time.perf_counter()
+        self._start_cpu = _cpu_seconds()
+        self._peak_rss = _rss_bytes() or 0
+        self._sampler = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+        self._sampler.start()
+
+    def _sample(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            self._update_peaks()
+
+    def _update_peaks(self):
+        rss = _rss_bytes()
+        if rss is None:
+            return
+        with self._lock:
+            self._peak_rss = max(self._peak_rss, rss)
+            for stage in self._open:
+                stage['_peak_rss'] = max(stage['_peak_rss'], rss)
+
+    def begin(self, name, parent=None):
+        """Opens the record of a stage (parent: open record of the stage it is called in)."""
+        bytes_read, bytes_written = _io_bytes()
+        stage = {
+            'name': name,
+            'parent': parent['name'] if parent else None,
+            'concurrent': False,
+            'start_s': time.perf_counter() - self._start,
+            'rows_in': None,
+            'rows_out': None,
+            '_wall': time.perf_counter(),
+            '_cpu': _cpu_seconds(),
+            '_io': (bytes_read, bytes_written),
+            '_peak_rss': _rss_bytes() or 0,
+            '_extra_bytes': [0, 0],
+            '_parent': parent,
+        }
+        ancestors = []
+        while parent is not None:
+            ancestors.append(parent)
+            parent = parent['_parent']
+        with self._lock:
+            # Any other open stage that is not a parent runs beside this one (on another thread): the
+            # process-wide counters of both include the work of the other
+            for other in self._open:
+                if not any(other is ancestor for ancestor in ancestors):
+                    other['concurrent'] = stage['concurrent'] = True
+            self._open.append(stage)
+        return stage
+
+    def end(self, stage, error=None):
+        """Closes the record of a stage and adds it to the run."""
+        self._update_peaks()
+        bytes_read, bytes_written = _io_bytes()
+        start_read, start_written = stage['_io']
+        extra_read, extra_written = stage['_extra_bytes']
+        record = {
+            'name': stage['name'],
+            'parent': stage['parent'],
+            'start_s': round(stage['start_s'], 3),
+            'wall_s': round(time.perf_counter() - stage['_wall'], 3),
+            'cpu_s': round(_cpu_seconds() - stage['_cpu'], 3),
+            'peak_rss_mib': round((stage['_peak_rss'] or _max_rss_bytes()) / _MIB, 1),
+            'rows_in': stage['rows_in'],
+            'rows_out': stage['rows_out'],
+            'bytes_read': None if bytes_read is None else bytes_read - start_read + extra_read,
+            'bytes_written': None if bytes_written is None else bytes_written - start_written + extra_written,
+            'concurrent': stage['concurrent'],
+        }
+        if error is not None:
+            record['error'] = f"{type(error).__name__}: {error}"
+        with self._lock:
+            self._open.remove(stage)
+            self.stages.append(record)
+        return record
+
+    def report(self):
+        """Run report: metadata, totals and the stages in the order they started."""
+        self._update_peaks()
+        return {
+            'started_at': self._started_at.isoformat(timespec="seconds"),
+            'argv': sys.argv,
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'meta': self.meta,
+            'wall_s': round(time.perf_counter() - self._start, 3),
+            'cpu_s': round(_cpu_seconds() - self._start_cpu, 3),
+            'peak_rss_mib': round((self._peak_rss or _max_rss_bytes()) / _MIB, 1),
+            'stages': sorted(self.stages, key=lambda stage: stage['start_s']),
+        }
+
+    def close(self):
+        self._stop.set()
+        self._sampler.join()
+
+
+def start_run(**meta):
+    """Starts profiling the stages called from now on (meta is saved in the report)."""
+    global _active_run
+    if _active_run is not None:
+        _active_run.close()
+    _active_run = RunProfiler(**meta)
+    return _active_run
+
+
+def finish_run(report_path=None):
+    """
+    Stops profiling and returns the run report, also written as JSON to report_path when given.
+    Returns None when no run was being profiled.
+    """
+    global _active_run
+    run, _active_run = _active_run, None
+    if run is None:
+        return None
+    run.close()
+    report = run.report()
+    if report_path:
+        os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Run report saved to {report_path}")
+    return report
+
+
+def record(rows_in=None, rows_out=None, bytes_read=None, bytes_written=None):
+    """
+    Adds counts the decorator cannot see to the stage being run: rows read from files, or bytes read
+    by worker processes (their I/O is not in this process' counters). No-op outside a profiled run.
+    """
+    stage = _current_stage.get()
+    if stage is None or _active_run is None:
+        return
+    for key, value in (('rows_in', rows_in), ('rows_out', rows_out)):
+        if value is not None:
+            stage[key] = (stage[key] or 0) + int(value)
+    if bytes_read:
+        stage['_extra_bytes'][0] += int(bytes_read)
+    if bytes_written:
+        stage['_extra_bytes'][1] += int(bytes_written)
+
+
+def _rows(value):
+    """Rows of a DataFrame, None for anything else."""
+    return len(value) if isinstance(value, pd.DataFrame) else None
+
+
+def profiled_stage(name=None, rows_in=None):
+    """
+    Decorator recording every call of a pipeline stage in the active run.
+
+    Parameters:
+        name (str, optional): Stage name in the report. Default the function name.
+        rows_in (str, optional): Argument holding the input DataFrame when the caller hands it over in
+            memory; its rows are counted as rows_in. Rows read from files are counted with record.
+
+    rows_out is the length of the returned DataFrame, unless the stage recorded it itself.
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            run = _active_run
+            if run is None:
+                return func(*args, **kwargs)
+
+            parent = _current_stage.get()
+            stage = run.begin(stage_name, parent)
+            token = _current_stage.set(stage)
+            try:
+                if rows_in:
+                    record(rows_in=_rows(signature.bind_partial(*args, **kwargs).arguments.get(rows_in)))
+                result = func(*args, **kwargs)
+                if stage['rows_out'] is None:
+                    stage['rows_out'] = _rows(result)
+            except BaseException as error:
+                run.end(stage, error)
+                raise
+            finally:
+                _current_stage.reset(token)
+            run.end(stage)
+            return result
+
+        return wrapper
+    return decorator
+
+
+#----------------------------------------------------------------------------
+# Reports
+
+def load_report(path):
+    """Run report written by finish_run."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def stages_frame(report):
+    """
+    Stages of a run report as a DataFrame, keyed by stage (repeated names get #2, #3...). concurrent
+    is True for the stages that ran beside another one (False in reports made before it was recorded).
+    """
+    df = pd.DataFrame(report['stages'], columns=['name', 'parent', 'start_s', *STAGE_METRICS, 'concurrent'])
+    df['concurrent'] = df['concurrent'].fillna(False).astype(bool)
+    occurrence = df.groupby('name').cumcount() + 1
+    df.insert(0, 'stage', df['name'].where(occurrence == 1, df['name'] + "#" + occurrence.astype(str)))
+    return df
+
+
+def diff_reports(old, new, tolerance=0.10):
+    """
+    Compares the stages of two run reports.
+
+    Parameters:
+        old (dict): Baseline run report.
+        new (dict): Run report to check.
+        tolerance (float): Relative increase of time, memory or bytes tolerated before it is a
+            regression. Default 0.10 (10%).
+
+    Returns:
+        pd.DataFrame: One row per stage and metric: old, new, change (new / old - 1) and regression.
+            Stages present in only one report have a missing old or new.
+    """
+    key_columns = ['stage', 'metric']
+    old_df = stages_frame(old).melt(id_vars='stage', value_vars=STAGE_METRICS, var_name='metric', value_name='old')
+    new_df = stages_frame(new).melt(id_vars='stage', value_vars=STAGE_METRICS, var_name='metric', value_name='new')
+    diff = old_df.merge(new_df, on=key_columns, how='outer', sort=False)
+
+    old_values = pd.to_numeric(diff['old'], errors='coerce')
+    new_values = pd.to_numeric(diff['new'], errors='coerce')
+    diff['change'] = (new_values / old_values.where(old_values != 0) - 1).round(4)
+
+    floors = diff['metric'].map(REGRESSION_FLOORS)
+    diff['regression'] = (floors.notna() & (new_values > old_values * (1 + tolerance))
+                          & (new_values - old_values > floors)).fillna(False).astype(bool)
+    return diff
+
+
+def _format_value(value):
+    if value is None or pd.isna(value):
+        return "-"
+    return f"{value:,.3f}".rstrip("0").rstrip(".") if isinstance(value, float) else f"{int(value):,}"
+
+
+def print_report(report):
+    """Prints the stages of a run report as a table."""
+    df = stages_frame(report)
+    print(f"Run of {report['started_at']}: {report['wall_s']:.2f}s wall, {report['cpu_s']:.2f}s CPU, "
+          f"peak RSS {report['peak_rss_mib']:.0f} MiB")
+    print(f"{'stage':<40}" + "".join(f"{metric:>16}" for metric in STAGE_METRICS))
+    for row in df.itertuples(index=False):
+        indent = "  " if isinstance(row.parent, str) else ""
+        marker = " *" if row.concurrent else ""
+        print(f"{indent + row.stage + marker:<40}" + "".join(f"{_format_value(getattr(row, metric)):>16}"
+                                                              for metric in STAGE_METRICS))
+    if df['concurrent'].any():
+        print("* ran beside other stages on threads: cpu_s, peak_rss_mib and bytes are process-wide and "
+              "include their work")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or compare ETL run reports.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="Print the stages of a run report")
+    show.add_argument("report")
+    diff = commands.add_parser("diff", help="Compare two run reports; exit status 1 on regressions")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    diff.add_argument("--tolerance", type=float, default=0.10, help="Relative increase tolerated (default 0.10)")
+    diff.add_argument("--all", action="store_true", help="Also print the metrics that did not change")
+    args = parser.parse_args()
+
+    if args.command == "show":
+        print_report(load_report(args.report))
+        return 0
+
+    result = diff_reports(load_report(args.old), load_report(args.new), args.tolerance)
+    if not args.all:
+        result = result[result['regression'] | (result['old'].fillna(-1) != result['new'].fillna(-1))]
+    for row in result.itertuples(index=False):
+        change = "" if pd.isna(row.change) else f"{row.change:+.1%}"
+        flag = "  REGRESSION" if row.regression else ""
+        print(f"{row.stage:<40} {row.metric:<14} {_format_value(row.old):>16} -> {_format_value(row.new):>16} "
+              f"{change:>9}{flag}")
+    regressions = int(result['regression'].sum())
+    print(f"{regressions} regression(s) above {args.tolerance:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""
+Query backends of the API datasets: market_metrics, credit_data, financial_metrics and
+financial_metrics_processed.
+
+Every backend answers the same query (rows of a dataset matching column filters and a first year,
+optionally summed by group), so an API endpoint asks for the slice its chart needs instead of
+filtering whole frames:
+
+    - PandasBackend: frames loaded in memory (read_report_csv), filtered with boolean masks. The
+      default, and what the API did before.
+    - SQLiteBackend: the star schema of bacen_data.db (scripts.sqlite_store). Filters and group-bys
+      run in SQLite on the covering indexes of fact_saldo; only the result is loaded.
+    - DuckDBBackend: the partitioned Parquet outputs (scripts.data_lake) read by DuckDB, an embedded
+      columnar engine. Filters are pushed into the Parquet scan (period partitions and row groups are
+      skipped), so a dataset larger than RAM can be served.
+
+make_backend builds one from its name, e.g. from the BACEN_QUERY_BACKEND environment variable.
+"""
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+from scripts.schema import QUARTER_COLUMN, quarter_codes
+
+
+# Dataset -> tables (SQLite) or output files (DuckDB) it is made of
+DATASETS = {
+    'market_metrics': ['market_metrics'],
+    'credit_data': ['cred_pf', 'cred_pj'],
+    'financial_metrics': ['financial_metrics'],
+    'financial_metrics_processed': ['financial_metrics_processed'],
+}
+
+
+class QueryBackend:
+    """Base class: rows of the API datasets, filtered (and aggregated) by the engine."""
+
+    def query(self, dataset, where=None, min_year=None, group_by=None, sum_columns=None):
+        """
+        Rows of a dataset.
+
+        Parameters:
+            dataset (str): One of DATASETS.
+            where (dict, optional): {column: value or [values]} equality / membership filters.
+                AnoMes_Q values are quarter labels ("2024Q3").
+            min_year (int, optional): Only rows with AnoMes in this year or later.
+            group_by (list, optional): Sum sum_columns by these columns (one row per group)
+                instead of returning every row.
+            sum_columns (list, optional): Columns summed with group_by. Default ['Saldo'].
+
+        Returns:
+            pd.DataFrame: The matching rows (or groups), with the columns of the dataset's CSV.
+        """
+        if dataset not in DATASETS:
+            raise KeyError(f"Unknown dataset: {dataset}")
+        where = {col: list(values) if isinstance(values, (list, tuple, set)) else [values]
+                 for col, values in (where or {}).items()}
+        return self._query(dataset, where, min_year, group_by, sum_columns or ['Saldo'])
+
+    def _query(self, dataset, where, min_year, group_by, sum_columns):
+        raise NotImplementedError
+
+
+class PandasBackend(QueryBackend):
+    """
+    Datasets held in memory as frames ({dataset: df}, preferably encoded with read_report_csv).
+    Slices are returned as they are stored (categoricals, integer AnoMes_Q); the plotting
+    functions decode them.
+    """
+
+    def __init__(self, frames):
+        self.frames = frames
+
+    def _query(self, dataset, where, min_year, group_by, sum_columns):
+        df = self.frames[dataset]
+        mask = pd.Series(True, index=df.index)
+        for col, values in where.items():
+            if col == QUARTER_COLUMN and pd.api.types.is_integer_dtype(df[col]):
+                values = quarter_codes(pd.Series(values)).tolist()
+            mask &= df[col].isin(values)
+        if min_year is not None:
+            mask &= self._years(df['AnoMes']) >= min_year
+
+        df = df[mask]
+        if group_by:
+            df = df.groupby(group_by, observed=True, sort=False)[sum_columns].sum().reset_index()
+        return df
+
+    @staticmethod
+    def _years(anomes):
+        """Year of every AnoMes, computed once per category for an encoded column."""
+        if isinstance(anomes.dtype, pd.CategoricalDtype):
+            years = pd.to_datetime(anomes.cat.categories.astype(str)).year.to_numpy()
+            codes = anomes.cat.codes.to_numpy()
+            return pd.Series(years[codes], index=anomes.index).where(codes >= 0)
+        return pd.to_datetime(anomes).dt.year
+
+
+class _SQLBackend(QueryBackend):
+    """SQL generation shared by the SQLite and DuckDB backends."""
+
+    # Columns of a dataset returned for SELECT *
+    SELECT_ALL = "SELECT *"
+
+    def _source(self, dataset):
+        raise NotImplementedError
+
+    def _year_condition(self, dataset, min_year):
+        raise NotImplementedError
+
+    def _read(self, sql, params):
+        raise NotImplementedError
+
+    @staticmethod
+    def _quote(name):
+        return '"' + name.replace('"', '""') + '"'
+
+    def _query(self, dataset, where, min_year, group_by, sum_columns):
+        conditions, params = [], []
+        for col, values in where.items():
+            conditions.append(f"{self._quote(col)} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        if min_year is not None:
+            condition, value = self._year_condition(dataset, min_year)
+            conditions.append(condition)
+            params.append(value)
+
+        if group_by:
+            keys = ", ".join(self._quote(col) for col in group_by)
+            sums = ", ".join(f"SUM({self._quote(col)}) AS {self._quote(col)}" for col in sum_columns)
+            select = f"SELECT {keys}, {sums}"
+        else:
+            select = self.SELECT_ALL
+        sql = f"{select} FROM {self._source(dataset)}"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if group_by:
+            sql += f" GROUP BY {keys}"
+        return self._read(sql, params)
+
+
+class SQLiteBackend(_SQLBackend):
+    """
+    Datasets served from the SQLite database written by save_to_sqlite (views over the star schema
+    and indexed plain tables). Each query opens its own read-only connection, so the backend can be
+    shared by the API's worker threads; in WAL mode queries do not block (nor see) a load in progress.
+    """
+
+    TABLES = {
+        'market_metrics': 'market_metrics',
+        'credit_data': 'credit_data',
+        'financial_metrics': 'financial_metrics',
+        'financial_metrics_processed': 'financial_metrics_processed',
+    }
+
+    def __init__(self, db_path="../data/bacen_data.db"):
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(db_path)
+        self.db_path = db_path
+
+    def _source(self, dataset):
+        return self._quote(self.TABLES[dataset])
+
+    def _year_condition(self, dataset, min_year):
+        # AnoMes is stored as YYYY-MM-DD text
+        return "AnoMes >= ?", str(min_year)
+
+    def _read(self, sql, params):
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            return pd.read_sql_query(sql, conn, params=params)
+        finally:
+            conn.close()
+
+
+class DuckDBBackend(_SQLBackend):
+    """
+    Datasets served by DuckDB from the Parquet tables of data_dir (the ETL's "parquet" output
+    format). Requires the duckdb package.
+    """
+
+    def __init__(self, data_dir="../data"):
+        import duckdb
+
+        self.data_dir = data_dir
+        self._conn = duckdb.connect()
+        self._lock = threading.Lock()
+
+    # Periodo, the partition column of the Parquet tables, is only used for filtering
+    SELECT_ALL = "SELECT * EXCLUDE (Periodo)"
+
+    def _source(self, dataset):
+        scans = []
+        for table in DATASETS[dataset]:
+            path = os.path.join(self.data_dir, f"{table}.parquet").replace("'", "''")
+            scans.append(f"SELECT * FROM read_parquet('{path}/**/*.parquet', hive_partitioning = true, "
+                         "union_by_name = true)")
+        return "(" + " UNION ALL BY NAME ".join(scans) + ")"
+
+    def _year_condition(self, dataset, min_year):
+        # On the partition column, so DuckDB skips the files of earlier periods
+        return "Periodo >= ?", int(min_year) * 100
+
+    def _read(self, sql, params):
+        # One cursor per query: a DuckDB connection is not shared between threads
+        with self._lock:
+            cursor = self._conn.cursor()
+        try:
+            return self._as_csv_schema(cursor.execute(sql, params).df())
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _as_csv_schema(df):
+        """
+        Query result with the columns and dtypes the SQLite backend returns (those of the CSV
+        outputs): dates as "YYYY-MM-DD" text, CodInst as text, AnoMes_Y (stored as text when written
+        from a period) as a number, and NumeroRelatorio, which the Hive scan appends as a partition
+        column, back after NomeRelatorio.
+        """
+        for col in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[col]):
+                df[col] = df[col].dt.strftime('%Y-%m-%d')
+            elif col == 'CodInst' and not pd.api.types.is_string_dtype(df[col]):
+                df[col] = df[col].astype(str).where(df[col].notna())
+            elif col == 'AnoMes_Y' and pd.api.types.is_string_dtype(df[col]):
+                df[col] = pd.to_numeric(df[col])
+
+        columns = list(df.columns)
+        if 'NumeroRelatorio' in columns and 'NomeRelatorio' in columns:
+            columns.remove('NumeroRelatorio')
+            columns.insert(columns.index('NomeRelatorio') + 1, 'NumeroRelatorio')
+            df = df[columns]
+        return df
+
+
+def make_backend(name="pandas", **options):
+    """
+    Query backend by name: "pandas" (options: frames), "sqlite" (db_path) or "duckdb" (data_dir).
+    """
+    backends = {'pandas': PandasBackend, 'sqlite': SQLiteBackend, 'duckdb': DuckDBBackend}
+    if name not in backends:
+        raise ValueError(f"Invalid query backend: {name}")
+    return backends[name](**options)
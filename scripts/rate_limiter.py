@@ -0,0 +1,202 @@
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+import requests
+
+
+# HTTP status codes that mean "slow down / try again later"
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket shared by every request sent to the BACEN Olinda API.
+
+    Requests take one token each; tokens refill at `rate` per second up to `burst`.
+    The rate adapts to the server (AIMD): every successful response raises it by
+    `increase_step` up to `max_rate`, every 429/5xx multiplies it by `decrease_factor`
+    down to `min_rate`. A Retry-After header pauses the whole bucket until it expires.
+
+    Parameters:
+        rate (float): Initial requests per second. Default 5.
+        burst (int): Bucket capacity, i.e. requests allowed back to back. Default 5.
+        min_rate (float): Lower bound for the adapted rate. Default 0.2.
+        max_rate (float): Upper bound for the adapted rate. Default 50.
+        increase_step (float): Rate added after each success. Default 0.5.
+        decrease_factor (float): Rate multiplier after each 429/5xx. Default 0.5.
+        backoff_base (float): Base delay (s) of the exponential backoff. Default 1.
+        backoff_max (float): Maximum backoff delay (s). Default 60.
+    """
+
+    def __init__(
+        self,
+        rate=5.0,
+        burst=5,
+        min_rate=0.2,
+        max_rate=50.0,
+        increase_step=0.5,
+        decrease_factor=0.5,
+        backoff_base=1.0,
+        backoff_max=60.0
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+        # Counters for the download logs
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+
+    def acquire(self):
+        """Blocks until a token is available (and any Retry-After pause is over)."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+
+                if now >= self._blocked_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    self.requests += 1
+                    return
+
+                wait = max(self._blocked_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def record_success(self):
+        """Additive increase of the rate after a successful response."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def record_throttle(self, retry_after=None):
+        """Multiplicative decrease of the rate after a 429/5xx, pausing the bucket for retry_after seconds."""
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self._tokens = min(self._tokens, 1.0)
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+    def record_retry(self):
+        """Counts a retried request."""
+        with self._lock:
+            self.retries += 1
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff for the given attempt (1-based), never shorter than retry_after."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after:
+            delay = max(delay, retry_after)
+        return delay
+
+    def stats(self):
+        """Summary of the limiter state for logging."""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'throttled': self.throttled,
+                'retries': self.retries,
+                'rate': round(self.rate, 2)
+            }
+
+
+def parse_retry_after(response):
+    """
+    Returns the Retry-After header of response in seconds, or None.
+    Supports both the delta-seconds and the HTTP-date forms.
+    """
+    if response is None:
+        return None
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def request_with_backoff(send, rate_limiter, max_retries=3, description="request"):
+    """
+    Sends a request through rate_limiter, retrying network errors, 429 and 5xx responses
+    with jittered exponential backoff.
+
+    Parameters:
+        send (callable): Function without arguments returning a requests.Response.
+        rate_limiter (AdaptiveRateLimiter): Limiter shared by all Olinda requests.
+        max_retries (int): Retries allowed before giving up. Default 3.
+        description (str): Label used in the log messages (e.g. the period).
+
+    Returns:
+        requests.Response: The successful response.
+
+    Raises:
+        requests.exceptions.RequestException: If the request still fails after max_retries
+        retries, or immediately on a non-retryable HTTP error (e.g. 404).
+    """
+    attempt = 0
+    while True:
+        rate_limiter.acquire()
+        retry_after = None
+        try:
+            response = send()
+            response.raise_for_status()
+            rate_limiter.record_success()
+            return response
+
+        except requests.exceptions.HTTPError as e:
+            status_code = e.response.status_code if e.response is not None else None
+            if status_code not in RETRYABLE_STATUS_CODES:
+                raise
+            retry_after = parse_retry_after(e.response)
+            rate_limiter.record_throttle(retry_after)
+            e.response.close()  # Release the connection of a streamed response
+            error = e
+
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            error = e
+
+        attempt += 1
+        if attempt > max_retries:
+            raise error
+
+        delay = rate_limiter.backoff_delay(attempt, retry_after)
+        rate_limiter.record_retry()
+        logging.warning(f"Retrying {description}... ({attempt}/{max_retries}) in {delay:.1f}s: {error}")
+        time.sleep(delay)
+
+
+# Limiter shared by all Olinda requests of the process
+_DEFAULT_RATE_LIMITER = None
+_DEFAULT_RATE_LIMITER_LOCK = threading.Lock()
+
+
+def get_default_rate_limiter():
+    """Returns the process-wide AdaptiveRateLimiter used when a fetcher is not given one."""
+    global _DEFAULT_RATE_LIMITER
+    with _DEFAULT_RATE_LIMITER_LOCK:
+        if _DEFAULT_RATE_LIMITER is None:
+            _DEFAULT_RATE_LIMITER = AdaptiveRateLimiter()
+        return _DEFAULT_RATE_LIMITER
@@ -0,0 +1,232 @@
+"""
+Column schema of the raw IF.data reports (IfDataValores) shared by the fetch and ETL layers.
+"""
+import numpy as np
+import pandas as pd
+
+
+# Integer columns of the raw reports; every other column is kept as string
+RAW_REPORT_INT_COLUMNS = ['TipoInstituicao', 'AnoMes', 'NumeroRelatorio']
+
+# Float columns, delivered by the API with a decimal comma ("1234,56")
+RAW_REPORT_DECIMAL_COLUMNS = ['Saldo']
+
+# Low-cardinality string columns (a few thousand distinct values over millions of rows),
+# held as pandas categoricals by the ETL
+RAW_REPORT_CATEGORY_COLUMNS = ['CodInst', 'NomeRelatorio', 'Grupo', 'Conta', 'NomeColuna', 'DescricaoColuna']
+
+# Repeated string columns of the cleaned report and of the tables derived from it (market_metrics,
+# credit_data, financial_metrics, financial_metrics_processed), held as categoricals in memory
+REPORT_CATEGORY_COLUMNS = [
+    'NomeInstituicao', 'NomeRelatorio', 'Grupo', 'NomeColuna', 'DescricaoColuna', 'NomeRelatorio_Grupo_Coluna',
+    'ComponentType', 'Component',
+    # Period labels ("2024-09-01", "2024-09"); AnoMes_Y is read as an int already
+    'AnoMes', 'AnoMes_M'
+]
+
+# Column held as an integer quarter code (year * 10 + quarter, "2024Q3" -> 20243) in memory
+QUARTER_COLUMN = 'AnoMes_Q'
+
+
+def parse_decimal_comma(series):
+    """Converts a Brazilian-format number column (comma as decimal separator) to float."""
+    if series.dtype != object and not pd.api.types.is_string_dtype(series):
+        return series.astype(float)
+    return series.str.replace(',', '.').astype(float)
+
+
+def period_keys(anomes):
+    """AnoMes values in any of the formats of the ETL outputs (201303, "2013-03-01", Timestamp) as YYYYMM ints."""
+    if pd.api.types.is_datetime64_any_dtype(anomes):
+        return anomes.dt.year * 100 + anomes.dt.month
+    return anomes.astype(str).str.replace('-', '', regex=False).str[:6].astype(int)
+
+
+def normalize_raw_report(df):
+    """
+    Types a raw report frame read with its columns as strings (or categoricals):
+        - Saldo converted from decimal comma to float
+        - CodInst zero-padded to 8 digits
+        - TipoInstituicao, AnoMes and NumeroRelatorio as nullable integers
+
+    Returns:
+        pd.DataFrame: The same frame, typed in place.
+    """
+    for col in RAW_REPORT_DECIMAL_COLUMNS:
+        if col in df.columns:
+            df[col] = parse_decimal_comma(df[col])
+
+    for col in RAW_REPORT_INT_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+
+    if 'CodInst' in df.columns:
+        codinst = df['CodInst']
+        padded = None
+        if isinstance(codinst.dtype, pd.CategoricalDtype):
+            # Pad the categories only, unless padding would merge two of them
+            padded = codinst.cat.categories.astype(str).str.zfill(8)
+        if padded is not None and padded.is_unique:
+            df['CodInst'] = codinst.cat.rename_categories(padded)
+        else:
+            df['CodInst'] = codinst.astype(str).str.zfill(8)
+
+    return df
+
+
+def read_raw_report_csv(path):
+    """
+    Reads a raw report CSV (as downloaded, or a combined report written by the ETL) with an
+    explicit schema: low-cardinality strings straight into categoricals (CodInst keeps its
+    zeros) and Saldo parsed by the C parser with a decimal comma. Files with a decimal point
+    in Saldo (the ETL's own output) come back as strings there; normalize_raw_report converts
+    them and types the integer ids.
+    """
+    dtype = {col: 'category' for col in RAW_REPORT_CATEGORY_COLUMNS}
+    df = pd.read_csv(path, dtype=dtype, decimal=',', encoding='utf-8')
+    return normalize_raw_report(df)
+
+
+def to_categories(df, columns=RAW_REPORT_CATEGORY_COLUMNS):
+    """Converts the given string columns of df (when present) to categoricals, in place."""
+    for col in columns:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+
+def concat_categorical(frames, columns=RAW_REPORT_CATEGORY_COLUMNS):
+    """
+    Concatenates frames whose categorical columns have different categories. pd.concat would
+    fall back to object dtype for those columns; aligning every frame on the union of the
+    categories first keeps them categorical (only the small category arrays are merged).
+    """
+    for col in columns:
+        if all(col in df.columns for df in frames):
+            categories = set()
+            for df in frames:
+                categories.update(to_categories(df, [col])[col].cat.categories)
+            dtype = pd.CategoricalDtype(sorted(categories))
+            for df in frames:
+                df[col] = df[col].astype(dtype)
+    return pd.concat(frames, ignore_index=True)
+
+
+def join_columns(df, columns, sep='_'):
+    """
+    df[columns[0]] + sep + df[columns[1]] + ... as a categorical, with the strings built once per
+    distinct combination of values instead of once per row. Missing when any part is missing.
+    """
+    parts = [df[col] if isinstance(df[col].dtype, pd.CategoricalDtype) else df[col].astype('category')
+             for col in columns]
+
+    # One integer key per combination of category codes (0 for a missing part)
+    keys = np.zeros(len(df), dtype='int64')
+    for part in parts:
+        keys = keys * (len(part.cat.categories) + 1) + (part.cat.codes.to_numpy() + 1)
+    positions, unique_keys = pd.factorize(keys)
+
+    # Decode each distinct key back to its parts and build its label
+    labels = pd.Series('', index=range(len(unique_keys)), dtype=object)
+    missing = np.zeros(len(unique_keys), dtype=bool)
+    for i, part in enumerate(reversed(parts)):
+        size = len(part.cat.categories) + 1
+        codes = unique_keys % size - 1
+        unique_keys = unique_keys // size
+        missing |= codes < 0
+        values = np.asarray(part.cat.categories.astype(str), dtype=object)[np.maximum(codes, 0)]
+        labels = values + (sep if i else '') + labels
+    labels[missing] = np.nan
+
+    # Two combinations can give the same label ("a_b" + "c", "a" + "b_c")
+    label_codes, categories = pd.factorize(labels)
+    return pd.Series(pd.Categorical.from_codes(label_codes[positions], categories=categories), index=df.index)
+
+
+def quarter_codes(values):
+    """
+    Quarters ("2024Q3" labels or quarterly Periods) as int32 codes year * 10 + quarter (20243),
+    which sort in time order. Labels are parsed once per distinct value.
+    """
+    values = pd.Series(values)
+    if isinstance(values.dtype, pd.PeriodDtype):
+        return (values.dt.year * 10 + values.dt.quarter).astype('int32')
+
+    labels = values.astype('category').cat
+    quarters = pd.PeriodIndex(labels.categories.astype(str), freq='Q')
+    keys = np.asarray(quarters.year * 10 + quarters.quarter, dtype='int32')
+    codes = labels.codes.to_numpy()
+    if (codes < 0).any():
+        # Missing quarters kept as <NA>
+        return pd.Series(keys[codes], index=values.index).astype('Int32').mask(codes < 0)
+    return pd.Series(keys[codes], index=values.index)
+
+
+def quarter_labels(codes):
+    """Integer quarter codes (see quarter_codes) back to their "2024Q3" labels."""
+    codes = pd.Series(codes)
+    positions, uniques = pd.factorize(codes)
+    labels = np.array([f"{code // 10}Q{code % 10}" for code in uniques] + [np.nan], dtype=object)
+    # factorize marks missing values with -1, the position of the trailing NaN
+    return pd.Series(labels[positions], index=codes.index)
+
+
+def encode_report_frame(df, columns=REPORT_CATEGORY_COLUMNS):
+    """
+    Dictionary-encodes a report frame in place: the given string columns (when present) as
+    categoricals and AnoMes_Q as an integer quarter code. Filters such as
+    df[df['NomeInstituicao'].isin([...])] work unchanged on the encoded frame; see
+    decode_report_frame for the slices handed to code expecting plain strings.
+
+    Returns:
+        pd.DataFrame: The same frame, encoded.
+    """
+    to_categories(df, columns)
+    if QUARTER_COLUMN in df.columns and not pd.api.types.is_integer_dtype(df[QUARTER_COLUMN]):
+        df[QUARTER_COLUMN] = quarter_codes(df[QUARTER_COLUMN])
+    return df
+
+
+def decode_report_frame(df):
+    """
+    Copy of an encoded report frame (usually a small filtered slice) with the dtypes it has when
+    read by pd.read_csv: categoricals as plain strings and AnoMes_Q as "2024Q3" labels.
+    """
+    conversions = {col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)}
+    df = df.astype(conversions) if conversions else df.copy()
+    if QUARTER_COLUMN in df.columns and pd.api.types.is_integer_dtype(df[QUARTER_COLUMN]):
+        df[QUARTER_COLUMN] = quarter_labels(df[QUARTER_COLUMN])
+    return df
+
+
+def read_report_csv(path, **read_csv_kwargs):
+    """
+    Canonical load path of the cleaned report and the derived tables: the repeated string
+    columns are parsed straight into categoricals (see REPORT_CATEGORY_COLUMNS) and AnoMes_Q
+    is stored as an integer quarter code, instead of one Python string object per cell.
+    Other columns are inferred as pd.read_csv does.
+    """
+    dtype = {col: 'category' for col in REPORT_CATEGORY_COLUMNS}
+    dtype.update(read_csv_kwargs.pop('dtype', None) or {})
+    df = pd.read_csv(path, dtype=dtype, **read_csv_kwargs)
+    return encode_report_frame(df, columns=[])
+
+
+def memory_usage(df):
+    """Bytes held by df, including the Python string objects of object columns."""
+    return int(df.memory_usage(deep=True).sum())
+
+
+def raw_report_arrow_schema(columns):
+    """pyarrow schema for a raw report with the given columns (ints, floats, strings otherwise)."""
+    import pyarrow as pa
+
+    fields = []
+    for col in columns:
+        if col in RAW_REPORT_INT_COLUMNS:
+            fields.append(pa.field(col, pa.int64()))
+        elif col in RAW_REPORT_DECIMAL_COLUMNS:
+            fields.append(pa.field(col, pa.float64()))
+        else:
+            fields.append(pa.field(col, pa.string()))
+    return pa.schema(fields)
@@ -0,0 +1,339 @@
+"""
+SQLite storage of the ETL outputs (bacen_data.db) as a star schema.
+
+The report tables are normalized into one fact table and three dimensions:
+
+    fact_saldo(inst_id, metric_id, period_id, Saldo)                    one row per report line
+    dim_institution(inst_id, TipoInstituicao, CodInst, NomeInstituicao)
+    dim_metric(metric_id, NumeroRelatorio, NomeRelatorio, Grupo, Conta, NomeColuna, DescricaoColuna,
+               NomeRelatorio_Grupo_Coluna)
+    dim_period(period_id, AnoMes, AnoMes_M, AnoMes_Q, AnoMes_Y)         period_id is YYYYMM
+
+consolidated_reports (the cleaned report) fills fact_saldo. The derived report tables (credit_pf,
+credit_pj, market_metrics) are the rows of consolidated_reports of some metrics, so only their
+metric ids are stored, in metric_set(name, metric_id). Every report table is also a view with the
+columns of its CSV, so "SELECT * FROM market_metrics WHERE AnoMes_Q = '2024Q3'" keeps working, and
+credit_data is the view of credit_pf and credit_pj together.
+
+fact_saldo has covering indexes on (metric, period) and (institution, metric), so "one metric over
+time" and "one institution's metrics" queries are answered from an index alone. The database runs
+in WAL mode and every save is bulk loaded in a single transaction: readers keep seeing the
+previous data until it commits.
+
+Other tables (institutions, financial_metrics, financial_metrics_processed) are stored as plain
+tables, with the indexes of PLAIN_TABLE_INDEXES.
+"""
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from scripts.schema import period_keys
+
+
+# Report table loaded into fact_saldo
+FACT_SOURCE_TABLE = 'consolidated_reports'
+
+# Report tables that are the rows of FACT_SOURCE_TABLE of some metrics, stored in metric_set
+METRIC_SET_TABLES = ['credit_pf', 'credit_pj', 'market_metrics']
+
+# Views over several report tables
+COMBINED_VIEWS = {'credit_data': ['credit_pf', 'credit_pj']}
+
+# Indexes of the plain tables the API filters on: {table: [[column, ...], ...]}
+PLAIN_TABLE_INDEXES = {
+    'financial_metrics': [['NomeInstituicao', 'NomeColuna']],
+    'financial_metrics_processed': [['NomeInstituicao', 'AnoMes_Q'], ['NomeInstituicao', 'Component']],
+}
+
+# Columns of the report tables (consolidated_cleaned.csv and its subsets), in file order
+REPORT_COLUMNS = [
+    'TipoInstituicao', 'CodInst', 'AnoMes', 'NomeRelatorio', 'NumeroRelatorio', 'Grupo', 'Conta',
+    'NomeColuna', 'DescricaoColuna', 'Saldo', 'AnoMes_M', 'AnoMes_Q', 'AnoMes_Y',
+    'NomeRelatorio_Grupo_Coluna', 'NomeInstituicao'
+]
+
+# Dimension table: (id column, [(column, SQL type), ...]); a row per distinct combination
+DIMENSIONS = {
+    'dim_institution': ('inst_id', [
+        ('TipoInstituicao', 'INTEGER'), ('CodInst', 'TEXT'), ('NomeInstituicao', 'TEXT')
+    ]),
+    'dim_metric': ('metric_id', [
+        ('NumeroRelatorio', 'INTEGER'), ('NomeRelatorio', 'TEXT'), ('Grupo', 'TEXT'), ('Conta', 'INTEGER'),
+        ('NomeColuna', 'TEXT'), ('DescricaoColuna', 'TEXT'), ('NomeRelatorio_Grupo_Coluna', 'TEXT')
+    ]),
+}
+
+PERIOD_COLUMNS = [('AnoMes', 'TEXT'), ('AnoMes_M', 'TEXT'), ('AnoMes_Q', 'TEXT'), ('AnoMes_Y', 'INTEGER')]
+
+# Covering indexes of fact_saldo
+FACT_INDEXES = {
+    'ix_fact_metric_period': ['metric_id', 'period_id', 'inst_id', 'Saldo'],
+    'ix_fact_institution_metric': ['inst_id', 'metric_id', 'period_id', 'Saldo'],
+}
+
+# Fact rows sent to executemany at a time
+INSERT_BATCH_SIZE = 100_000
+
+STAR_TABLES = ['fact_saldo', 'dim_institution', 'dim_metric', 'dim_period', 'metric_set']
+
+
+def connect(db_path):
+    """
+    Connection to db_path in WAL mode (readers are not blocked by a load) with transactions
+    managed explicitly (see write_tables).
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def has_star_schema(db_path):
+    """True when db_path exists and holds the star schema (a database of a previous run to update)."""
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    except sqlite3.OperationalError:
+        return False
+    try:
+        names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        conn.close()
+    return set(STAR_TABLES) <= names
+
+
+def is_report_table(name, df):
+    """True for the tables stored in the star schema: the cleaned report and its metric subsets."""
+    return name in [FACT_SOURCE_TABLE] + METRIC_SET_TABLES and set(REPORT_COLUMNS) <= set(df.columns)
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _sql_values(df):
+    """Rows of df as tuples of Python values (None for missing), as sqlite3 binds them."""
+    values = df.astype(object)
+    return list(values.where(df.notna(), None).itertuples(index=False, name=None))
+
+
+def _drop(conn, name):
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+    if row:
+        conn.execute(f"DROP {row[0].upper()} {_quote(name)}")
+
+
+def _create_star_schema(conn):
+    for table, (id_column, columns) in DIMENSIONS.items():
+        definitions = ", ".join(f"{_quote(col)} {sql_type}" for col, sql_type in columns)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({id_column} INTEGER PRIMARY KEY, {definitions}, "
+                     f"UNIQUE ({', '.join(_quote(col) for col, _ in columns)}))")
+    definitions = ", ".join(f"{_quote(col)} {sql_type}" for col, sql_type in PERIOD_COLUMNS)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS dim_period (period_id INTEGER PRIMARY KEY, {definitions})")
+    conn.execute("CREATE TABLE IF NOT EXISTS metric_set (name TEXT NOT NULL, metric_id INTEGER NOT NULL, "
+                 "PRIMARY KEY (name, metric_id)) WITHOUT ROWID")
+    conn.execute("CREATE TABLE IF NOT EXISTS fact_saldo (inst_id INTEGER NOT NULL, metric_id INTEGER NOT NULL, "
+                 "period_id INTEGER NOT NULL, Saldo REAL)")
+
+
+def _create_fact_indexes(conn):
+    for index, columns in FACT_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {index} ON fact_saldo ({', '.join(columns)})")
+
+
+def _report_view_sql(name):
+    """SELECT of the report table name (consolidated_reports or a metric set) with its CSV columns."""
+    sources = {col: 'i' for col, _ in DIMENSIONS['dim_institution'][1]}
+    sources.update({col: 'm' for col, _ in DIMENSIONS['dim_metric'][1]})
+    sources.update({col: 'p' for col, _ in PERIOD_COLUMNS})
+    sources['Saldo'] = 'f'
+    sql = (f"SELECT {', '.join(f'{sources[col]}.{_quote(col)}' for col in REPORT_COLUMNS)} "
+           "FROM fact_saldo f "
+           "JOIN dim_institution i ON i.inst_id = f.inst_id "
+           "JOIN dim_metric m ON m.metric_id = f.metric_id "
+           "JOIN dim_period p ON p.period_id = f.period_id")
+    if name != FACT_SOURCE_TABLE:
+        sql += f" WHERE f.metric_id IN (SELECT metric_id FROM metric_set WHERE name = '{name}')"
+    return sql
+
+
+def _dimension_ids(conn, dimension, df):
+    """
+    Ids in dimension of every row of df, adding the combinations of values not stored yet.
+
+    The distinct combinations (a few thousand) go through a temporary table, so the values are
+    matched by SQLite with the column types of the dimension, NULLs included.
+    """
+    id_column, columns = DIMENSIONS[dimension]
+    names = [col for col, _ in columns]
+    keys = df[names]
+
+    # Code of each row's combination, in order of first appearance like drop_duplicates
+    codes = keys.groupby(names, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+    combinations = keys.drop_duplicates()
+
+    definitions = ", ".join(f"{_quote(col)} {sql_type}" for col, sql_type in columns)
+    conn.execute("DROP TABLE IF EXISTS temp._keys")
+    conn.execute(f"CREATE TEMP TABLE _keys (_code INTEGER PRIMARY KEY, {definitions})")
+    conn.executemany(f"INSERT INTO _keys VALUES ({', '.join('?' * (len(names) + 1))})",
+                     [(code, *row) for code, row in enumerate(_sql_values(combinations))])
+
+    match = " AND ".join(f"d.{_quote(col)} IS k.{_quote(col)}" for col in names)
+    column_list = ", ".join(_quote(col) for col in names)
+    conn.execute(f"INSERT INTO {dimension} ({column_list}) "
+                 f"SELECT DISTINCT {', '.join(f'k.{_quote(col)}' for col in names)} FROM _keys k "
+                 f"WHERE NOT EXISTS (SELECT 1 FROM {dimension} d WHERE {match}) ORDER BY k._code")
+
+    lookup = np.zeros(len(combinations), dtype='int64')
+    for code, dimension_id in conn.execute(f"SELECT k._code, d.{id_column} FROM _keys k JOIN {dimension} d ON {match}"):
+        lookup[code] = dimension_id
+    conn.execute("DROP TABLE temp._keys")
+    return lookup[codes]
+
+
+def _as_text(series):
+    """Dates as YYYY-MM-DD and periods as their labels, as written in the CSV outputs."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.dt.strftime('%Y-%m-%d')
+    if isinstance(series.dtype, (pd.PeriodDtype, pd.CategoricalDtype)):
+        return series.astype(str).where(series.notna())
+    return series
+
+
+def _period_ids(conn, df):
+    """YYYYMM period id of every row of df, storing the labels of its periods in dim_period."""
+    period_ids = period_keys(df['AnoMes']).astype('int64')
+    columns = [col for col, _ in PERIOD_COLUMNS]
+    periods = pd.DataFrame({col: _as_text(df[col]) for col in columns}).assign(period_id=period_ids.to_numpy())
+    periods = periods.drop_duplicates('period_id')[['period_id'] + columns]
+    conn.executemany(f"INSERT OR REPLACE INTO dim_period VALUES ({', '.join('?' * (len(columns) + 1))})",
+                     _sql_values(periods))
+    return period_ids.to_numpy()
+
+
+def _insert_facts(conn, df):
+    inst_ids = _dimension_ids(conn, 'dim_institution', df)
+    metric_ids = _dimension_ids(conn, 'dim_metric', df)
+    period_ids = _period_ids(conn, df)
+    saldo = df['Saldo'].astype(float).to_numpy()
+
+    for start in range(0, len(df), INSERT_BATCH_SIZE):
+        end = start + INSERT_BATCH_SIZE
+        conn.executemany("INSERT INTO fact_saldo VALUES (?, ?, ?, ?)", zip(
+            inst_ids[start:end].tolist(), metric_ids[start:end].tolist(),
+            period_ids[start:end].tolist(), saldo[start:end].tolist()
+        ))
+
+
+def _insert_metric_set(conn, name, df):
+    metric_ids = np.unique(_dimension_ids(conn, 'dim_metric', df))
+    conn.executemany("INSERT OR IGNORE INTO metric_set VALUES (?, ?)", [(name, int(i)) for i in metric_ids])
+
+
+def _sql_type(series):
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_integer_dtype(series):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(series):
+        return 'REAL'
+    return 'TEXT'
+
+
+def _write_plain_table(conn, name, df, periods=None, replace_existing=True):
+    """
+    Stores df as a plain table. With periods (incremental mode), its rows of those AnoMes are
+    replaced in the existing table instead of the whole table.
+    """
+    df = df.apply(_as_text)
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+    if periods is None or not exists or 'AnoMes' not in df.columns:
+        _drop(conn, name)
+        definitions = ", ".join(f"{_quote(col)} {_sql_type(df[col])}" for col in df.columns)
+        conn.execute(f"CREATE TABLE {_quote(name)} ({definitions})")
+    elif replace_existing:
+        conn.execute(
+            f"DELETE FROM {_quote(name)} "
+            f"WHERE CAST(substr(replace(AnoMes, '-', ''), 1, 6) AS INTEGER) IN ({', '.join('?' * len(periods))})",
+            [int(period) for period in periods]
+        )
+    conn.executemany(f"INSERT INTO {_quote(name)} ({', '.join(_quote(col) for col in df.columns)}) "
+                     f"VALUES ({', '.join('?' * len(df.columns))})", _sql_values(df))
+
+    for i, columns in enumerate(PLAIN_TABLE_INDEXES.get(name, [])):
+        if set(columns) <= set(df.columns):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {_quote(f'ix_{name}_{i}')} ON {_quote(name)} "
+                         f"({', '.join(_quote(col) for col in columns)})")
+
+
+def _create_combined_views(conn):
+    """Views of COMBINED_VIEWS whose tables all exist."""
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+    for view, tables in COMBINED_VIEWS.items():
+        if set(tables) <= names:
+            _drop(conn, view)
+            conn.execute(f"CREATE VIEW {_quote(view)} AS "
+                         + " UNION ALL ".join(f"SELECT * FROM {_quote(table)}" for table in tables))
+
+
+def write_tables(conn, tables, periods=None, replace_existing=True, partial_tables=None):
+    """
+    Bulk loads tables in a single transaction.
+
+    Report tables go to the star schema: consolidated_reports to fact_saldo, the other ones to
+    metric_set, each with a view of the same name. Other tables are stored as plain tables.
+
+    Parameters:
+        conn (sqlite3.Connection): Connection from connect().
+        tables (dict or iterable): {table_name: pd.DataFrame}, or (table_name, pd.DataFrame) pairs,
+            e.g. a generator loading one file at a time.
+        periods (list, optional): Incremental mode: the frames only hold the rows of these AnoMes
+            (YYYYMM), which replace the rows of the same periods. Default None replaces everything
+            (the star schema is rebuilt and its indexes created after the load).
+        replace_existing (bool): With periods, whether the database may already hold rows of them.
+        partial_tables (set, optional): With periods, the tables whose frames only hold the rows of
+            periods; the other ones are complete and replace their table. Default None: all of them.
+    """
+    items = tables.items() if isinstance(tables, dict) else tables
+    star_schema_ready = False
+
+    conn.execute("BEGIN")
+    try:
+        for name, df in items:
+            table_periods = periods if partial_tables is None or name in partial_tables else None
+            if not is_report_table(name, df):
+                _write_plain_table(conn, name, df, table_periods, replace_existing)
+                continue
+
+            if not star_schema_ready:
+                if periods is None:
+                    for table in STAR_TABLES:
+                        _drop(conn, table)
+                _create_star_schema(conn)
+                star_schema_ready = True
+
+            if name == FACT_SOURCE_TABLE:
+                if table_periods is None:
+                    conn.execute("DELETE FROM fact_saldo")
+                elif replace_existing:
+                    conn.execute(f"DELETE FROM fact_saldo WHERE period_id IN ({', '.join('?' * len(periods))})",
+                                 [int(period) for period in periods])
+                _insert_facts(conn, df)
+            else:
+                if table_periods is None:
+                    conn.execute("DELETE FROM metric_set WHERE name = ?", (name,))
+                _insert_metric_set(conn, name, df)
+            _drop(conn, name)
+            conn.execute(f"CREATE VIEW {_quote(name)} AS {_report_view_sql(name)}")
+
+        if star_schema_ready:
+            # Built once over the loaded rows on a full load, rather than maintained row by row
+            _create_fact_indexes(conn)
+        _create_combined_views(conn)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+    # Statistics for the query planner, outside the load transaction
+    if star_schema_ready:
+        conn.execute("ANALYZE")